@@ -55,3 +55,187 @@ insert into rss_sources (name, url, category) values
   ('OpenAI Blog', 'https://openai.com/blog/rss.xml', 'AI Research'),
   ('VentureBeat AI', 'https://venturebeat.com/category/ai-strategy/feed/', 'Negocios')
 on conflict (url) do nothing;
+
+-- 5. Caché HTTP de feeds (GET condicional)
+-- El ingestor envía If-None-Match / If-Modified-Since y omite feeds sin cambios.
+alter table rss_sources add column if not exists etag text;
+alter table rss_sources add column if not exists last_modified text;
+alter table rss_sources add column if not exists content_hash text; -- sha256 del último cuerpo procesado
+
+-- 6. Marca de agua por fuente (ingesta incremental)
+-- Última entrada procesada: solo se ingieren artículos más nuevos.
+alter table rss_sources add column if not exists last_entry_id text; -- GUID o link
+alter table rss_sources add column if not exists last_entry_published timestamptz;
+
+-- 7. Casi-duplicados (SimHash)
+-- Una tendencia canónica por noticia; las copias de otros medios quedan como fuentes alternativas.
+alter table trends add column if not exists fingerprint text; -- SimHash 64 bits en hex
+alter table trends add column if not exists alternate_sources jsonb default '[]'::jsonb; -- [{source, url}]
+create index if not exists trends_fingerprint_idx on trends (fingerprint);
+
+-- 8. Salud de fuentes y circuit breaker
+-- Fuentes con fallos consecutivos se suspenden con backoff exponencial hasta circuit_open_until.
+alter table rss_sources add column if not exists last_success_at timestamptz;
+alter table rss_sources add column if not exists last_error text;
+alter table rss_sources add column if not exists consecutive_failures int default 0;
+alter table rss_sources add column if not exists circuit_open_until timestamptz;
+alter table rss_sources add column if not exists latency_samples jsonb default '[]'::jsonb; -- últimas N latencias (ms)
+alter table rss_sources add column if not exists latency_p50_ms int;
+alter table rss_sources add column if not exists latency_p95_ms int;
+alter table rss_sources add column if not exists last_bytes int;
+alter table rss_sources add column if not exists last_entry_count int;
+
+-- 9. Ejecuciones batch (scheduler)
+-- Metadatos de cada corrida de ingesta o matching lanzada por src/scheduler.py.
+create table if not exists runs (
+  id bigint primary key generated always as identity,
+  kind text not null, -- 'ingest' | 'matching'
+  status text not null default 'running', -- running | completed | failed
+  params jsonb default '{}'::jsonb,
+  started_at timestamptz default now(),
+  finished_at timestamptz,
+  duration_s numeric,
+  items int default 0, -- tendencias guardadas u oportunidades detectadas
+  errors jsonb default '[]'::jsonb -- mensajes de error de la corrida
+);
+create index if not exists runs_kind_started_idx on runs (kind, started_at desc);
+
+-- 10. Ledger de pares evaluados (matching incremental)
+-- Cada par cliente-tendencia evaluado por Gemini, con huellas de sus entradas:
+-- el matcher solo reevalúa pares nuevos o cuyo contexto, tendencia, modelo o prompt cambiaron.
+create table if not exists match_ledger (
+  id bigint primary key generated always as identity,
+  client_key text not null, -- id del cliente (o nombre)
+  trend_key text not null, -- url de la tendencia
+  client_hash text not null, -- sha256 del contexto del cliente usado en el prompt
+  trend_hash text not null, -- sha256 del título + resumen
+  model text,
+  prompt_version text,
+  match_score int,
+  evaluated_at timestamptz default now(),
+  unique (client_key, trend_key)
+);
+create index if not exists match_ledger_client_idx on match_ledger (client_key);
+
+-- 11. Resumen estructurado del contexto del cliente
+-- Perfil compacto (stack, dolores, objetivos) generado una vez desde tech_context_raw;
+-- se regenera solo cuando cambia el hash del texto crudo.
+alter table clients add column if not exists context_digest jsonb;
+alter table clients add column if not exists context_digest_hash text;
+alter table clients add column if not exists context_digest_at timestamptz;
+
+-- 12. Uso de Gemini por llamada (tokens, latencia, costo)
+-- Una fila por llamada a generate_content (o acierto de caché), etiquetada con corrida, sitio y cliente/tendencia.
+create table if not exists llm_calls (
+  id bigint primary key generated always as identity,
+  run_id bigint references runs(id) on delete set null,
+  site text not null, -- match | match_batch | digest | tech_context | relevance | relevance_batch
+  model text,
+  client_keys jsonb default '[]'::jsonb, -- clientes cubiertos por la llamada
+  trend_key text,
+  prompt_tokens int default 0,
+  output_tokens int default 0,
+  total_tokens int default 0,
+  latency_ms int,
+  wait_s numeric default 0, -- espera por cuota antes de la llamada
+  cost_usd numeric default 0,
+  cached boolean default false,
+  estimated boolean default false, -- tokens estimados (sin usage_metadata)
+  created_at timestamptz default now()
+);
+create index if not exists llm_calls_run_idx on llm_calls (run_id);
+create index if not exists llm_calls_created_idx on llm_calls (created_at desc);
+
+-- 13. Corridas de matching con checkpoints (reanudables)
+-- Cada par evaluado se guarda al terminar (oportunidad + ledger con run_id) y el avance queda en runs.progress.
+-- Una corrida en 'running' sin checkpoint reciente quedó interrumpida (sesión cerrada) y se puede reanudar.
+alter table runs add column if not exists progress jsonb; -- {"total", "done", "opportunities", "errors"}
+alter table runs add column if not exists checkpoint_at timestamptz;
+alter table match_ledger add column if not exists run_id bigint references runs(id) on delete set null;
+alter table opportunities add column if not exists run_id bigint references runs(id) on delete set null;
+create index if not exists match_ledger_run_idx on match_ledger (run_id);
+create index if not exists runs_status_idx on runs (kind, status);
+
+-- 14. Cola de trabajos en segundo plano (ingesta y matching fuera de Streamlit)
+-- El dashboard encola; los workers (python src/jobs.py) toman trabajos con claim_job y publican su avance en job_events.
+create table if not exists jobs (
+  id bigint primary key generated always as identity,
+  kind text not null, -- ingest | matching | resume
+  params jsonb default '{}'::jsonb,
+  dedupe_key text not null, -- sha256 de (kind, params): un mismo trabajo no se encola dos veces
+  status text not null default 'queued', -- queued | running | completed | failed | cancelled
+  cancel_requested boolean default false,
+  worker text,
+  run_id bigint references runs(id) on delete set null,
+  error text,
+  created_at timestamptz default now(),
+  started_at timestamptz,
+  heartbeat_at timestamptz, -- último latido del worker (detecta workers caídos)
+  finished_at timestamptz
+);
+-- Deduplicación: a lo sumo un trabajo pendiente o en curso por clave
+create unique index if not exists jobs_dedupe_active_idx on jobs (dedupe_key) where status in ('queued', 'running');
+create index if not exists jobs_status_created_idx on jobs (status, created_at);
+
+create table if not exists job_events (
+  id bigint primary key generated always as identity,
+  job_id bigint references jobs(id) on delete cascade,
+  type text not null, -- log | partial | pitch_* | run | result
+  message text,
+  data jsonb,
+  created_at timestamptz default now()
+);
+create index if not exists job_events_job_idx on job_events (job_id, id);
+
+-- Toma el trabajo en cola más antiguo si hay menos de p_max_running en curso.
+-- Los trabajos sin latido por p_stale_seconds se dan por fallidos (worker caído).
+create or replace function claim_job(p_worker text, p_max_running int default 2, p_stale_seconds int default 600)
+returns setof jobs
+language plpgsql
+as $$
+begin
+  -- Serializa las tomas para que el tope de concurrencia sea exacto
+  perform pg_advisory_xact_lock(hashtext('claim_job'));
+
+  update jobs set status = 'failed', error = 'Worker sin latido', finished_at = now()
+  where status = 'running' and heartbeat_at < now() - make_interval(secs => p_stale_seconds);
+
+  if (select count(*) from jobs where status = 'running') >= p_max_running then
+    return;
+  end if;
+
+  return query
+  update jobs set status = 'running', worker = p_worker, started_at = now(), heartbeat_at = now()
+  where id = (select id from jobs where status = 'queued' order by created_at limit 1 for update skip locked)
+  returning *;
+end;
+$$;
+
+-- 15. Paginación por clave del feed y de las tendencias
+-- fetch_opportunities_page / fetch_trends_page ordenan por (fecha, id) descendente y siguen desde un cursor:
+-- cada página es una búsqueda en el índice, sin OFFSET ni traer el texto largo.
+create index if not exists opportunities_feed_idx on opportunities (created_at desc, id desc);
+create index if not exists opportunities_client_feed_idx on opportunities (client_name, created_at desc, id desc);
+create index if not exists trends_source_published_idx on trends (source, published_at desc, id desc);
+
+-- 16. Tendencias de fuentes activas en una sola consulta
+-- trends se une a rss_sources por clave (source_id) y no por el nombre de la fuente (texto editable).
+alter table trends add column if not exists source_id bigint references rss_sources(id) on delete set null;
+-- Backfill de las tendencias anteriores a la columna (por nombre, una sola vez)
+update trends t set source_id = s.id from rss_sources s where t.source_id is null and t.source = s.name;
+create index if not exists trends_source_id_idx on trends (source_id);
+create index if not exists trends_published_idx on trends (published_at desc);
+
+-- fetch_trends(active_only=True): la página de tendencias activas en un solo viaje (order + limit sobre la vista).
+-- Recrear la vista si se agregan columnas a trends (t.* se expande al crearla).
+-- Left join: las tendencias sin source_id (migradas, de fuentes borradas o guardadas fuera del ingestor) no se pierden;
+-- solo se excluyen las de fuentes pausadas.
+create or replace view active_trends as
+  select t.*
+  from trends t
+  left join rss_sources s on s.id = t.source_id
+  where s.id is null or s.is_active;
+
+-- 17. Cuota de Gemini reportada por los workers
+-- Cada worker tiene su propio limitador: su estado viaja con el latido del trabajo para mostrarlo en el dashboard.
+alter table jobs add column if not exists throttle jsonb;
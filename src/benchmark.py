@@ -0,0 +1,253 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import time
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import fake_gemini
+import ingestor as ingestor_module
+import llm_client
+import matcher as matcher_module
+import rate_limiter
+from memory_db import InMemoryDatabase
+from scheduler import consume_events
+
+INDUSTRIES = ["Minería", "Banca / Finanzas", "Retail / E-commerce", "Salud", "Energía", "Logística"]
+TOPICS = ["IA generativa", "migración cloud", "lago de datos", "ciberseguridad zero trust", "automatización RPA",
+          "gemelos digitales", "edge computing", "modernización legacy", "observabilidad", "APIs abiertas"]
+
+# Escenarios de matching: nombre -> opciones del OpportunityMatcher
+SCENARIOS = {
+    "secuencial": {},
+    "concurrente": {"max_concurrency": 8},
+    "lote": {"max_concurrency": 8, "batch_clients": True},
+    "cascada": {"max_concurrency": 8, "cascade": True},
+    "cache": {"max_concurrency": 8, "warm_cache": True},
+    "streaming": {"max_concurrency": 8, "stream_pitch": True},
+}
+
+# Primer dato útil para ventas: una oportunidad completa o, en streaming, el primer puntaje
+INSIGHT_EVENTS = ("partial", "pitch_score")
+
+def build_dataset(clients=10, sources=6, entries_per_source=20, client_sources=2, seed=0):
+    """
+    Datos sintéticos reproducibles: clientes con contexto crudo, fuentes RSS (algunas exclusivas de un cliente)
+    y el XML de cada feed.
+    """
+    rnd = random.Random(seed)
+    client_rows = []
+    for i in range(clients):
+        topics = rnd.sample(TOPICS, 3)
+        client_rows.append({
+            "id": i + 1,
+            "name": f"Cliente {i + 1:03d}",
+            "industry": INDUSTRIES[i % len(INDUSTRIES)],
+            "tech_context_raw": f"Empresa del sector {INDUSTRIES[i % len(INDUSTRIES)]}. Invierte en {', '.join(topics)}. " * 20
+        })
+
+    source_rows, feeds = [], {}
+    now = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    for s in range(sources):
+        url = f"https://feeds{s % 3}.example.com/source-{s}.xml"
+        client_id = client_rows[s % len(client_rows)]["id"] if s < client_sources and client_rows else None
+        source_rows.append({"id": 100 + s, "name": f"Fuente {s}", "url": url, "category": "Benchmark", "client_id": client_id, "is_active": True})
+        items = []
+        for e in range(entries_per_source):
+            topic = rnd.choice(TOPICS)
+            items.append(f"""
+            <item>
+              <title>{topic.capitalize()}: caso {s}-{e} en {rnd.choice(INDUSTRIES)}</title>
+              <link>https://news.example.com/{s}/{e}</link>
+              <guid>https://news.example.com/{s}/{e}</guid>
+              <description>Empresas adoptan {topic} para reducir costos; análisis {s}-{e} con cifras {rnd.randint(1, 99)}%.</description>
+              <pubDate>{format_datetime(now - timedelta(hours=s * entries_per_source + e))}</pubDate>
+            </item>""")
+        feeds[url] = f"""<?xml version="1.0"?><rss version="2.0"><channel><title>Fuente {s}</title>{''.join(items)}</channel></rss>""".encode("utf-8")
+    return {"clients": client_rows, "sources": source_rows, "feeds": feeds}
+
+class FakeFeedSession:
+    """
+    Reemplazo de requests.Session para el ingestor: sirve los feeds sintéticos con latencia fija.
+    """
+    def __init__(self, feeds, latency_ms=0):
+        self.feeds = feeds
+        self.latency_ms = latency_ms
+        self.headers = {}
+        self.requests = 0
+
+    def get(self, url, timeout=None, headers=None):
+        self.requests += 1
+        time.sleep(self.latency_ms / 1000)
+        if url not in self.feeds:
+            return SimpleNamespace(status_code=404, content=b"", headers={})
+        return SimpleNamespace(status_code=200, content=self.feeds[url], headers={})
+
+@contextlib.contextmanager
+def offline(db, rpm=100_000, tpm=100_000_000, base_backoff=0.05, quiet=True, **fake_config):
+    """
+    Conecta matcher e ingestor al Gemini falso y a la base en memoria, con limitador y caché LLM propios.
+    Restaura todo al salir.
+    """
+    fake = fake_gemini.install(**fake_config)
+    patched = [
+        (matcher_module, "genai", fake_gemini), (ingestor_module, "genai", fake_gemini),
+        (matcher_module, "DatabaseClient", lambda: db), (ingestor_module, "DatabaseClient", lambda: db),
+        (rate_limiter, "_shared_limiter", rate_limiter.RateLimiter(rpm=rpm, tpm=tpm, base_backoff=base_backoff, max_backoff=1.0)),
+        (llm_client, "_shared_cache", llm_client.LLMCache(":memory:")),
+    ]
+    previous = [(module, name, getattr(module, name)) for module, name, _ in patched]
+    previous_key = os.environ.get("GEMINI_API_KEY")
+    for module, name, value in patched:
+        setattr(module, name, value)
+    os.environ["GEMINI_API_KEY"] = previous_key or "offline-benchmark"
+    try:
+        with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+            yield fake
+    finally:
+        for module, name, value in previous:
+            setattr(module, name, value)
+        if previous_key is None:
+            os.environ.pop("GEMINI_API_KEY", None)
+
+def _report(name, wall, units, unit_name, fake, **extra):
+    stats = fake.stats()
+    return dict({
+        "scenario": name,
+        "wall_s": round(wall, 3),
+        unit_name: units,
+        f"{unit_name}_per_s": round(units / wall, 2) if wall > 0 else None,
+        "gemini_calls": stats["calls"],
+        "errors_429": stats["errors_429"],
+        "calls_by_kind": stats["by_kind"],
+        "prompt_tokens": stats["prompt_tokens"],
+        "output_tokens": stats["output_tokens"],
+    }, **extra)
+
+def bench_ingest(dataset, feed_latency_ms=20, parse_workers=0, **offline_config):
+    """
+    Ingesta end-to-end (descarga, parseo, dedup, relevancia IA, guardado) contra feeds y Gemini falsos.
+    """
+    db = InMemoryDatabase(clients=dataset["clients"], sources=dataset["sources"])
+    with offline(db, **offline_config) as fake:
+        ingestor = ingestor_module.InnovationIngestor(parse_workers=parse_workers)
+        ingestor.session = FakeFeedSession(dataset["feeds"], feed_latency_ms)
+        started = time.perf_counter()
+        trends, errors = consume_events(ingestor.fetch_trends(), log=lambda m: None)
+        if trends:
+            ingestor.save_trends(trends)
+        wall = time.perf_counter() - started
+    return _report("ingesta", wall, len(trends), "trends", fake, sources=len(dataset["sources"]), errors=len(errors)), db
+
+def bench_matching(db, name, options, trend_limit=10, **offline_config):
+    """
+    Un ciclo de matching completo (contexto, pares, ledger, guardado) sobre una copia de la base.
+    """
+    options = dict(options)
+    warm_cache = options.pop("warm_cache", False)
+    db = InMemoryDatabase(clients=db.fetch_clients(), sources=db.fetch_rss_sources(), trends=db.trends)
+    with offline(db, **offline_config) as fake:
+        if warm_cache:
+            # Primera pasada solo para poblar el caché LLM; se mide la segunda
+            consume_events(matcher_module.OpportunityMatcher(**options).run_matching_cycle(trend_limit=trend_limit), log=lambda m: None)
+            db.match_ledger.clear()
+            fake.reset()
+        matcher = matcher_module.OpportunityMatcher(**options)
+        started = time.perf_counter()
+        first_insight = []
+
+        def timed(events):
+            for event in events:
+                if event["type"] in INSIGHT_EVENTS and not first_insight:
+                    first_insight.append(time.perf_counter() - started)
+                yield event
+
+        matches, errors = consume_events(timed(matcher.run_matching_cycle(trend_limit=trend_limit)), log=lambda m: None)
+        if matches:
+            matcher.save_opportunities(matches)
+        wall = time.perf_counter() - started
+        cache = matcher.llm.cache_stats()
+    return _report(name, wall, len(db.match_ledger), "pairs", fake, opportunities=len(matches),
+                   cache_hits=cache["hits"], errors=len(errors),
+                   first_insight_s=round(first_insight[0], 3) if first_insight else None)
+
+def run_benchmarks(args):
+    fake_config = {"latency_ms": args.latency_ms, "latency": args.latency, "jitter": args.jitter,
+                   "rate_429": args.rate_429, "ms_per_output_token": args.ms_per_output_token, "seed": args.seed}
+    offline_config = dict(fake_config, rpm=args.rpm, quiet=not args.verbose)
+    dataset = build_dataset(clients=args.clients, sources=args.sources, entries_per_source=args.entries, seed=args.seed)
+
+    reports = []
+    ingest_report, db = bench_ingest(dataset, feed_latency_ms=args.feed_latency_ms, parse_workers=args.parse_workers, **offline_config)
+    reports.append(ingest_report)
+    for name in args.scenarios:
+        reports.append(bench_matching(db, name, SCENARIOS[name], trend_limit=args.trend_limit, **offline_config))
+    return reports
+
+def print_reports(reports):
+    print(f"{'escenario':<14}{'wall (s)':>10}{'1er (s)':>9}{'items':>8}{'items/s':>10}{'llamadas':>10}{'429':>6}{'tok in':>10}{'tok out':>10}")
+    for r in reports:
+        units = r.get("pairs", r.get("trends"))
+        rate = r.get("pairs_per_s", r.get("trends_per_s"))
+        first = f"{r['first_insight_s']:.2f}" if r.get("first_insight_s") is not None else "-"
+        print(f"{r['scenario']:<14}{r['wall_s']:>10.2f}{first:>9}{units:>8}{rate or 0:>10.1f}{r['gemini_calls']:>10}{r['errors_429']:>6}{r['prompt_tokens']:>10}{r['output_tokens']:>10}")
+
+def check_regressions(reports, baseline, tolerance):
+    """
+    Compara el throughput (items/s) contra una corrida base. Retorna la lista de regresiones.
+    """
+    previous = {r["scenario"]: r for r in baseline}
+    regressions = []
+    for r in reports:
+        base = previous.get(r["scenario"])
+        key = "pairs_per_s" if "pairs_per_s" in r else "trends_per_s"
+        if base and base.get(key) and r.get(key) is not None and r[key] < base[key] * (1 - tolerance):
+            regressions.append(f"{r['scenario']}: {r[key]} {key} (base {base[key]})")
+    return regressions
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="InnovA Radar: benchmark offline de ingesta y matching (Gemini y Supabase simulados).")
+    parser.add_argument("--clients", type=int, default=10)
+    parser.add_argument("--sources", type=int, default=6)
+    parser.add_argument("--entries", type=int, default=20, help="Entradas por feed")
+    parser.add_argument("--trend-limit", type=int, default=10, help="Tendencias por cliente")
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--latency-ms", type=float, default=300, help="Latencia media de Gemini simulada")
+    parser.add_argument("--latency", choices=["fixed", "uniform", "lognormal"], default="lognormal")
+    parser.add_argument("--jitter", type=float, default=0.5)
+    parser.add_argument("--ms-per-output-token", type=float, default=0.0, help="Costo de latencia por token generado")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Probabilidad de responder 429")
+    parser.add_argument("--rpm", type=int, default=100_000, help="Cuota del limitador durante el benchmark")
+    parser.add_argument("--feed-latency-ms", type=float, default=20)
+    parser.add_argument("--parse-workers", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Guardar los resultados en este archivo")
+    parser.add_argument("--baseline", help="JSON de una corrida anterior para detectar regresiones")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Caída de throughput tolerada vs. la base")
+    parser.add_argument("--verbose", action="store_true", help="Mostrar los logs de ingestor y matcher")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    reports = run_benchmarks(args)
+    print_reports(reports)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=2, ensure_ascii=False)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = check_regressions(reports, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"❌ Regresión: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
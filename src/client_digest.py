@@ -0,0 +1,128 @@
+import hashlib
+import json
+
+from llm_client import is_json, parse_json
+from rate_limiter import estimate_tokens
+
+DIGEST_VERSION = "digest-v1" # Subirla al cambiar el prompt o el formato: regenera todos los resúmenes
+DEFAULT_DIGEST_TOKENS = 300
+RAW_CONTEXT_CHARS = 12000 # Texto crudo máximo que se envía a resumir (una sola vez por cambio)
+STACK_KEYS = ("cloud", "backend", "frontend", "data")
+
+def digest_hash(raw_context, token_budget=DEFAULT_DIGEST_TOKENS):
+    """
+    Huella de las entradas del resumen: si cambia el texto crudo, la versión o el presupuesto, se regenera.
+    """
+    payload = json.dumps([raw_context or "", DIGEST_VERSION, token_budget], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def is_fresh(client, token_budget=DEFAULT_DIGEST_TOKENS):
+    return bool(client.get('context_digest')) and client.get('context_digest_hash') == digest_hash(client.get('tech_context_raw'), token_budget)
+
+def _clean_list(values):
+    if not isinstance(values, list):
+        return []
+    return [str(v).strip() for v in values if str(v).strip()]
+
+def normalize_digest(data):
+    """
+    Lleva la respuesta del LLM a la forma de client_db.json: tech_stack, pain_points, strategic_goals.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("El resumen debe ser un objeto JSON")
+    stack = data.get("tech_stack") if isinstance(data.get("tech_stack"), dict) else {}
+    return {
+        "industry": str(data.get("industry") or "").strip(),
+        "tech_stack": {key: _clean_list(stack.get(key)) for key in STACK_KEYS},
+        "pain_points": _clean_list(data.get("pain_points")),
+        "strategic_goals": _clean_list(data.get("strategic_goals"))
+    }
+
+def digest_to_text(digest):
+    """
+    Representación compacta del resumen para los prompts del matcher.
+    """
+    lines = []
+    if digest.get("industry"):
+        lines.append(f"Industria: {digest['industry']}")
+    stack = "; ".join(f"{key}: {', '.join(items)}" for key, items in digest.get("tech_stack", {}).items() if items)
+    if stack:
+        lines.append(f"Stack: {stack}")
+    if digest.get("pain_points"):
+        lines.append("Dolores: " + " | ".join(digest["pain_points"]))
+    if digest.get("strategic_goals"):
+        lines.append("Objetivos: " + " | ".join(digest["strategic_goals"]))
+    return "\n".join(lines)
+
+def fit_to_budget(digest, token_budget):
+    """
+    Recorta el último elemento de la lista más larga hasta que el texto quepa en token_budget.
+    """
+    digest = json.loads(json.dumps(digest))
+    while estimate_tokens(digest_to_text(digest)) > token_budget:
+        lists = [digest["pain_points"], digest["strategic_goals"]] + list(digest["tech_stack"].values())
+        longest = max(lists, key=len)
+        if not longest:
+            break
+        longest.pop()
+    return digest
+
+class ClientDigester:
+    """
+    Condensa una vez el contexto crudo de cada cliente (scraping de ClientEnricher) en un perfil
+    estructurado y acotado en tokens, que el matcher reutiliza en cada prompt.
+    """
+    def __init__(self, llm, token_budget=DEFAULT_DIGEST_TOKENS):
+        self.llm = llm
+        self.token_budget = token_budget
+
+    def digest(self, client):
+        raw = (client.get('tech_context_raw') or '')[:RAW_CONTEXT_CHARS]
+        prompt = f"""
+        ACTÚA COMO: Analista de Cuentas TI en una Consultora de Software.
+        OBJETIVO: Condensar el siguiente texto crudo (extraído de la web, puede traer ruido) en un perfil tecnológico del cliente {client.get('name')} (Industria: {client.get('industry') or 'Desconocida'}).
+
+        TEXTO CRUDO:
+        "{raw}"
+
+        INSTRUCCIONES:
+        1. Ignora menús, avisos legales y texto sin relación con tecnología o negocio.
+        2. Frases cortas y concretas; máximo 5 elementos por lista. No inventes datos.
+        3. El perfil completo no debe superar ~{self.token_budget} tokens.
+
+        FORMATO DE SALIDA (JSON Estricto):
+        {{
+            "industry": "<industria>",
+            "tech_stack": {{"cloud": [], "backend": [], "frontend": [], "data": []}},
+            "pain_points": ["..."],
+            "strategic_goals": ["..."]
+        }}
+        """
+        text = self.llm.generate(prompt, generation_config={"response_mime_type": "application/json"}, cache_if=is_json,
+                                 site="digest", tags={"client_keys": [client.get('id') or client.get('name')]})
+        return fit_to_budget(normalize_digest(parse_json(text)), self.token_budget)
+
+    def refresh(self, clients, db=None):
+        """
+        Regenera los resúmenes vencidos (texto crudo distinto al resumido) y los guarda en clients.
+        Actualiza cada dict en memoria. Generador de eventos log; retorna cuántos se regeneraron.
+        """
+        refreshed = 0
+        for client in clients:
+            if not client.get('tech_context_raw') or is_fresh(client, self.token_budget):
+                continue
+            yield {"type": "log", "message": f"🧾 Resumiendo contexto de {client.get('name')}..."}
+            try:
+                digest = self.digest(client)
+            except Exception as e:
+                yield {"type": "log", "message": f"⚠️ No se pudo resumir {client.get('name')}, se usa el texto crudo: {e}"}
+                continue
+            client['context_digest'] = digest
+            client['context_digest_hash'] = digest_hash(client.get('tech_context_raw'), self.token_budget)
+            refreshed += 1
+            if db is not None and client.get('id') is not None:
+                try:
+                    db.update_client_digest(client['id'], digest, client['context_digest_hash'])
+                except Exception as e:
+                    yield {"type": "log", "message": f"⚠️ No se pudo guardar el resumen de {client.get('name')}: {e}"}
+        return refreshed
@@ -4,6 +4,7 @@ import pandas as pd
 import sys
 import os
 import time
+from datetime import datetime, timezone
 
 # Asegurar que podemos importar los módulos locales
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -11,11 +12,20 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from db_client import DatabaseClient
 from matcher import OpportunityMatcher
 from profile_enricher import ClientEnricher
-from ingestor import InnovationIngestor
+from feed_health import circuit_open_until, parse_timestamp
+from client_digest import digest_to_text, is_fresh
+from usage import summarize_calls
+from jobs import JobQueue
 
 # Configuración de página - Debe ser lo primero
 st.set_page_config(page_title="InnovA Radar", page_icon="📡", layout="wide")
 
+RUN_STALE_S = 300 # Una corrida 'running' sin checkpoint en este lapso se considera interrumpida
+JOB_POLL_S = 2 # Cada cuánto la página consulta el avance de sus trabajos
+JOB_LOG_TAIL = 30 # Últimos logs del trabajo que se muestran
+FEED_PAGE_SIZE = 10 # Tarjetas por página del feed (paginación por clave en la base)
+TRENDS_PAGE_SIZE = 25 # Filas por página del listado de tendencias ingeridas
+
 # --- FUNCIONES DE PAGINAS ---
 
 def render_sidebar():
@@ -23,7 +33,7 @@ def render_sidebar():
     st.sidebar.caption("Enterprise Innovation System")
     
     # Navegación Principal
-    page = st.sidebar.radio("Navegación", ["Radar de Oportunidades", "Gestión de Datos", "Fuentes de Información"])
+    page = st.sidebar.radio("Navegación", ["Radar de Oportunidades", "Gestión de Datos", "Fuentes de Información", "Consumo IA"])
     
     st.sidebar.divider()
     
@@ -31,9 +41,203 @@ def render_sidebar():
     st.sidebar.caption("Estado del Sistema")
     st.sidebar.markdown("✅ **Database**: *Connected*")
     st.sidebar.markdown("✅ **AI Engine**: *Ready*")
+    render_worker_throttle()
     
     return page
 
+def render_worker_throttle():
+    """
+    Cuota de Gemini según la reportan los workers en su latido (el limitador vive en cada proceso worker).
+    """
+    try:
+        running = JobQueue().db.fetch_jobs(statuses=("running",), limit=5)
+    except Exception as e:
+        st.sidebar.caption(f"⏱️ Cuota Gemini: sin datos de los workers ({e})")
+        return
+    reported = [job for job in running if job.get("throttle")]
+    if not reported:
+        st.sidebar.caption("⏱️ Cuota Gemini: sin trabajos en curso.")
+        return
+    for job in reported:
+        throttle = job["throttle"]
+        st.sidebar.caption(f"⏱️ #{job['id']} ({job['kind']}): {throttle['requests_available']:.0f}/{throttle['rpm']} req · efectivo {throttle['effective_rpm']} RPM · espera acumulada {throttle['total_wait']:.0f}s")
+
+def enqueue_job(kind, params, session_key):
+    """
+    Encola un trabajo (o se engancha al idéntico ya pendiente) y lo sigue desde esta sesión.
+    """
+    try:
+        job = JobQueue().enqueue(kind, params)
+    except Exception as e:
+        st.error(f"❌ No se pudo encolar el trabajo: {e}")
+        return None
+    if job["deduplicated"]:
+        st.info(f"⏳ Ya hay un trabajo idéntico pendiente (#{job['id']}); se muestra su avance.")
+    else:
+        st.toast(f"📥 Trabajo #{job['id']} encolado.")
+    st.session_state[session_key] = {"id": job["id"], "after": 0, "logs": [], "cards": {}, "found": [], "items": None}
+    return job
+
+def apply_job_event(tracked, event):
+    # Acumula en la sesión los eventos publicados por el worker (logs y tarjetas de streaming)
+    tracked["after"] = event["id"]
+    kind, data = event["type"], event.get("data") or {}
+    if kind == "log":
+        tracked["logs"].append(event["message"])
+    elif kind == "result":
+        tracked["items"] = data.get("items", 0)
+    elif kind == "partial":
+        tracked.setdefault("found", []).append(data)
+    elif kind == "pitch_start":
+        tracked["cards"][data["key"]] = dict(data)
+    elif kind in ("pitch_score", "pitch_reasoning", "pitch_delta", "pitch_end"):
+        card = tracked["cards"].get(data.get("key"))
+        if card is None:
+            return
+        if kind == "pitch_delta":
+            # Solo llega el tramo nuevo: el texto se arma aquí
+            card["text"] = card.get("text", "") + data["delta"]
+        else:
+            card.update(data)
+        if kind == "pitch_end":
+            card["done"] = True
+            # Sin match (o con error) la tarjeta parcial se retira
+            if card.get("error") or (card.get("match_score") or 0) <= 10:
+                tracked["cards"].pop(data["key"])
+
+def render_live_pitch(card):
+    """
+    Tarjeta parcial de un par en análisis (modo streaming).
+    """
+    score = card.get("match_score")
+    with st.container(border=True):
+        header = f"**{score}%**" if score is not None else "_calculando puntaje..._"
+        st.markdown(f"**{card['client']}** × {card['trend']} — {header}")
+        for r in card.get("reasoning", []):
+            st.markdown(f"- {r}")
+        if card.get("text"):
+            st.info(card["text"] if card.get("done") else card["text"] + " ▌")
+
+@st.fragment(run_every=JOB_POLL_S)
+def render_job_progress(session_key, title):
+    """
+    Avance del trabajo seguido por esta sesión: se consulta cada JOB_POLL_S sin bloquear la página.
+    """
+    tracked = st.session_state.get(session_key)
+    if not tracked:
+        return
+    queue = JobQueue()
+    try:
+        job = queue.get(tracked["id"])
+        for event in queue.events(tracked["id"], after_id=tracked["after"]):
+            apply_job_event(tracked, event)
+    except Exception as e:
+        st.caption(f"⚠️ No se pudo consultar el trabajo #{tracked['id']}: {e}")
+        return
+    if job is None:
+        st.session_state.pop(session_key, None)
+        return
+
+    status = job["status"]
+    active = status in ("queued", "running")
+    labels = {"queued": "⏳ En cola", "running": "⚙️ En curso", "completed": "✅ Completado", "failed": "❌ Fallido", "cancelled": "🛑 Cancelado"}
+    items = f" · {tracked['items']} resultados" if tracked["items"] is not None else ""
+    state = "running" if active else "complete" if status == "completed" else "error"
+    with st.status(f"{title} #{job['id']}: {labels.get(status, status)}{items}", state=state, expanded=active):
+        if status == "queued":
+            st.write("Esperando un worker libre (`python src/jobs.py`)...")
+        for message in tracked["logs"][-JOB_LOG_TAIL:]:
+            st.write(message)
+        for card in tracked["cards"].values():
+            render_live_pitch(card)
+        found = sorted(tracked.get("found", []), key=lambda op: -(op.get("match_score") or 0))
+        if found:
+            # Hallazgos hasta ahora, los mejores arriba (en modo anytime llegan primero los más prometedores)
+            st.markdown(f"**🏆 Oportunidades encontradas ({len(found)})**")
+            for op in found[:10]:
+                st.markdown(f"- **{op.get('match_score')}%** · {op.get('client')} × {op.get('trend')}")
+        if job.get("error"):
+            st.caption(f"Error: {job['error']}")
+
+    if active:
+        if st.button("🛑 Cancelar", key=f"cancel_{session_key}"):
+            queue.cancel(job["id"])
+            st.toast(f"Cancelación pedida para el trabajo #{job['id']}.")
+    elif not tracked.get("finished"):
+        # Al terminar se recarga la página completa una vez (feed y corridas actualizados)
+        tracked["finished"] = True
+        st.rerun(scope="app")
+    elif st.button("Cerrar", key=f"close_{session_key}"):
+        st.session_state.pop(session_key, None)
+        st.rerun(scope="app")
+
+def render_resumable_runs(stream=True):
+    """
+    Corridas de matching en curso, interrumpidas (sin checkpoint reciente), fallidas o canceladas; salvo las en curso, se pueden reanudar.
+    """
+    try:
+        runs = DatabaseClient().fetch_resumable_runs("matching", limit=5)
+    except Exception as e:
+        st.caption(f"⚠️ No se pudieron leer las corridas pendientes: {e}")
+        return
+    if not runs:
+        return
+
+    resume = None
+    now = datetime.now(timezone.utc)
+    with st.expander(f"⏯️ Corridas en curso o interrumpidas ({len(runs)})"):
+        for run in runs:
+            progress = run.get("progress") or {}
+            total, done = progress.get("total") or 0, progress.get("done") or 0
+            last_activity = parse_timestamp(run.get("checkpoint_at") or run.get("started_at"))
+            active = run["status"] == "running" and last_activity is not None and (now - last_activity).total_seconds() < RUN_STALE_S
+            state = "🟢 En curso" if active else {"failed": "🔴 Fallida", "cancelled": "⚪ Cancelada"}.get(run["status"], "🟠 Interrumpida")
+            params = run.get("params") or {}
+
+            c1, c2 = st.columns([4, 1])
+            with c1:
+                st.markdown(f"**#{run['id']}** · {state} · {params.get('client') or 'Todos'} · {params.get('trend_limit', '?')} tendencias por cliente")
+                st.progress(min(done / total, 1.0) if total else 0.0,
+                            text=f"{done}/{total} pares · {progress.get('opportunities', 0)} oportunidades guardadas")
+            with c2:
+                if not active and st.button("⏯️ Reanudar", key=f"resume_{run['id']}"):
+                    resume = run
+
+    if resume:
+        enqueue_job("resume", {"run_id": resume["id"], "stream_pitch": stream}, "matching_job")
+
+def render_opportunity_detail(db, opportunity_id):
+    """
+    Pitch y razones de una oportunidad (texto largo), pedidos al abrir su tarjeta y guardados en la sesión.
+    """
+    details = st.session_state.setdefault("opportunity_details", {})
+    if opportunity_id not in details:
+        try:
+            details[opportunity_id] = db.fetch_opportunity_detail(opportunity_id) or {}
+        except Exception as e:
+            st.caption(f"⚠️ No se pudo cargar el detalle: {e}")
+            return
+    op = details[opportunity_id]
+
+    # Full Content (Pitch)
+    st.markdown("#### Sales Pitch")
+    st.info(op.get('generated_pitch'))
+
+    # Reasoning
+    st.markdown("#### Por qué es relevante")
+    reasoning = op.get('reasoning')
+    if isinstance(reasoning, str):
+        try:
+            reasoning = json.loads(reasoning)
+        except:
+            pass
+
+    if isinstance(reasoning, list):
+        for r in reasoning:
+            st.markdown(f"- {r}")
+    else:
+        st.markdown(str(reasoning))
+
 def page_opportunities():
     
     # --- Top Actions Row & Selector ---
@@ -51,56 +255,63 @@ def page_opportunities():
     with c2:
         selected_client_filter = st.selectbox("📂 Filtrar Análisis/Vista:", ["Todos"] + all_client_names)
         trend_limit_val = st.slider("Límite de Tendencias", min_value=1, max_value=20, value=5, help="Define cuántas noticias analizar por cliente")
+        prefilter_val = st.toggle("🧭 Pre-filtro semántico local", value=True, help="Envía a Gemini solo las tendencias más afines al contexto de cada cliente")
+        incremental_val = st.toggle("📒 Solo pares nuevos o modificados", value=True, help="Omite pares cliente-tendencia ya evaluados con el mismo contexto (ledger)")
+        batch_val = st.toggle("📦 Varios clientes por prompt", value=False, help="Evalúa cada tendencia contra un grupo de clientes en una sola llamada a Gemini")
+        cascade_val = st.toggle("🔎 Triage + pitch solo para ganadores", value=True, help="Primero un puntaje breve por par; el análisis completo y el pitch solo para los que superan el umbral")
+        triage_threshold_val = st.slider("Umbral de triage", min_value=0, max_value=100, value=40, disabled=not cascade_val)
+        stream_val = st.toggle("⚡ Pitch en vivo (streaming)", value=True, help="Muestra puntaje, razones y pitch a medida que Gemini los genera")
+        anytime_val = st.toggle("💸 Modo anytime (presupuesto)", value=False, help="Evalúa primero los pares más prometedores y se detiene al agotar el presupuesto (ignora el límite de tendencias)")
+        b1, b2 = st.columns(2)
+        max_calls_val = b1.number_input("Máx. llamadas", min_value=0, value=30, step=10, disabled=not anytime_val, help="0 = sin tope de llamadas")
+        max_tokens_val = b2.number_input("Máx. tokens", min_value=0, value=0, step=10000, disabled=not anytime_val, help="0 = sin tope de tokens")
+        concurrency_val = st.slider("Llamadas IA en paralelo", min_value=1, max_value=8, value=4, help="Pares cliente-tendencia evaluados a la vez (respetando la cuota de Gemini)")
 
     # Boton de Analisis (Depende del filtro)
+    matching_params = {"client": selected_client_filter, "trend_limit": trend_limit_val, "prefilter": prefilter_val,
+                       "concurrency": concurrency_val, "batch_clients": batch_val, "incremental": incremental_val,
+                       "cascade": cascade_val, "triage_threshold": triage_threshold_val, "triage_top_k": None,
+                       "max_calls": (int(max_calls_val) or None) if anytime_val else None,
+                       "max_tokens": (int(max_tokens_val) or None) if anytime_val else None}
     if st.button("🚀 Ejecutar Análisis IA", type="primary", use_container_width=True):
-        matcher = OpportunityMatcher()
-        matches = []
-        
-        # UI Feedback
-        target_msg = f"para {selected_client_filter}" if selected_client_filter != "Todos" else "Global"
-        
-        with st.status(f"🧠 Ejecutando Análisis ({target_msg})...", expanded=True) as status:
-            st.write("Iniciando motor cognitivo...")
-            
-            # Pasamos filtro y limite
-            for update in matcher.run_matching_cycle(specific_client_name=selected_client_filter, trend_limit=trend_limit_val):
-                if update["type"] == "log":
-                    st.write(update["message"])
-                elif update["type"] == "result":
-                    matches = update["data"]
-            
-            status.update(label="✅ Análisis Completado!", state="complete", expanded=False)
-        
-        if matches:
-            matcher.save_opportunities(matches)
-            st.success(f"Se encontraron {len(matches)} nuevas oportunidades.")
-            time.sleep(1)
-            st.rerun()
-        else:
-            st.warning("El análisis terminó sin nuevas oportunidades.")
+        # El análisis corre en un worker: la página sigue usable y consulta el avance
+        enqueue_job("matching", dict(matching_params, stream_pitch=stream_val), "matching_job")
+
+    render_resumable_runs(stream_val)
+    target_msg = f"para {selected_client_filter}" if selected_client_filter != "Todos" else "Global"
+    render_job_progress("matching_job", f"🧠 Análisis IA ({target_msg})")
 
     st.divider()
     
-    opportunities = db.fetch_opportunities()
-    
-    if not opportunities:
-        st.info("No hay oportunidades detectadas aún.")
+    f1, f2 = st.columns([3, 1])
+    with f1:
+        st.markdown("### Business Opportunity Feed")
+    with f2:
+        min_score_val = st.slider("Puntaje mínimo", min_value=0, max_value=100, value=0, step=5)
+
+    # Cursores (created_at, id) de las páginas ya vistas; se reinician al cambiar los filtros
+    feed_filter = (selected_client_filter, min_score_val)
+    feed = st.session_state.get("feed")
+    if not feed or feed["filter"] != feed_filter:
+        feed = st.session_state["feed"] = {"filter": feed_filter, "cursors": [None]}
+    try:
+        filtered_ops, next_cursor = db.fetch_opportunities_page(
+            client_name=selected_client_filter if selected_client_filter != "Todos" else None,
+            min_score=min_score_val or None, cursor=feed["cursors"][-1], limit=FEED_PAGE_SIZE)
+    except Exception as e:
+        st.error(f"❌ No se pudo cargar el feed: {e}")
         return
 
-    # Filter View Logic (Uses the same selector)
-    if selected_client_filter != "Todos":
-        filtered_ops = [op for op in opportunities if op.get('client_name') == selected_client_filter]
-    else:
-        filtered_ops = opportunities
-
     if not filtered_ops:
-        st.warning(f"No hay oportunidades guardadas para {selected_client_filter}.")
+        if len(feed["cursors"]) > 1:
+            feed["cursors"].pop() # La última página quedó vacía (descartes): volver a la anterior
+            st.rerun()
+        if selected_client_filter != "Todos" or min_score_val:
+            st.warning(f"No hay oportunidades guardadas para {selected_client_filter} con ese puntaje.")
+        else:
+            st.info("No hay oportunidades detectadas aún.")
         return
 
-    # FEED VIEW IMPLEMENTATION
-    st.markdown("### Business Opportunity Feed")
-    
     # Center column for feed look
     _, feed_col, _ = st.columns([1, 6, 1])
     
@@ -130,25 +341,10 @@ def page_opportunities():
                 
                 # Title
                 st.markdown(f"## {op.get('trend_title')}")
-                
-                # Full Content (Pitch)
-                st.markdown("#### Sales Pitch")
-                st.info(op.get('generated_pitch'))
-                
-                # Reasoning
-                st.markdown("#### Por qué es relevante")
-                reasoning = op.get('reasoning')
-                if isinstance(reasoning, str):
-                    try:
-                        reasoning = json.loads(reasoning)
-                    except:
-                        pass
-                
-                if isinstance(reasoning, list):
-                    for r in reasoning:
-                        st.markdown(f"- {r}")
-                else:
-                    st.markdown(str(reasoning))
+
+                # Pitch y razones: se descargan solo al abrir la tarjeta
+                if st.toggle("📄 Ver pitch y razones", key=f"open_{op.get('id')}"):
+                    render_opportunity_detail(db, op.get('id'))
                 
                 # Action Buttons (Mockup)
                 b1, b2, b3 = st.columns([1, 1, 4])
@@ -164,6 +360,18 @@ def page_opportunities():
 
             st.markdown("---") # Spacer between cards
 
+        p1, p2, p3 = st.columns([1, 2, 1])
+        with p1:
+            if len(feed["cursors"]) > 1 and st.button("⬅️ Anteriores"):
+                feed["cursors"].pop()
+                st.rerun()
+        with p2:
+            st.caption(f"Página {len(feed['cursors'])}")
+        with p3:
+            if next_cursor and st.button("Siguientes ➡️"):
+                feed["cursors"].append(next_cursor)
+                st.rerun()
+
 def page_data_management():
     st.title("Gestión de Datos Maestros")
     
@@ -223,7 +431,8 @@ def page_data_management():
                         if st.button("✨ Generar con IA", key="gen_ai_ctx", help="Autocompletar usando Gemini", use_container_width=True):
                             with st.spinner("Gemini está investigando a la empresa..."):
                                 m_gen = OpportunityMatcher()
-                                ai_context = m_gen.generate_tech_context(client_to_edit['name'], client_to_edit.get('industry'))
+                                ai_context = m_gen.generate_tech_context(client_to_edit['name'], client_to_edit.get('industry'), client_to_edit.get('id'))
+                                m_gen.save_usage()
                                 # Update session state to reflect in text_area on rerun
                                 st.session_state['temp_edit_context'] = ai_context
                                 st.rerun()
@@ -273,8 +482,12 @@ def page_data_management():
                 else:
                     st.markdown(f":grey-background[{ind}]")
             with r3:
-                raw = c.get('tech_context_raw') or "Sin datos."
-                st.caption(raw[:150] + "...")
+                # Preferimos el resumen estructurado vigente; si no hay, el texto crudo
+                if is_fresh(c):
+                    st.caption("🧾 " + digest_to_text(c['context_digest'])[:150] + "...")
+                else:
+                    raw = c.get('tech_context_raw') or "Sin datos."
+                    st.caption(raw[:150] + "...")
             with r4:
                 # Acciones 
                 c_edit, c_del = st.columns(2)
@@ -293,28 +506,85 @@ def page_data_management():
         st.subheader("Ingesta de Tendencias")
         st.info("Utilice este módulo para forzar una actualización manual de todas las fuentes RSS.")
         if st.button("🔄 Ejecutar Motor de Ingesta (RSS)"):
-            ingestor = InnovationIngestor()
-            trends = []
-            
-            with st.status("📡 Escaneando fuentes distribuidas e Inteligencia...", expanded=True) as status:
-                st.write("Conectando con feeds...")
-                
-                # Consumir generador de logs
-                for update in ingestor.fetch_trends():
-                    if update["type"] == "log":
-                        st.write(update["message"])
-                    elif update["type"] == "result":
-                        trends = update["data"]
-                
-                status.update(label=f"✅ Ingesta Completada! ({len(trends)} arts)", state="complete", expanded=False)
+            enqueue_job("ingest", {}, "ingest_job")
+        render_job_progress("ingest_job", "📡 Ingesta RSS")
 
-            if trends:
-                ingestor.save_trends(trends)
-                st.success(f"Se procesaron {len(trends)} artículos nuevos.")
-                time.sleep(2)
-                st.rerun()
+        st.markdown("---")
+        render_trends_browser()
+
+def render_trends_browser():
+    """
+    Tendencias ingeridas, de la más reciente a la más antigua, paginadas por clave (published_at, id).
+    """
+    st.subheader("Tendencias Ingeridas")
+    db = DatabaseClient()
+    try:
+        source_names = sorted({s['name'] for s in db.fetch_rss_sources()})
+    except Exception:
+        source_names = []
+    source_filter = st.selectbox("Fuente", ["Todas"] + source_names, key="trends_source_filter")
+
+    # Cursores de las páginas ya vistas; se reinician al cambiar la fuente
+    browser = st.session_state.get("trends_browser")
+    if not browser or browser["filter"] != source_filter:
+        browser = st.session_state["trends_browser"] = {"filter": source_filter, "cursors": [None]}
+    try:
+        rows, next_cursor = db.fetch_trends_page(source=source_filter if source_filter != "Todas" else None,
+                                                 cursor=browser["cursors"][-1], limit=TRENDS_PAGE_SIZE)
+    except Exception as e:
+        st.error(f"❌ No se pudieron cargar las tendencias: {e}")
+        return
+
+    if not rows:
+        st.info("No hay tendencias ingeridas para esta fuente.")
+        return
+    for t in rows:
+        published = parse_timestamp(t.get('published_at'))
+        st.markdown(f"- [{t['title']}]({t['url']}) · {t.get('source') or '—'}"
+                    + (f" · {published.strftime('%d/%m %H:%M')}" if published else ""))
+
+    p1, p2, p3 = st.columns([1, 2, 1])
+    with p1:
+        if len(browser["cursors"]) > 1 and st.button("⬅️ Anteriores", key="trends_prev"):
+            browser["cursors"].pop()
+            st.rerun()
+    with p2:
+        st.caption(f"Página {len(browser['cursors'])}")
+    with p3:
+        if next_cursor and st.button("Siguientes ➡️", key="trends_next"):
+            browser["cursors"].append(next_cursor)
+            st.rerun()
 
 
+def render_source_health(source):
+    # Estado del circuit breaker + métricas de la última descarga
+    failures = source.get('consecutive_failures') or 0
+    open_until = circuit_open_until(source)
+    if open_until:
+        st.markdown(f":red-background[⛔ Suspendida hasta {open_until.strftime('%d/%m %H:%M')}]")
+    elif failures:
+        st.markdown(f":orange-background[⚠️ {failures} fallos seguidos]")
+    elif source.get('last_success_at'):
+        st.markdown(":green-background[✅ OK]")
+    else:
+        st.markdown(":grey-background[Sin datos]")
+
+    last_success = parse_timestamp(source.get('last_success_at'))
+    p50, p95 = source.get('latency_p50_ms'), source.get('latency_p95_ms')
+    details = []
+    if last_success:
+        details.append(f"Último éxito: {last_success.strftime('%d/%m %H:%M')}")
+    if p50 is not None:
+        details.append(f"p50/p95: {p50}/{p95} ms")
+    if source.get('last_bytes') is not None:
+        details.append(f"{source['last_bytes'] / 1024:.1f} KB")
+    if source.get('last_entry_count') is not None:
+        details.append(f"{source['last_entry_count']} entradas")
+    if details:
+        st.caption(" · ".join(details))
+    if failures and source.get('last_error'):
+        st.caption(f"Error: {source['last_error'][:80]}")
+
 def page_sources():
     st.title("Fuentes de Información")
     st.markdown("Gestión de feeds RSS y orígenes de datos para el motor de inteligencia.")
@@ -355,16 +625,17 @@ def page_sources():
         return
 
     # Header
-    h1, h2, h3, h4, h5 = st.columns([1, 4, 1.5, 1.5, 1])
+    h1, h2, h3, h4, h5, h6 = st.columns([1, 3.5, 1.5, 1.5, 2.5, 1])
     h1.markdown("**Activa**")
     h2.markdown("**Nombre**")
     h3.markdown("**Categoría**")
     h4.markdown("**Asignación**")
-    h5.markdown("**Acciones**")
+    h5.markdown("**Salud**")
+    h6.markdown("**Acciones**")
     st.divider()
 
     for s in sources:
-        r1, r2, r3, r4, r5 = st.columns([1, 4, 1.5, 1.5, 1])
+        r1, r2, r3, r4, r5, r6 = st.columns([1, 3.5, 1.5, 1.5, 2.5, 1])
         
         with r1:
             # Toggle de estado
@@ -391,6 +662,8 @@ def page_sources():
                 # Global -> Gris
                 st.markdown(f":grey-background[🌐 Global]")
         with r5:
+            render_source_health(s)
+        with r6:
             if st.button("🗑️", key=f"del_{s['id']}", help="Eliminar fuente"):
                 db.delete_rss_source(s['id'])
                 st.rerun()
@@ -398,6 +671,53 @@ def page_sources():
         st.markdown("---")
 
 
+def page_usage():
+    st.title("Consumo de IA")
+    st.markdown("Tokens, costo estimado y latencia de cada llamada a Gemini, por corrida, cliente y tipo de prompt.")
+
+    db = DatabaseClient()
+    try:
+        calls = db.fetch_llm_calls()
+    except Exception as e:
+        st.error(f"No se pudo leer el uso registrado: {e}")
+        return
+    if not calls:
+        st.info("Aún no hay llamadas registradas. Ejecute una ingesta o un análisis.")
+        return
+
+    real_calls = [c for c in calls if not c.get('cached')]
+    m1, m2, m3, m4 = st.columns(4)
+    m1.metric("Costo estimado", f"US${sum(float(c.get('cost_usd') or 0) for c in calls):.4f}")
+    m2.metric("Llamadas", len(real_calls), f"{len(calls) - len(real_calls)} desde caché", delta_color="off")
+    m3.metric("Tokens entrada", f"{sum(c.get('prompt_tokens') or 0 for c in calls):,}")
+    m4.metric("Tokens salida", f"{sum(c.get('output_tokens') or 0 for c in calls):,}")
+
+    columns = ["calls", "cached", "prompt_tokens", "output_tokens", "avg_prompt_tokens", "cost_usd", "latency_p50_ms", "latency_p95_ms"]
+
+    st.subheader("Por tipo de prompt")
+    st.dataframe(pd.DataFrame(summarize_calls(calls, "site"))[["site"] + columns], use_container_width=True, hide_index=True)
+
+    st.subheader("Por corrida")
+    runs = {r['id']: r for r in db.fetch_runs(limit=100)}
+    by_run = pd.DataFrame(summarize_calls(calls, "run_id"))
+    by_run["tipo"] = by_run["run_id"].map(lambda i: runs.get(i, {}).get('kind', '-'))
+    by_run["inicio"] = by_run["run_id"].map(lambda i: runs.get(i, {}).get('started_at', '-'))
+    st.dataframe(by_run[["run_id", "tipo", "inicio"] + columns], use_container_width=True, hide_index=True)
+
+    st.subheader("Por cliente")
+    names = {str(c.get('id')): c.get('name') for c in db.fetch_clients()}
+    by_client = pd.DataFrame(summarize_calls(calls, "client"))
+    by_client["cliente"] = by_client["client"].map(lambda k: names.get(k, k or "-"))
+    st.dataframe(by_client[["cliente"] + columns], use_container_width=True, hide_index=True)
+
+    # Tamaño de prompt en el tiempo: permite detectar regresiones
+    st.subheader("Tokens de entrada promedio por día")
+    df = pd.DataFrame(real_calls)
+    if not df.empty:
+        df["dia"] = pd.to_datetime(df["created_at"]).dt.date
+        st.line_chart(df.pivot_table(index="dia", columns="site", values="prompt_tokens", aggfunc="mean"))
+
+
 # --- MAIN APP FLOW ---
 page = render_sidebar()
 
@@ -407,3 +727,5 @@ elif page == "Gestión de Datos":
     page_data_management()
 elif page == "Fuentes de Información":
     page_sources()
+elif page == "Consumo IA":
+    page_usage()
@@ -1,9 +1,41 @@
 import os
+import time
+from datetime import datetime, timezone
+from itertools import islice
 from supabase import create_client, Client
 from dotenv import load_dotenv
 
 load_dotenv()
 
+def _chunked(iterable, size):
+    # Agrupa un iterable en listas de tamaño fijo sin materializarlo completo
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+# Columnas livianas de los listados: el texto largo (pitch, razones, resumen) se pide aparte al abrir la tarjeta
+OPPORTUNITY_CARD_COLUMNS = "id, client_name, trend_title, match_score, run_id, created_at"
+OPPORTUNITY_DETAIL_COLUMNS = "id, reasoning, generated_pitch"
+TREND_LIST_COLUMNS = "id, title, source, url, published_at"
+EXISTING_URL_BATCH = 50 # URLs por consulta de conteo en save_trends: mantiene corta la URL del request
+
+def _after_cursor(query, column, cursor):
+    # Paginación por clave en orden (column desc, id desc): solo filas posteriores al cursor (valor, id)
+    if not cursor:
+        return query
+    value, last_id = cursor
+    return query.or_(f'{column}.lt."{value}",and({column}.eq."{value}",id.lt.{int(last_id)})')
+
+def _keyset_page(rows, limit, column):
+    # Se pide una fila de más para saber si hay página siguiente sin contar la tabla
+    if len(rows) <= limit:
+        return rows, None
+    last = rows[limit - 1]
+    return rows[:limit], (last[column], last["id"])
+
 class DatabaseClient:
     _instance = None
 
@@ -45,42 +77,110 @@ class DatabaseClient:
             response = self.client.table("clients").insert(data_to_save).execute()
         return response.data
 
+    def update_client_digest(self, client_id, digest, digest_hash):
+        # Resumen del contexto generado por ClientDigester (se invalida por hash del texto crudo)
+        return self.client.table("clients").update({
+            "context_digest": digest,
+            "context_digest_hash": digest_hash,
+            "context_digest_at": datetime.now(timezone.utc).isoformat()
+        }).eq("id", client_id).execute()
+
     def delete_client(self, client_id):
         return self.client.table("clients").delete().eq("id", client_id).execute()
 
-    def save_trends(self, trends_list):
-        # Limpiar tabla o Upsert? 
-        # Para MVP simple: Insertar nuevas (ignorando duplicados por URL si se configuró unique)
-        # O borrar antiguas. Para historial, mejor upsert on conflict 'url'.
-        
-        data = []
-        for t in trends_list:
-            row = {
-                "title": t.get("title"),
-                "source": t.get("source"),
-                "url": t.get("url"),
-                "summary": t.get("summary"),
-                "published_at": t.get("published") # Asegurar formato fecha si es posible
-            }
-            data.append(row)
-            
-        return self.client.table("trends").upsert(data, on_conflict="url").execute()
+    @staticmethod
+    def _trend_row(t):
+        return {
+            "title": t.get("title"),
+            "source": t.get("source"),
+            "source_id": t.get("source_id"),
+            "url": t.get("url"),
+            "summary": t.get("summary"),
+            "published_at": t.get("published"), # Asegurar formato fecha si es posible
+            "fingerprint": t.get("fingerprint"),
+            "alternate_sources": t.get("alternate_sources") or []
+        }
+
+    def save_trends(self, trends, chunk_size=500, max_retries=3, backoff=1.0, count_existing=False):
+        """
+        Upsert (on conflict 'url') por lotes desde cualquier iterable, con reintentos por lote.
+        Un lote fallido no afecta a los demás. Retorna un resumen por lote:
+        {chunk, rows, inserted, updated, failed, attempts, error}.
+        inserted/updated solo se calculan con count_existing (consultas extra, sin bloquear la escritura);
+        None significa desconocido (sin conteo o conteo fallido), tanto en lotes guardados como fallidos.
+        """
+        rows = (self._trend_row(t) for t in trends)
+        return [
+            self._upsert_trend_chunk(index, chunk, max_retries, backoff, count_existing)
+            for index, chunk in enumerate(_chunked(rows, chunk_size))
+        ]
+
+    def _existing_urls(self, urls):
+        """
+        Diagnóstico best-effort: URLs del lote que ya estaban guardadas, en consultas cortas. None si falla.
+        """
+        existing = set()
+        try:
+            for batch in _chunked(urls, EXISTING_URL_BATCH):
+                existing.update(row["url"] for row in self.client.table("trends").select("url").in_("url", batch).execute().data)
+        except Exception as e:
+            print(f"⚠️ No se pudo contar las tendencias existentes: {e}")
+            return None
+        return existing
+
+    def _upsert_trend_chunk(self, index, chunk, max_retries, backoff, count_existing=False):
+        # Postgres no permite que un mismo upsert toque dos veces la misma fila: gana la última versión
+        by_url = {}
+        for row in chunk:
+            by_url[row["url"] or id(row)] = row
+        chunk = list(by_url.values())
+        urls = [row["url"] for row in chunk if row["url"]]
+
+        # El conteo va fuera de los reintentos: un fallo del diagnóstico nunca impide el upsert
+        existing = self._existing_urls(urls) if count_existing and urls else None
+        updated = len(existing) if existing is not None else None
+        inserted = len(chunk) - updated if updated is not None else None
+
+        last_error = None
+        for attempt in range(max_retries + 1):
+            try:
+                self.client.table("trends").upsert(chunk, on_conflict="url").execute()
+                return {"chunk": index, "rows": len(chunk), "inserted": inserted, "updated": updated,
+                        "failed": 0, "attempts": attempt + 1, "error": None}
+            except Exception as e:
+                last_error = e
+                if attempt < max_retries:
+                    time.sleep(backoff * (2 ** attempt))
+
+        # Nada se escribió: 0 si el conteo se obtuvo, None (desconocido) como en un lote guardado sin conteo
+        unknown = updated is None
+        return {"chunk": index, "rows": len(chunk), "inserted": None if unknown else 0, "updated": None if unknown else 0,
+                "failed": len(chunk), "attempts": max_retries + 1, "error": str(last_error)}
 
     def fetch_trends(self, limit=20, active_only=True):
-        query = self.client.table("trends").select("*").order("published_at", desc=True)
-        
-        if active_only:
-            # 1. Obtener nombres de fuentes activas
-            active_sources = self.client.table("rss_sources").select("name").eq("is_active", True).execute().data
-            active_names = [s['name'] for s in active_sources]
-            
-            if not active_names:
-                return [] # Si no hay fuentes activas, no devolvemos tendencias
-            
-            # 2. Filtrar query
-            query = query.in_("source", active_names)
-            
-        return query.limit(limit).execute().data
+        # Solo fuentes activas: la vista active_trends une trends y rss_sources por source_id en un solo viaje
+        table = "active_trends" if active_only else "trends"
+        return self.client.table(table).select("*").order("published_at", desc=True).limit(limit).execute().data
+
+    def fetch_trends_page(self, source=None, cursor=None, limit=50, columns=TREND_LIST_COLUMNS):
+        """
+        Una página de tendencias ordenada por (published_at, id) descendente (las sin fecha no se listan).
+        cursor es el (published_at, id) retornado por la página anterior. Retorna (filas, cursor siguiente o None).
+        """
+        query = self.client.table("trends").select(columns).not_.is_("published_at", "null")
+        if source:
+            query = query.eq("source", source)
+        query = _after_cursor(query, "published_at", cursor)
+        rows = query.order("published_at", desc=True).order("id", desc=True).limit(limit + 1).execute().data
+        return _keyset_page(rows, limit, "published_at")
+
+    def fetch_trend_fingerprints(self, limit=2000):
+        # Índice persistente de huellas SimHash para agrupar casi-duplicados entre ejecuciones
+        return self.client.table("trends") \
+            .select("title, source, source_id, url, summary, published_at, fingerprint, alternate_sources") \
+            .not_.is_("fingerprint", "null") \
+            .order("published_at", desc=True) \
+            .limit(limit).execute().data
 
     def save_opportunity(self, opportunity):
         return self.client.table("opportunities").insert(opportunity).execute()
@@ -88,6 +188,135 @@ class DatabaseClient:
     def fetch_opportunities(self):
         return self.client.table("opportunities").select("*").order("created_at", desc=True).execute().data
 
+    def fetch_opportunities_page(self, client_name=None, min_score=None, cursor=None, limit=20, columns=OPPORTUNITY_CARD_COLUMNS):
+        """
+        Una página del feed, filtrada en la base y ordenada por (created_at, id) descendente.
+        cursor es el (created_at, id) retornado por la página anterior. Retorna (filas, cursor siguiente o None).
+        """
+        query = self.client.table("opportunities").select(columns)
+        if client_name:
+            query = query.eq("client_name", client_name)
+        if min_score is not None:
+            query = query.gte("match_score", min_score)
+        query = _after_cursor(query, "created_at", cursor)
+        rows = query.order("created_at", desc=True).order("id", desc=True).limit(limit + 1).execute().data
+        return _keyset_page(rows, limit, "created_at")
+
+    def fetch_opportunity_detail(self, opportunity_id):
+        # Texto largo de una tarjeta (pitch y razones), al abrirla
+        rows = self.client.table("opportunities").select(OPPORTUNITY_DETAIL_COLUMNS).eq("id", opportunity_id).limit(1).execute().data
+        return rows[0] if rows else None
+
+    # --- LEDGER DE MATCHING (pares ya evaluados) ---
+    def fetch_match_ledger(self, client_keys=None, run_id=None):
+        query = self.client.table("match_ledger").select("client_key, trend_key, client_hash, trend_hash, model, prompt_version, match_score")
+        if client_keys:
+            query = query.in_("client_key", list(client_keys))
+        if run_id is not None:
+            # Pares ya guardados por una corrida (checkpoints para reanudarla)
+            query = query.eq("run_id", run_id)
+        return query.execute().data
+
+    def upsert_match_ledger(self, rows, chunk_size=500):
+        # Una fila por par: la evaluación más reciente reemplaza a la anterior
+        for chunk in _chunked(rows, chunk_size):
+            self.client.table("match_ledger").upsert(chunk, on_conflict="client_key,trend_key").execute()
+
+    # --- USO DE GEMINI (tokens, latencia, costo) ---
+    def save_llm_calls(self, calls, chunk_size=500):
+        for chunk in _chunked(calls, chunk_size):
+            self.client.table("llm_calls").insert(chunk).execute()
+
+    def fetch_llm_calls(self, since=None, limit=5000):
+        query = self.client.table("llm_calls").select("*").order("created_at", desc=True)
+        if since:
+            query = query.gte("created_at", since)
+        return query.limit(limit).execute().data
+
+    # --- RUNS (ejecuciones batch) ---
+    def start_run(self, kind, params=None):
+        data = {"kind": kind, "status": "running", "params": params or {}}
+        return self.client.table("runs").insert(data).execute().data[0]
+
+    def finish_run(self, run_id, status, duration_s, items, errors):
+        return self.client.table("runs").update({
+            "status": status,
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+            "duration_s": round(duration_s, 2),
+            "items": items,
+            "errors": errors
+        }).eq("id", run_id).execute()
+
+    def fetch_runs(self, kind=None, limit=20):
+        query = self.client.table("runs").select("*").order("started_at", desc=True)
+        if kind:
+            query = query.eq("kind", kind)
+        return query.limit(limit).execute().data
+
+    def fetch_run(self, run_id):
+        rows = self.client.table("runs").select("*").eq("id", run_id).limit(1).execute().data
+        return rows[0] if rows else None
+
+    def fetch_resumable_runs(self, kind="matching", limit=20):
+        # En curso o interrumpidas (un proceso caído deja la corrida en 'running'), fallidas y canceladas
+        return self.client.table("runs").select("*").eq("kind", kind) \
+            .in_("status", ["running", "failed", "cancelled"]) \
+            .order("started_at", desc=True).limit(limit).execute().data
+
+    def update_run_progress(self, run_id, progress):
+        return self.client.table("runs").update({
+            "progress": progress,
+            "checkpoint_at": datetime.now(timezone.utc).isoformat()
+        }).eq("id", run_id).execute()
+
+    def reopen_run(self, run_id):
+        # Reanudación: la misma corrida vuelve a 'running'
+        return self.client.table("runs").update({"status": "running", "finished_at": None}).eq("id", run_id).execute()
+
+    # --- JOBS (cola de trabajos en segundo plano) ---
+    def enqueue_job(self, kind, params, dedupe_key):
+        data = {"kind": kind, "params": params or {}, "dedupe_key": dedupe_key, "status": "queued"}
+        return self.client.table("jobs").insert(data).execute().data[0]
+
+    def fetch_active_job(self, dedupe_key):
+        rows = self.client.table("jobs").select("*").eq("dedupe_key", dedupe_key) \
+            .in_("status", ["queued", "running"]).limit(1).execute().data
+        return rows[0] if rows else None
+
+    def fetch_job(self, job_id):
+        rows = self.client.table("jobs").select("*").eq("id", job_id).limit(1).execute().data
+        return rows[0] if rows else None
+
+    def fetch_jobs(self, kind=None, statuses=None, limit=20):
+        query = self.client.table("jobs").select("*").order("created_at", desc=True)
+        if kind:
+            query = query.eq("kind", kind)
+        if statuses:
+            query = query.in_("status", list(statuses))
+        return query.limit(limit).execute().data
+
+    def claim_job(self, worker, max_running=2, stale_seconds=600):
+        # RPC atómica: respeta el tope de trabajos simultáneos y libera los de workers caídos
+        rows = self.client.rpc("claim_job", {"p_worker": worker, "p_max_running": max_running, "p_stale_seconds": stale_seconds}).execute().data
+        return rows[0] if rows else None
+
+    def update_job(self, job_id, fields):
+        return self.client.table("jobs").update(fields).eq("id", job_id).execute()
+
+    def request_job_cancel(self, job_id):
+        # En cola: se cancela de inmediato. En curso: el worker lo ve en su próximo latido
+        self.client.table("jobs").update({"status": "cancelled", "finished_at": datetime.now(timezone.utc).isoformat()}) \
+            .eq("id", job_id).eq("status", "queued").execute()
+        return self.client.table("jobs").update({"cancel_requested": True}).eq("id", job_id).eq("status", "running").execute()
+
+    def add_job_events(self, rows, chunk_size=500):
+        for chunk in _chunked(rows, chunk_size):
+            self.client.table("job_events").insert(chunk).execute()
+
+    def fetch_job_events(self, job_id, after_id=0, limit=500):
+        return self.client.table("job_events").select("*").eq("job_id", job_id).gt("id", after_id) \
+            .order("id").limit(limit).execute().data
+
     # --- RSS SOURCES MANAGEMENT ---
     def fetch_rss_sources(self):
         # Hacemos un join con clients para mostrar el nombre del cliente si existe
@@ -112,6 +341,10 @@ class DatabaseClient:
     def update_source_status(self, source_id, is_active):
         return self.client.table("rss_sources").update({"is_active": is_active}).eq("id", source_id).execute()
 
+    def update_source_state(self, source_id, fields):
+        # Estado técnico de la fuente (caché HTTP, marca de agua, salud) calculado por el ingestor
+        return self.client.table("rss_sources").update(fields).eq("id", source_id).execute()
+
     def update_client(self, client_id, industry, tech_context):
         return self.client.table("clients").update({
             "industry": industry,
@@ -0,0 +1,96 @@
+import hashlib
+import re
+import unicodedata
+
+FINGERPRINT_BITS = 64
+BANDS = 8 # 8 bandas de 8 bits: con distancia <= 7 al menos una banda coincide exacta
+
+STOPWORDS = {
+    "the", "a", "an", "of", "to", "in", "on", "for", "and", "or", "is", "are", "with", "by", "its", "at", "as",
+    "el", "la", "los", "las", "de", "del", "en", "y", "o", "un", "una", "por", "para", "con", "que", "se", "su"
+}
+
+def normalize_text(text):
+    """
+    Normaliza texto para comparar: sin HTML, sin acentos, minúsculas y solo alfanuméricos.
+    """
+    text = re.sub(r"<[^>]+>", " ", text or "")
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"[^a-z0-9]+", " ", text.lower()).strip()
+
+def _features(text):
+    words = [w for w in normalize_text(text).split() if w not in STOPWORDS]
+    # Palabras + bigramas: tolera reordenamientos menores entre medios
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+def simhash(text):
+    """
+    Huella SimHash de 64 bits (como int) del texto normalizado.
+    """
+    weights = [0] * FINGERPRINT_BITS
+    for feature in _features(text):
+        h = int.from_bytes(hashlib.md5(feature.encode("utf-8")).digest()[:8], "big")
+        for bit in range(FINGERPRINT_BITS):
+            weights[bit] += 1 if (h >> bit) & 1 else -1
+
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+def trend_fingerprint(title, summary):
+    """
+    Huella hexadecimal (16 caracteres) de título + resumen, lista para guardar en DB.
+    """
+    return f"{simhash(f'{title} {summary}'):016x}"
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+class NearDuplicateIndex:
+    """
+    Índice en memoria de huellas SimHash con búsqueda por bandas.
+    Cada huella apunta a la tendencia canónica que la representa.
+    """
+    def __init__(self, max_distance=6):
+        if max_distance >= BANDS:
+            raise ValueError(f"max_distance debe ser menor que {BANDS}")
+        self.max_distance = max_distance
+        self._band_bits = FINGERPRINT_BITS // BANDS
+        self._buckets = {}
+
+    def _bands(self, fingerprint):
+        mask = (1 << self._band_bits) - 1
+        for band in range(BANDS):
+            yield band, (fingerprint >> (band * self._band_bits)) & mask
+
+    def add(self, fingerprint_hex, trend):
+        fingerprint = int(fingerprint_hex, 16)
+        for key in self._bands(fingerprint):
+            self._buckets.setdefault(key, []).append((fingerprint, trend))
+
+    def find(self, fingerprint_hex):
+        """
+        Retorna la tendencia canónica más cercana dentro de max_distance, o None.
+        """
+        fingerprint = int(fingerprint_hex, 16)
+        best, best_distance = None, self.max_distance + 1
+        for key in self._bands(fingerprint):
+            for candidate, trend in self._buckets.get(key, []):
+                distance = hamming_distance(fingerprint, candidate)
+                if distance < best_distance:
+                    best, best_distance = trend, distance
+        return best
+
+def add_alternate_source(canonical, source, url):
+    """
+    Registra una copia (fuente + URL) en la tendencia canónica. Retorna True si era nueva.
+    """
+    if not url or url == canonical.get("url"):
+        return False
+    alternates = canonical.setdefault("alternate_sources", [])
+    if any(a.get("url") == url for a in alternates):
+        return False
+    alternates.append({"source": source, "url": url})
+    return True
@@ -0,0 +1,191 @@
+"""
+Sustituto local de google.generativeai para medir y probar sin red ni cuota.
+Expone configure() y GenerativeModel(...).generate_content(...) (también con stream=True) con latencia configurable,
+inyección de 429 y respuestas JSON deterministas según el tipo de prompt.
+
+Se activa con GEMINI_BACKEND=fake (matcher e ingestor) o con install() en benchmarks.
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+from rate_limiter import estimate_tokens
+
+try:
+    from google.api_core.exceptions import ResourceExhausted
+except ImportError: # Sin google-api-core: el mensaje igual lo reconoce is_rate_limit_error
+    ResourceExhausted = None
+
+STREAM_CHUNK_CHARS = 48 # Tamaño de cada fragmento con stream=True
+
+class FakeBackend:
+    """
+    Configuración y contadores compartidos por todos los modelos falsos del proceso.
+    latency: "fixed" | "uniform" | "lognormal", alrededor de latency_ms (jitter = dispersión relativa).
+    """
+    def __init__(self, latency_ms=0, latency="fixed", jitter=0.5, rate_429=0.0, ms_per_output_token=0.0, seed=0, sleep=time.sleep):
+        self.latency_ms = latency_ms
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.ms_per_output_token = ms_per_output_token
+        self._sleep = sleep
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.calls = 0
+            self.errors_429 = 0
+            self.by_kind = {}
+            self.prompt_tokens = 0
+            self.output_tokens = 0
+
+    def _draw(self):
+        # Un solo generador con lock: la secuencia es reproducible con la misma semilla
+        with self._lock:
+            if self.latency == "uniform":
+                latency = self._random.uniform(self.latency_ms * (1 - self.jitter), self.latency_ms * (1 + self.jitter))
+            elif self.latency == "lognormal":
+                latency = self.latency_ms * self._random.lognormvariate(0, self.jitter) if self.latency_ms else 0
+            else:
+                latency = self.latency_ms
+            throttled = self._random.random() < self.rate_429
+        return max(0.0, latency), throttled
+
+    def _count(self, kind, prompt_tokens, output_tokens, throttled):
+        with self._lock:
+            self.calls += 1
+            self.by_kind[kind] = self.by_kind.get(kind, 0) + 1
+            if throttled:
+                self.errors_429 += 1
+            else:
+                self.prompt_tokens += prompt_tokens
+                self.output_tokens += output_tokens
+
+    def stats(self):
+        with self._lock:
+            return {"calls": self.calls, "errors_429": self.errors_429, "by_kind": dict(self.by_kind),
+                    "prompt_tokens": self.prompt_tokens, "output_tokens": self.output_tokens}
+
+backend = FakeBackend()
+
+def configure(api_key=None, **kwargs):
+    pass
+
+def install(**config):
+    """
+    Reemplaza la configuración global del backend falso y la retorna (contadores en cero).
+    """
+    global backend
+    backend = FakeBackend(**config)
+    return backend
+
+def _score(*parts):
+    # Puntaje determinista 0-100 a partir de la identidad del par
+    digest = hashlib.sha256("|".join(str(p) for p in parts).encode("utf-8")).digest()
+    return digest[0] * 100 // 255
+
+def _field(prompt, label):
+    match = re.search(rf"{label}:\s*(.+)", prompt)
+    return match.group(1).strip() if match else ""
+
+def classify(prompt):
+    """
+    Tipo de prompt según sus marcadores (los mismos textos que arman matcher, ingestor y client_digest).
+    """
+    if "TAREA: Estimar" in prompt:
+        return "triage"
+    if "Para CADA cliente" in prompt:
+        return "match_batch"
+    if "ACTÚA COMO: Arquitecto de Soluciones" in prompt:
+        return "match"
+    if "Condensar el siguiente texto crudo" in prompt:
+        return "digest"
+    if "Para CADA artículo" in prompt:
+        return "relevance_batch"
+    if "ERES: Analista de Inteligencia" in prompt:
+        return "relevance"
+    return "text"
+
+def respond(prompt):
+    """
+    Respuesta determinista (misma entrada, misma salida) con la forma que espera cada llamador.
+    """
+    kind = classify(prompt)
+    if kind == "triage":
+        client, trend = _field(prompt, "CLIENTE"), _field(prompt, "NOTICIA")
+        return kind, json.dumps({"match_score": _score(client, trend), "reason": f"Afinidad entre {client[:30]} y la noticia."})
+    if kind == "match":
+        client, trend = _field(prompt, "Nombre"), _field(prompt, "Título")
+        return kind, json.dumps(_match(client, trend), ensure_ascii=False)
+    if kind == "match_batch":
+        trend = _field(prompt, "Título")
+        clients = re.findall(r"\[\d+\] Nombre:\s*(.+)", prompt)
+        return kind, json.dumps([dict(_match(c.strip(), trend), client=c.strip()) for c in clients], ensure_ascii=False)
+    if kind == "digest":
+        return kind, json.dumps({"industry": "General", "tech_stack": {"cloud": ["AWS"], "backend": ["Java"], "frontend": [], "data": ["PostgreSQL"]},
+                                 "pain_points": ["Sistemas legacy"], "strategic_goals": ["Automatización"]}, ensure_ascii=False)
+    if kind == "relevance":
+        title = _field(prompt, "Título")
+        return kind, json.dumps({"is_relevant": _score(title) >= 30, "new_summary": f"Resumen técnico: {title[:60]}"}, ensure_ascii=False)
+    if kind == "relevance_batch":
+        titles = re.findall(r"\[(\d+)\] Título:\s*(.+)", prompt)
+        return kind, json.dumps([{"index": int(i), "is_relevant": _score(t.strip()) >= 30, "new_summary": f"Resumen técnico: {t.strip()[:60]}"}
+                                 for i, t in titles], ensure_ascii=False)
+    return kind, "Perfil tecnológico simulado: stack cloud híbrido, desafíos de integración y foco en automatización."
+
+def _match(client, trend):
+    score = _score(client, trend)
+    return {
+        "match_score": score,
+        "reasoning": [f"Oportunidad técnica para {client}", "Valor de negocio estimado", "Viable con su stack"],
+        "generated_pitch": f"Estimado equipo de {client}: a partir de '{trend[:60]}' proponemos una PoC de dos semanas. " * 3
+    }
+
+class GenerativeModel:
+    def __init__(self, model_name="gemini-flash-latest", **kwargs):
+        self.model_name = model_name if model_name.startswith("models/") else f"models/{model_name}"
+
+    def generate_content(self, prompt, generation_config=None, stream=False, **kwargs):
+        current = backend
+        latency_ms, throttled = current._draw()
+        kind, text = respond(prompt)
+        prompt_tokens, output_tokens = estimate_tokens(prompt), estimate_tokens(text)
+        current._count(kind, prompt_tokens, output_tokens, throttled)
+
+        if throttled:
+            # Un 429 responde rápido, como la API real
+            current._sleep(min(latency_ms, 50) / 1000)
+            message = "429 Resource has been exhausted (e.g. check quota)."
+            raise ResourceExhausted(message) if ResourceExhausted else Exception(message)
+
+        usage = SimpleNamespace(prompt_token_count=prompt_tokens, candidates_token_count=output_tokens,
+                                total_token_count=prompt_tokens + output_tokens)
+        if stream:
+            return FakeStream(text, usage, latency_ms, current)
+        current._sleep((latency_ms + output_tokens * current.ms_per_output_token) / 1000)
+        return SimpleNamespace(text=text, usage_metadata=usage)
+
+class FakeStream:
+    """
+    Respuesta con stream=True: fragmentos de ~STREAM_CHUNK_CHARS caracteres. El primero llega tras la
+    latencia base y cada uno suma el costo de sus tokens (ms_per_output_token), como en la API real.
+    """
+    def __init__(self, text, usage_metadata, latency_ms, current):
+        self.text = text
+        self.usage_metadata = usage_metadata
+        self._latency_ms = latency_ms
+        self._backend = current
+
+    def __iter__(self):
+        for position in range(0, len(self.text), STREAM_CHUNK_CHARS):
+            piece = self.text[position:position + STREAM_CHUNK_CHARS]
+            first = self._latency_ms if position == 0 else 0
+            self._backend._sleep((first + estimate_tokens(piece) * self._backend.ms_per_output_token) / 1000)
+            yield SimpleNamespace(text=piece)
@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta, timezone
+
+# Circuit breaker: tras FAILURE_THRESHOLD fallos seguidos la fuente se omite
+# durante BASE_BACKOFF * 2^(fallos - umbral), con tope MAX_BACKOFF.
+FAILURE_THRESHOLD = 3
+BASE_BACKOFF = timedelta(minutes=15)
+MAX_BACKOFF = timedelta(hours=24)
+LATENCY_WINDOW = 20 # Muestras de latencia conservadas por fuente
+
+def parse_timestamp(value):
+    """
+    Convierte un timestamp ISO (como lo devuelve Supabase) a datetime con zona horaria.
+    """
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+def percentile(samples, pct):
+    """
+    Percentil por rango más cercano (pct entre 0 y 100). None si no hay muestras.
+    """
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = max(1, -(-len(ordered) * pct // 100)) # ceil sin floats
+    return ordered[int(rank) - 1]
+
+def circuit_open_until(source, now=None):
+    """
+    Retorna el datetime hasta el que la fuente está suspendida, o None si puede consultarse.
+    """
+    now = now or datetime.now(timezone.utc)
+    until = parse_timestamp(source.get('circuit_open_until'))
+    if until and until > now:
+        return until
+    return None
+
+def record_success(source, latency_ms, size_bytes, now=None):
+    """
+    Campos de salud a persistir tras una descarga exitosa (cierra el circuito).
+    """
+    now = now or datetime.now(timezone.utc)
+    samples = (list(source.get('latency_samples') or []) + [int(latency_ms)])[-LATENCY_WINDOW:]
+    return {
+        "last_success_at": now.isoformat(),
+        "last_error": None,
+        "consecutive_failures": 0,
+        "circuit_open_until": None,
+        "latency_samples": samples,
+        "latency_p50_ms": percentile(samples, 50),
+        "latency_p95_ms": percentile(samples, 95),
+        "last_bytes": size_bytes
+    }
+
+def record_failure(source, error, now=None, threshold=FAILURE_THRESHOLD, base_backoff=BASE_BACKOFF, max_backoff=MAX_BACKOFF):
+    """
+    Campos de salud a persistir tras un fallo. Abre el circuito con backoff exponencial
+    cuando se alcanza el umbral de fallos consecutivos.
+    """
+    now = now or datetime.now(timezone.utc)
+    failures = (source.get('consecutive_failures') or 0) + 1
+    fields = {
+        "last_error": str(error)[:500],
+        "consecutive_failures": failures,
+        "circuit_open_until": None
+    }
+    if failures >= threshold:
+        backoff = min(base_backoff * (2 ** (failures - threshold)), max_backoff)
+        fields["circuit_open_until"] = (now + backoff).isoformat()
+    return fields
@@ -1,15 +1,138 @@
 import feedparser
-import json
-from datetime import datetime
+import hashlib
+from datetime import datetime, timezone
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlparse
 import requests
 from db_client import DatabaseClient
+from dedup import NearDuplicateIndex, trend_fingerprint, add_alternate_source
+from llm_client import LLMClient, parse_json, is_json
+from usage import UsageTracker
+from feed_health import parse_timestamp, circuit_open_until, record_success, record_failure
 
 import os
 import google.generativeai as genai
 
+if os.getenv("GEMINI_BACKEND", "").lower() == "fake":
+    import fake_gemini as genai # Sustituto local sin red ni cuota (benchmarks, demos)
+
+RELEVANCE_CRITERIA = """
+        CRITERIOS DE RELEVANCIA:
+        - SÍ es relevante si menciona: Migraciones cloud, uso de IA, nuevos sistemas core, digitalización, ciberseguridad, automatización.
+        - NO es relevante si es: Resultados financieros puros, cambios de directiva, litigios legales, huelgas, o noticias generales del sector sin mencionar a la empresa específicamente en un contexto tech.
+"""
+
+def _entry_key(entry):
+    return entry.get('id') or entry.get('link')
+
+def _entry_published(entry):
+    """
+    Fecha de publicación de una entrada como datetime UTC (None si el feed no la informa).
+    """
+    parsed = entry.get('published_parsed') or entry.get('updated_parsed')
+    if not parsed:
+        return None
+    return datetime(*parsed[:6], tzinfo=timezone.utc)
+
+def _truncate_summary(text):
+    text = text or ""
+    return text[:500] + "..." if len(text) > 500 else text
+
+def select_new_entries(entries, last_entry_id=None, last_entry_published=None, max_entries=20):
+    """
+    Filtra las entradas más nuevas que la marca de agua (watermark) de la fuente, sin importar el orden del feed.
+    Con más de max_entries nuevas se procesan las más antiguas y la marca avanza solo hasta la última procesada:
+    el resto queda para la próxima corrida. Retorna (entradas_nuevas, nueva_marca, pendientes_por_limite).
+    """
+    last_published = parse_timestamp(last_entry_published)
+
+    candidates = []
+    id_seen = False
+    for entry in entries:
+        if last_entry_id and _entry_key(entry) == last_entry_id:
+            id_seen = True
+            continue
+        published = _entry_published(entry)
+        if published and last_published:
+            if published > last_published:
+                candidates.append(entry)
+            continue
+        # Sin fechas para comparar: en el feed (del más nuevo al más antiguo) lo nuevo está antes de la marca
+        if not id_seen:
+            candidates.append(entry)
+
+    # Más antiguas primero (las entradas sin fecha, en orden inverso del feed, cuentan como las más antiguas)
+    min_date = datetime.min.replace(tzinfo=timezone.utc)
+    candidates.reverse()
+    candidates.sort(key=lambda e: _entry_published(e) or min_date)
+
+    dropped = max(0, len(candidates) - max_entries) if max_entries else 0
+    processed = candidates[:max_entries] if dropped else candidates
+
+    watermark = {}
+    if processed:
+        newest = processed[-1]
+        newest_published = _entry_published(newest)
+        watermark = {
+            "last_entry_id": _entry_key(newest),
+            "last_entry_published": newest_published.isoformat() if newest_published else last_entry_published
+        }
+    # Más recientes primero, como en el feed
+    return processed[::-1], watermark, dropped
+
+def normalize_feed(content, source_name, last_entry_id=None, last_entry_published=None, max_entries=20):
+    """
+    Parsea un feed y normaliza sus entradas nuevas a diccionarios compactos (trend_item).
+    Es una función de módulo (picklable) para poder ejecutarse en un pool de procesos:
+    solo viajan de vuelta los campos ya recortados, no el feed completo.
+    """
+    feed = feedparser.parse(content)
+    new_entries, watermark, dropped = select_new_entries(feed.entries, last_entry_id, last_entry_published, max_entries)
+
+    items = []
+    for entry in new_entries:
+        summary_text = entry.get('summary', '') or entry.get('description', '')
+        title_text = entry.get('title', 'Sin Título')
+        items.append({
+            "id": entry.get('link', str(time.time())),
+            "title": title_text,
+            "source": source_name,
+            "published": entry.get('published', str(datetime.now())),
+            "url": entry.get('link', ''),
+            "summary": _truncate_summary(summary_text),
+            "tags": [t.term for t in entry.get('tags', [])] if 'tags' in entry else [],
+            "fingerprint": trend_fingerprint(title_text, summary_text),
+            "alternate_sources": []
+        })
+    return {"entry_count": len(feed.entries), "items": items, "watermark": watermark, "dropped": dropped}
+
 class InnovationIngestor:
-    def __init__(self):
+    def __init__(self, max_workers=8, per_host_limit=2, timeout=10, max_entries_per_source=20, llm_batch_size=8,
+                 dedup_max_distance=6, dedup_window=2000, parse_workers=0, use_llm_cache=True):
+        # Concurrencia de descarga: límite global (hilos) y límite por host
+        self.max_workers = max_workers
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+        # Máximo de entradas nuevas procesadas por fuente y ejecución
+        self.max_entries_per_source = max_entries_per_source
+        # Artículos evaluados por llamada a Gemini en fuentes de cliente (1 = sin batch)
+        self.llm_batch_size = max(1, llm_batch_size)
+        # Detección de casi-duplicados (SimHash): distancia máxima y tendencias previas a indexar
+        self.dedup_max_distance = dedup_max_distance
+        self.dedup_window = dedup_window
+        self._dedup_index = NearDuplicateIndex(dedup_max_distance)
+        self._touched_canonicals = {}
+        # Procesos para parsear/normalizar feeds (0 = en el hilo principal)
+        self.parse_workers = parse_workers
+        self._host_slots = {}
+        self._host_slots_lock = threading.Lock()
+        # Estado por fuente (caché HTTP, marca de agua) pendiente de persistir tras guardar tendencias
+        self._pending_source_state = {}
+        # Salud por fuente (latencia, fallos, circuit breaker): se persiste al final de cada ingesta
+        self._source_health = {}
+
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
@@ -23,10 +146,15 @@ class InnovationIngestor:
         else:
             print("⚠️ GEMINI_API_KEY no encontrada.")
             self.model = None
+        # Todas las llamadas a Gemini pasan por LLMClient (caché de respuestas en disco)
+        # Tokens, latencia y costo de cada llamada (se persisten con save_usage)
+        self.usage = UsageTracker()
+        self.llm = LLMClient(self.model, use_cache=use_llm_cache, usage=self.usage) if self.model else None
 
-    def evaluate_news_with_llm(self, title, summary, client_name):
+    def evaluate_news_with_llm(self, title, summary, client_name, client_id=None, url=None):
         """
         Usa Gemini para decidir si la noticia es sobre una implementación tecnológica del cliente.
+        El uso se etiqueta con la URL de la noticia, la misma clave de tendencia que usa el matcher.
         """
         if not self.model:
             return True, summary # Si no hay modelo, pasamos todo por defecto
@@ -39,11 +167,7 @@ class InnovationIngestor:
         ARTÍCULO:
         Título: {title}
         Resumen: {summary}
-        
-        CRITERIOS DE RELEVANCIA:
-        - SÍ es relevante si menciona: Migraciones cloud, uso de IA, nuevos sistemas core, digitalización, ciberseguridad, automatización.
-        - NO es relevante si es: Resultados financieros puros, cambios de directiva, litigios legales, huelgas, o noticias generales del sector sin mencionar a la empresa específicamente en un contexto tech.
-        
+        {RELEVANCE_CRITERIA}
         SALIDA (JSON Estricto):
         {{
             "is_relevant": true/false,
@@ -52,13 +176,218 @@ class InnovationIngestor:
         """
         
         try:
-            response = self.model.generate_content(prompt)
-            data = json.loads(response.text.replace("```json", "").replace("```", ""))
+            data = parse_json(self.llm.generate(prompt, cache_if=is_json, site="relevance",
+                                                tags={"client_keys": [client_id], "trend_key": url or title}))
             return data.get("is_relevant", False), data.get("new_summary", summary)
         except Exception as e:
             print(f"      ⚠️ Error LLM: {e}")
             return True, summary # En caso de duda o error, guardamos.
 
+    def evaluate_news_batch_with_llm(self, articles, client_name, client_id=None, urls=None):
+        """
+        Evalúa varios artículos (lista de (título, resumen), con sus urls) para un cliente en una sola llamada.
+        Retorna una lista de (is_relevant, new_summary) en el mismo orden.
+        Si el arreglo viene mal formado, los artículos afectados se evalúan uno a uno.
+        """
+        if not self.model:
+            return [(True, summary) for _, summary in articles]
+        if len(articles) == 1:
+            return [self.evaluate_news_with_llm(articles[0][0], articles[0][1], client_name, client_id, urls[0] if urls else None)]
+
+        articles_block = "\n".join(
+            f"[{i}] Título: {title}\n    Resumen: {summary}" for i, (title, summary) in enumerate(articles)
+        )
+        prompt = f"""
+        ERES: Analista de Inteligencia Tecnológica.
+        
+        OBJETIVO: Para CADA artículo, determinar si habla sobre una adopción, implementación o proyecto tecnológico específico de la empresa '{client_name}'.
+        
+        ARTÍCULOS:
+        {articles_block}
+        {RELEVANCE_CRITERIA}
+        SALIDA (JSON Estricto, un arreglo con un objeto por artículo, en el mismo orden):
+        [
+            {{
+                "index": <numero_del_articulo>,
+                "is_relevant": true/false,
+                "new_summary": "Resumen de 1 linea enfocando SOLO lo técnico. Si no es relevante, dejar vacío."
+            }}
+        ]
+        """
+
+        try:
+            # Solo se cachea un arreglo JSON completo; uno mal formado se reevalúa por ítem
+            text = self.llm.generate(prompt, cache_if=lambda t: is_json(t) and isinstance(parse_json(t), list),
+                                     site="relevance_batch", tags={"client_keys": [client_id]})
+        except Exception as e:
+            print(f"      ⚠️ Error LLM: {e}")
+            return [(True, summary) for _, summary in articles] # En caso de duda o error, guardamos.
+
+        verdicts = {}
+        try:
+            data = parse_json(text)
+        except ValueError:
+            data = None
+        if isinstance(data, list):
+            for position, item in enumerate(data):
+                if not isinstance(item, dict) or not isinstance(item.get("is_relevant"), bool):
+                    continue
+                index = item.get("index", position)
+                if isinstance(index, int) and 0 <= index < len(articles):
+                    verdicts[index] = (item["is_relevant"], item.get("new_summary", articles[index][1]))
+
+        results = []
+        for i, (title, summary) in enumerate(articles):
+            if i in verdicts:
+                results.append(verdicts[i])
+            else:
+                # Fallback individual para entradas faltantes o mal formadas
+                results.append(self.evaluate_news_with_llm(title, summary, client_name, client_id, urls[i] if urls else None))
+        return results
+
+    def _host_slot(self, url):
+        """
+        Semáforo por host para no saturar un mismo servidor con descargas paralelas.
+        """
+        host = urlparse(url).netloc
+        with self._host_slots_lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.per_host_limit)
+            return self._host_slots[host]
+
+    def _fetch_source(self, source):
+        """
+        Descarga un feed respetando el límite de concurrencia por host. Se ejecuta en el pool.
+        Envía If-None-Match / If-Modified-Since si conocemos la versión anterior del feed.
+        """
+        headers = {}
+        if source.get('etag'):
+            headers['If-None-Match'] = source['etag']
+        if source.get('last_modified'):
+            headers['If-Modified-Since'] = source['last_modified']
+
+        with self._host_slot(source['url']):
+            started = time.perf_counter()
+            resp = self.session.get(source['url'], timeout=self.timeout, headers=headers)
+            return resp, (time.perf_counter() - started) * 1000
+
+    def _check_feed(self, source, resp, stats):
+        """
+        Detecta feeds sin cambios (304 o mismo hash de contenido) para omitir parseo e IA.
+        Generador de logs que retorna el estado de caché a persistir, o None si no hay cambios.
+        """
+        source_name = source['name']
+
+        if resp.status_code == 304:
+            stats["not_modified"] += 1
+            yield {"type": "log", "message": f"     ♻️ {source_name}: sin cambios (304)."}
+            return None
+
+        stats["bytes"] += len(resp.content or b"")
+        content_hash = hashlib.sha256(resp.content if isinstance(resp.content, bytes) else str(resp.content).encode()).hexdigest()
+        if source.get('content_hash') == content_hash:
+            stats["same_hash"] += 1
+            yield {"type": "log", "message": f"     ♻️ {source_name}: contenido idéntico, se omite."}
+            return None
+
+        stats["changed"] += 1
+        return {
+            "etag": resp.headers.get('ETag'),
+            "last_modified": resp.headers.get('Last-Modified'),
+            "content_hash": content_hash
+        }
+
+    def _ingest_parsed(self, source, parsed, state, real_trends, stats):
+        """
+        Agrupa duplicados, evalúa relevancia con IA (fuentes de cliente) y agrega las
+        tendencias normalizadas por normalize_feed a real_trends. Retorna un generador de logs.
+        """
+        source_name = source['name']
+        client_data = source.get('clients')
+        assigned_client_name = client_data.get('name') if client_data else None
+        items = parsed["items"]
+
+        if source.get('id') is not None:
+            if source['id'] in self._source_health:
+                self._source_health[source['id']]["last_entry_count"] = parsed["entry_count"]
+            # Con entradas pendientes por el tope, el caché de GET condicional se limpia: si no, la próxima
+            # corrida recibiría 304 (o el mismo hash) y esas entradas no se ingerirían nunca
+            cache = dict.fromkeys(state, None) if parsed["dropped"] else state
+            self._pending_source_state.setdefault(source['id'], {}).update({**cache, **parsed["watermark"]})
+
+        if not parsed["entry_count"]:
+            return
+
+        yield {"type": "log", "message": f"     ✅ {source_name}: {parsed['entry_count']} artículos detectados, {len(items)} nuevos."}
+        if parsed["dropped"]:
+            yield {"type": "log", "message": f"     ✂️ {source_name}: {parsed['dropped']} artículos nuevos exceden el máximo por fuente ({self.max_entries_per_source}); quedan para la próxima corrida."}
+
+        candidates = []
+        # Candidatos de este lote: sus casi-duplicados se agrupan antes de la IA (al índice global entran si son relevantes)
+        batch_index = NearDuplicateIndex(self.dedup_max_distance)
+        for item in items:
+            # La tendencia queda ligada a su fuente por clave (vista active_trends)
+            item["source_id"] = source.get('id')
+            # Casi-duplicados: se agrupan en la tendencia canónica sin pasar por la IA
+            canonical = self._dedup_index.find(item["fingerprint"]) or batch_index.find(item["fingerprint"])
+            if canonical is not None:
+                stats["duplicates"] += 1
+                if add_alternate_source(canonical, source_name, item["url"]) and canonical.get('_persisted'):
+                    self._touched_canonicals[canonical['url']] = canonical
+                yield {"type": "log", "message": f"     🧬 Duplicado de '{canonical['title'][:30]}...' en {source_name}, se agrupa."}
+                continue
+            batch_index.add(item["fingerprint"], item)
+            candidates.append(item)
+
+        # Fuentes de cliente: la relevancia se evalúa con IA en lotes
+        verdicts = [(True, item["summary"]) for item in candidates]
+        if assigned_client_name:
+            for start in range(0, len(candidates), self.llm_batch_size):
+                batch = candidates[start:start + self.llm_batch_size]
+                yield {"type": "log", "message": f"     🧠 Analizando con IA para {assigned_client_name}: {len(batch)} artículos en una llamada..."}
+                batch_verdicts = self.evaluate_news_batch_with_llm([(i["title"], i["summary"]) for i in batch], assigned_client_name,
+                                                                    source.get('client_id'), [i["url"] for i in batch])
+                for item, (is_relevant, _) in zip(batch, batch_verdicts):
+                    if is_relevant:
+                        yield {"type": "log", "message": f"       ✅ Relevante (Tech): '{item['title'][:30]}...'"}
+                    else:
+                        yield {"type": "log", "message": f"       🚫 Descartado (No Tech): '{item['title'][:30]}...'"}
+                verdicts[start:start + len(batch)] = batch_verdicts
+                if self.llm and self.llm.last_wait >= 0.5:
+                    yield {"type": "log", "message": f"       ⏳ Esperó {self.llm.last_wait:.1f}s por cuota API."}
+
+        for trend_item, (is_relevant, final_summary) in zip(candidates, verdicts):
+            if is_relevant:
+                trend_item["summary"] = _truncate_summary(final_summary)
+                real_trends.append(trend_item)
+                self._dedup_index.add(trend_item["fingerprint"], trend_item)
+
+    def _load_dedup_index(self, db):
+        """
+        Carga el índice persistente de huellas (tendencias recientes ya guardadas).
+        Retorna un generador de logs.
+        """
+        self._dedup_index = NearDuplicateIndex(self.dedup_max_distance)
+        self._touched_canonicals = {}
+        try:
+            rows = db.fetch_trend_fingerprints(limit=self.dedup_window)
+            for row in rows:
+                canonical = {
+                    "title": row.get("title"),
+                    "source": row.get("source"),
+                    "source_id": row.get("source_id"),
+                    "url": row.get("url"),
+                    "summary": row.get("summary"),
+                    "published": row.get("published_at"),
+                    "fingerprint": row.get("fingerprint"),
+                    "alternate_sources": list(row.get("alternate_sources") or []),
+                    "_persisted": True
+                }
+                self._dedup_index.add(canonical["fingerprint"], canonical)
+            yield {"type": "log", "message": f"   🧬 Índice de huellas cargado: {len(rows)} tendencias previas."}
+        except Exception as e:
+            yield {"type": "log", "message": f"   ⚠️ No se pudo cargar el índice de huellas: {e}"}
+
     def fetch_trends(self):
         """
         Obtiene noticias reales desde los RSS feeds almacenados en Supabase.
@@ -78,67 +407,136 @@ class InnovationIngestor:
             return
 
         real_trends = []
-        
-        for source in rss_feeds_data:
-            source_name = source['name']
-            url = source['url']
-            client_data = source.get('clients') 
-            assigned_client_name = client_data.get('name') if client_data else None
+        stats = {"changed": 0, "not_modified": 0, "same_hash": 0, "bytes": 0, "duplicates": 0, "circuit_open": 0}
+        self._pending_source_state = {}
+        self._source_health = {}
+        yield from self._load_dedup_index(db)
 
-            try:
-                yield {"type": "log", "message": f"  📡 Conectando a {source_name}..."}
-                resp = self.session.get(url, timeout=10)
-                if resp.status_code == 200:
-                    feed = feedparser.parse(resp.content)
-                    
-                    if feed.entries:
-                        count = len(feed.entries)
-                        yield {"type": "log", "message": f"     ✅ {count} artículos detectados."}
-                        
-                        for entry in feed.entries[:5]: # Top 5 recent
-                            summary_text = entry.get('summary', '') or entry.get('description', '')
-                            title_text = entry.get('title', 'Sin Título')
-                            
-                            final_summary = summary_text
-                            is_relevant = True
-                            
-                            if assigned_client_name:
-                                yield {"type": "log", "message": f"     🧠 Analizando con IA para {assigned_client_name}: '{title_text[:30]}...'"}
-                                is_relevant, ai_summary = self.evaluate_news_with_llm(title_text, summary_text, assigned_client_name)
-                                if is_relevant:
-                                    final_summary = ai_summary
-                                    yield {"type": "log", "message": "       ✅ Relevante (Tech)."}
-                                else:
-                                    yield {"type": "log", "message": "       🚫 Descartado (No Tech)."}
-                            
-                            if is_relevant:
-                                trend_item = {
-                                    "id": entry.get('link', str(time.time())),
-                                    "title": title_text,
-                                    "source": source_name,
-                                    "published": entry.get('published', str(datetime.now())),
-                                    "url": entry.get('link', ''),
-                                    "summary": final_summary[:500] + "..." if len(final_summary) > 500 else final_summary,
-                                    "tags": [t.term for t in entry.get('tags', [])] if 'tags' in entry else []
-                                }
-                                real_trends.append(trend_item)
-            except Exception as e:
-                yield {"type": "log", "message": f"     ❌ Error leyendo {source_name}: {str(e)}"}
+        # Descarga concurrente: los eventos se emiten en orden de llegada.
+        # Con parse_workers > 0 el parseo de cada feed descargado se delega a un pool de procesos.
+        parse_pool = ProcessPoolExecutor(max_workers=self.parse_workers) if self.parse_workers else None
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                tasks = {}
+                for source in rss_feeds_data:
+                    open_until = circuit_open_until(source)
+                    if open_until:
+                        stats["circuit_open"] += 1
+                        yield {"type": "log", "message": f"  ⛔ {source['name']}: suspendida hasta {open_until.strftime('%d/%m %H:%M')} UTC ({source.get('consecutive_failures')} fallos seguidos)."}
+                        continue
+                    yield {"type": "log", "message": f"  📡 Conectando a {source['name']}..."}
+                    tasks[pool.submit(self._fetch_source, source)] = ("fetch", source, None)
 
+                pending = set(tasks)
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        stage, source, state = tasks.pop(future)
+                        try:
+                            if stage == "fetch":
+                                resp, latency_ms = future.result()
+                                if resp.status_code not in (200, 304):
+                                    raise requests.HTTPError(f"HTTP {resp.status_code}")
+                                if source.get('id') is not None:
+                                    self._source_health[source['id']] = record_success(source, latency_ms, len(resp.content or b""))
+
+                                state = yield from self._check_feed(source, resp, stats)
+                                if state is None:
+                                    continue
+                                parse_args = (resp.content, source['name'], source.get('last_entry_id'),
+                                              source.get('last_entry_published'), self.max_entries_per_source)
+                                if parse_pool:
+                                    parse_future = parse_pool.submit(normalize_feed, *parse_args)
+                                    tasks[parse_future] = ("parse", source, state)
+                                    pending.add(parse_future)
+                                    continue
+                                parsed = normalize_feed(*parse_args)
+                            else:
+                                parsed = future.result()
+
+                            yield from self._ingest_parsed(source, parsed, state, real_trends, stats)
+                        except Exception as e:
+                            if source.get('id') is not None:
+                                self._source_health[source['id']] = record_failure(source, e)
+                            yield {"type": "log", "message": f"     ❌ Error leyendo {source['name']}: {str(e)}"}
+        finally:
+            if parse_pool:
+                parse_pool.shutdown()
+            # También si la ingesta se cancela a mitad (generador cerrado): la salud ya medida no se pierde
+            self._commit_source_health(db)
+
+        if stats["circuit_open"]:
+            yield {"type": "log", "message": f"⛔ Fuentes omitidas por circuit breaker: {stats['circuit_open']}."}
+
+        skipped = stats["not_modified"] + stats["same_hash"]
+        yield {"type": "log", "message": f"♻️ Caché de feeds: {skipped} sin cambios (304: {stats['not_modified']}, hash: {stats['same_hash']}), {stats['changed']} actualizadas, {stats['bytes'] / 1024:.1f} KB descargados."}
+        touched = list(self._touched_canonicals.values())
+        yield {"type": "log", "message": f"🧬 Duplicados agrupados: {stats['duplicates']} ({len(touched)} tendencias existentes con nuevas fuentes alternativas)."}
         yield {"type": "log", "message": f"🏁 Ingesta finalizada. Total: {len(real_trends)} tendencias."}
-        yield {"type": "result", "data": real_trends}
+        yield {"type": "result", "data": real_trends + touched}
+
+    def _commit_source_health(self, db):
+        """
+        Persiste la salud de cada fuente consultada, independiente de si se guardan tendencias.
+        """
+        for source_id, fields in self._source_health.items():
+            try:
+                db.update_source_state(source_id, fields)
+            except Exception as e:
+                print(f"⚠️ Error guardando salud de fuente {source_id}: {e}")
+        self._source_health = {}
 
     def save_trends(self, trends):
         db = DatabaseClient()
-        db.save_trends(trends)
-        print(f"💾 {len(trends)} tendencias guardadas en Supabase.")
+        summaries = db.save_trends(trends, count_existing=True)
+        saved = sum(s.get("rows", 0) - s.get("failed", 0) for s in summaries)
+        failed = sum(s.get("failed", 0) for s in summaries)
+        print(f"💾 Tendencias guardadas en Supabase: {saved} guardadas, {failed} fallidas.")
+        for s in summaries:
+            if s.get("inserted") is not None:
+                print(f"   Lote {s['chunk']}: {s['inserted']} nuevas, {s['updated']} actualizadas.")
 
-if __name__ == "__main__":
-    ingestor = InnovationIngestor()
-    trends = ingestor.fetch_trends()
-    ingestor.save_trends(trends)
+        if failed:
+            # Sin confirmar el estado, la próxima ingesta vuelve a descargar estos feeds
+            print("⚠️ Hubo lotes fallidos: no se actualiza la caché ni la marca de agua de las fuentes.")
+            self._pending_source_state = {}
+        else:
+            self.commit_source_state()
+        return summaries
+
+    def commit_source_state(self):
+        """
+        Persiste el estado de las fuentes (ETag, Last-Modified, hash) de la última ingesta.
+        Se llama después de guardar las tendencias para no marcar como vistos feeds que no se guardaron.
+        """
+        db = DatabaseClient()
+        for source_id, fields in self._pending_source_state.items():
+            try:
+                db.update_source_state(source_id, fields)
+            except Exception as e:
+                print(f"⚠️ Error guardando estado de fuente {source_id}: {e}")
+        self._pending_source_state = {}
+
+    def save_usage(self, run_id=None):
+        """
+        Persiste en llm_calls el uso de Gemini registrado desde la última vez, asociado a run_id.
+        """
+        try:
+            return self.usage.flush(DatabaseClient(), run_id)
+        except Exception as e:
+            print(f"⚠️ No se pudo guardar el uso de Gemini: {e}")
+            return 0
 
 if __name__ == "__main__":
     ingestor = InnovationIngestor()
-    trends = ingestor.fetch_trends()
-    ingestor.save_trends(trends)
+    trends = []
+    for update in ingestor.fetch_trends():
+        if update["type"] == "log":
+            print(update["message"])
+        elif update["type"] == "result":
+            trends = update["data"]
+    if trends:
+        ingestor.save_trends(trends)
+    else:
+        ingestor.commit_source_state()
+    ingestor.save_usage()
@@ -0,0 +1,266 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from db_client import DatabaseClient
+from rate_limiter import get_rate_limiter
+from scheduler import DEFAULT_LOCK_PATH, JobLock, matching_kwargs, resume_matching, run_ingest, run_matching
+
+ACTIVE_STATUSES = ("queued", "running")
+DEFAULT_MAX_RUNNING = 2 # Trabajos simultáneos entre todos los workers
+HEARTBEAT_S = 1.0 # Cada cuánto se publican eventos, se marca el latido y se revisa la cancelación
+STALE_S = 600 # Un trabajo sin latido por este lapso se da por perdido (worker caído)
+LOCK_PATH = DEFAULT_LOCK_PATH # Lock del cron: los trabajos no se superponen con sus ciclos (sí entre ellos)
+
+def job_key(kind, params):
+    """
+    Clave de deduplicación: mismo tipo y mismos parámetros = mismo trabajo.
+    """
+    payload = json.dumps([kind, params or {}], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _run_matching_job(params, **hooks):
+    return run_matching(stream_pitch=params.get("stream_pitch", False), **matching_kwargs(params), **hooks)
+
+def _resume_job(params, **hooks):
+    return resume_matching(params["run_id"], stream_pitch=params.get("stream_pitch", False), **hooks)
+
+def _ingest_job(params, **hooks):
+    return run_ingest(parse_workers=params.get("parse_workers", 0), **hooks)
+
+# Tipo de trabajo -> función(params, log=, on_event=, cancelled=) que retorna el estado de la corrida
+JOB_RUNNERS = {
+    "ingest": _ingest_job,
+    "matching": _run_matching_job,
+    "resume": _resume_job,
+}
+
+def event_row(job_id, event):
+    """
+    Evento del ingestor/matcher -> fila de job_events. El resultado final se resume (ya quedó guardado en la base).
+    """
+    kind = event["type"]
+    row = {"job_id": job_id, "type": kind, "message": None, "data": None}
+    if kind == "log":
+        row["message"] = event["message"]
+    elif kind == "result":
+        row["data"] = {"items": len(event.get("data") or [])}
+    elif kind == "run":
+        row["data"] = {"run_id": event["run_id"]}
+    else:
+        row["data"] = {k: v for k, v in (event.get("data") or {}).items() if k != "ledger"}
+    return row
+
+class JobQueue:
+    """
+    Encolar, listar y cancelar trabajos; leer su avance (job_events). Lo usan el dashboard y la CLI.
+    """
+    def __init__(self, db=None):
+        self.db = db or DatabaseClient()
+
+    def enqueue(self, kind, params=None):
+        """
+        Encola un trabajo, o retorna el pendiente/en curso idéntico (con deduplicated=True).
+        """
+        if kind not in JOB_RUNNERS:
+            raise ValueError(f"Tipo de trabajo desconocido: {kind}")
+        key = job_key(kind, params)
+        existing = self.db.fetch_active_job(key)
+        if existing:
+            return dict(existing, deduplicated=True)
+        try:
+            return dict(self.db.enqueue_job(kind, params or {}, key), deduplicated=False)
+        except Exception:
+            # Otro usuario lo encoló entre medio: el índice único parcial rechaza el duplicado
+            existing = self.db.fetch_active_job(key)
+            if existing:
+                return dict(existing, deduplicated=True)
+            raise
+
+    def get(self, job_id):
+        return self.db.fetch_job(job_id)
+
+    def active(self, kind=None, limit=20):
+        return self.db.fetch_jobs(kind=kind, statuses=ACTIVE_STATUSES, limit=limit)
+
+    def cancel(self, job_id):
+        self.db.request_job_cancel(job_id)
+
+    def events(self, job_id, after_id=0):
+        return self.db.fetch_job_events(job_id, after_id=after_id)
+
+class JobReporter:
+    """
+    Publica por tandas los eventos de un trabajo en job_events, mantiene su latido y detecta
+    la cancelación pedida desde el dashboard. Un hilo propio late aunque no haya eventos.
+    """
+    def __init__(self, db, job_id, interval=None):
+        self.db = db
+        self.job_id = job_id
+        self.interval = interval or HEARTBEAT_S
+        self.run_id = None
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._beat_loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.beat()
+
+    def on_event(self, event):
+        if event["type"] == "run":
+            self.run_id = event["run_id"]
+            self._safe(self.db.update_job, self.job_id, {"run_id": self.run_id})
+        with self._lock:
+            self._buffer.append(event_row(self.job_id, event))
+
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def _beat_loop(self):
+        while not self._stop.wait(self.interval):
+            self.beat()
+
+    def beat(self):
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+        if rows and not self._safe(self.db.add_job_events, rows)[0]:
+            with self._lock:
+                self._buffer = rows + self._buffer # Se reintenta en el próximo latido
+        # El limitador de cuota vive en el proceso del worker: su estado viaja con el latido para el dashboard
+        self._safe(self.db.update_job, self.job_id, {"heartbeat_at": datetime.now(timezone.utc).isoformat(),
+                                                     "throttle": get_rate_limiter().state()})
+        _, job = self._safe(self.db.fetch_job, self.job_id)
+        if job and job.get("cancel_requested"):
+            self._cancel.set()
+
+    def _safe(self, func, *args):
+        # (ok, resultado): un corte de la base no debe detener el trabajo en curso
+        try:
+            return True, func(*args)
+        except Exception as e:
+            print(f"⚠️ Trabajo #{self.job_id}: no se pudo actualizar su estado: {e}")
+            return False, None
+
+def _wait_for_lock(lock, reporter):
+    """
+    Toma el lock del trabajo; si hay un ciclo del cron en curso, espera latiendo.
+    Retorna False si el trabajo se canceló mientras esperaba.
+    """
+    if lock.acquire():
+        return True
+    reporter.on_event({"type": "log", "message": "⏳ Hay un ciclo del cron en curso, esperando a que termine..."})
+    while not lock.acquire():
+        if reporter.cancelled():
+            return False
+        time.sleep(reporter.interval)
+    return True
+
+def execute_job(job, db=None):
+    """
+    Ejecuta un trabajo ya tomado (status running) y registra su estado final. Retorna ese estado.
+    Un trabajo y un ciclo del cron nunca se superponen; entre trabajos, la concurrencia la fija max_running.
+    """
+    db = db or DatabaseClient()
+    reporter = JobReporter(db, job["id"]).start()
+    lock = JobLock(LOCK_PATH, job["id"])
+    status, error = "failed", None
+    try:
+        if not _wait_for_lock(lock, reporter):
+            status = "cancelled"
+        else:
+            runner = JOB_RUNNERS.get(job["kind"])
+            if runner is None:
+                raise ValueError(f"Tipo de trabajo desconocido: {job['kind']}")
+            status = runner(job.get("params") or {}, log=lambda m: print(f"   [#{job['id']}] {m}"),
+                            on_event=reporter.on_event, cancelled=reporter.cancelled)
+            if status is None:
+                status, error = "failed", "Corrida a reanudar no encontrada"
+    except Exception as e:
+        error = str(e)
+        print(f"❌ Trabajo #{job['id']} fallido: {e}")
+    finally:
+        lock.release()
+        reporter.stop()
+    db.update_job(job["id"], {"status": status, "error": error, "finished_at": datetime.now(timezone.utc).isoformat()})
+    return status
+
+def worker_loop(name=None, max_running=DEFAULT_MAX_RUNNING, poll_interval=2.0, once=False, db=None):
+    """
+    Toma trabajos de la cola y los ejecuta, uno a la vez. Con once termina cuando no quedan trabajos
+    (o el tope de concurrencia no deja tomar más). Retorna cuántos ejecutó.
+    """
+    db = db or DatabaseClient()
+    name = name or f"{socket.gethostname()}:{os.getpid()}"
+    executed = 0
+    while True:
+        try:
+            job = db.claim_job(name, max_running, STALE_S)
+        except Exception as e:
+            print(f"⚠️ [{name}] No se pudo consultar la cola: {e}")
+            job = None
+        if job is None:
+            if once:
+                return executed
+            time.sleep(poll_interval)
+            continue
+        print(f"🛠️ [{name}] Trabajo #{job['id']} ({job['kind']})...")
+        status = execute_job(job, db)
+        print(f"🏁 [{name}] Trabajo #{job['id']}: {status}.")
+        executed += 1
+
+def run_worker_pool(workers=2, max_running=DEFAULT_MAX_RUNNING, poll_interval=2.0):
+    """
+    Lanza workers procesos locales; cada uno corre worker_loop. El tope global lo impone claim_job.
+    """
+    host = socket.gethostname()
+    processes = [
+        multiprocessing.Process(target=worker_loop, kwargs={"name": f"{host}:w{i}", "max_running": max_running, "poll_interval": poll_interval})
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    print(f"👷 {workers} workers activos (máx. {max_running} trabajos simultáneos). Ctrl+C para detener.")
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        print("👋 Workers detenidos.")
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="InnovA Radar: workers de la cola de trabajos (ingesta y matching).")
+    parser.add_argument("--workers", type=int, default=2, help="Procesos worker locales")
+    parser.add_argument("--max-running", type=int, default=DEFAULT_MAX_RUNNING, help="Tope de trabajos simultáneos entre todos los workers")
+    parser.add_argument("--poll", type=float, default=2.0, help="Segundos entre consultas a la cola vacía")
+    parser.add_argument("--once", action="store_true", help="Vaciar la cola en este proceso y salir")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.once:
+        worker_loop(max_running=args.max_running, once=True)
+        return
+    run_worker_pool(workers=args.workers, max_running=args.max_running, poll_interval=args.poll)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from rate_limiter import get_rate_limiter, estimate_tokens, is_rate_limit_error, retry_after_seconds
+from usage import usage_counts
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CACHE_PATH = os.path.join(PROJECT_ROOT, ".cache", "llm_cache.sqlite")
+DEFAULT_TTL = 7 * 24 * 3600 # 7 días
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+
+def parse_json(text):
+    """
+    json.loads tolerante a bloques ```json ... ``` en la respuesta.
+    """
+    return json.loads(text.replace("```json", "").replace("```", ""))
+
+def is_json(text):
+    try:
+        parse_json(text)
+        return True
+    except ValueError:
+        return False
+
+def _chunk_text(chunk):
+    # Un fragmento sin partes de texto (p. ej. el de cierre con usage_metadata) hace fallar .text en el SDK
+    try:
+        return chunk.text or ""
+    except (ValueError, AttributeError):
+        return ""
+
+def _scan_string(text, start):
+    """
+    Lee un literal JSON que abre en text[start] ('"'). Retorna (valor decodificado, cerrado, índice tras el literal).
+    Si el literal está incompleto retorna lo decodificable hasta ahora (sin escapes a medias).
+    """
+    i = start + 1
+    while i < len(text):
+        if text[i] == "\\":
+            i += 2
+            continue
+        if text[i] == '"':
+            return json.loads(text[start:i + 1]), True, i + 1
+        i += 1
+    raw = text[start + 1:]
+    # Recorta un escape incompleto al final (\ o \uXX) antes de decodificar
+    cut = raw.rfind("\\")
+    if cut != -1 and (len(raw) - cut < 2 or (raw[cut + 1] == "u" and len(raw) - cut < 6)):
+        raw = raw[:cut]
+    try:
+        return json.loads(f'"{raw}"'), False, len(text)
+    except ValueError:
+        return "", False, len(text)
+
+def _field_start(text, field):
+    match = re.search(rf'"{field}"\s*:\s*', text)
+    return match.end() if match else None
+
+def partial_json_fields(text):
+    """
+    Extrae de una respuesta JSON aún incompleta (streaming) los campos del análisis de match:
+    {"match_score": int | None, "reasoning": [ítems completos], "generated_pitch": texto parcial, "pitch_done": bool}.
+    """
+    fields = {"match_score": None, "reasoning": [], "generated_pitch": "", "pitch_done": False}
+    score = re.search(r'"match_score"\s*:\s*(-?\d+(?:\.\d+)?)\s*[,}\s]', text)
+    if score:
+        fields["match_score"] = int(float(score.group(1)))
+
+    start = _field_start(text, "reasoning")
+    if start is not None and text[start:start + 1] == "[":
+        i = start + 1
+        while True:
+            while i < len(text) and text[i] in " \t\r\n,":
+                i += 1
+            if i >= len(text) or text[i] != '"':
+                break
+            value, closed, i = _scan_string(text, i)
+            if not closed:
+                break
+            fields["reasoning"].append(value)
+
+    start = _field_start(text, "generated_pitch")
+    if start is not None and text[start:start + 1] == '"':
+        fields["generated_pitch"], fields["pitch_done"], _ = _scan_string(text, start)
+    return fields
+
+def cache_key(model_name, prompt, generation_config=None):
+    """
+    Clave de contenido: hash de (modelo, prompt, configuración de generación).
+    """
+    payload = json.dumps([model_name, prompt, generation_config], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class LLMCache:
+    """
+    Caché persistente (SQLite) de respuestas del LLM con TTL y expulsión LRU por tamaño.
+    Es seguro compartirlo entre hilos.
+    """
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            create table if not exists llm_cache (
+                key text primary key,
+                response text not null,
+                size integer not null,
+                created_at real not null,
+                last_access real not null
+            )
+        """)
+        self._conn.execute("create index if not exists llm_cache_access_idx on llm_cache (last_access)")
+        self._conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("select response, created_at from llm_cache where key = ?", (key,)).fetchone()
+            if row and now - row[1] <= self.ttl:
+                self._conn.execute("update llm_cache set last_access = ? where key = ?", (now, key))
+                self._conn.commit()
+                self.hits += 1
+                return row[0]
+            if row: # Expirada
+                self._conn.execute("delete from llm_cache where key = ?", (key,))
+                self._conn.commit()
+            self.misses += 1
+            return None
+
+    def set(self, key, response):
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "insert or replace into llm_cache (key, response, size, created_at, last_access) values (?, ?, ?, ?, ?)",
+                (key, response, size, now, now)
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # Expira por TTL y luego elimina las menos usadas hasta quedar bajo max_bytes
+        self._conn.execute("delete from llm_cache where created_at < ?", (time.time() - self.ttl,))
+        total = self._conn.execute("select coalesce(sum(size), 0) from llm_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute("select key, size from llm_cache order by last_access asc").fetchall():
+            self._conn.execute("delete from llm_cache where key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+def get_shared_cache():
+    """
+    Caché compartido por todos los llamadores de Gemini del proceso.
+    Configurable con LLM_CACHE_PATH, LLM_CACHE_TTL y LLM_CACHE_MAX_MB.
+    """
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = LLMCache(
+                path=os.getenv("LLM_CACHE_PATH", DEFAULT_CACHE_PATH),
+                ttl=int(os.getenv("LLM_CACHE_TTL", DEFAULT_TTL)),
+                max_bytes=int(float(os.getenv("LLM_CACHE_MAX_MB", DEFAULT_MAX_BYTES / (1024 * 1024))) * 1024 * 1024)
+            )
+        return _shared_cache
+
+class LLMClient:
+    """
+    Punto único de llamada a Gemini (generate_content) para matcher e ingestor.
+    Aplica el caché de respuestas (use_cache=False o LLM_CACHE_BYPASS=1 lo desactivan)
+    y el limitador de cuota compartido, con reintentos ante 429. Con usage (UsageTracker)
+    registra tokens, latencia y costo de cada llamada.
+    """
+    def __init__(self, model, use_cache=True, cache=None, rate_limiter=None, max_retries=4, expected_output_tokens=500, usage=None):
+        self.model = model
+        self.usage = usage
+        self.rate_limiter = rate_limiter or get_rate_limiter()
+        self.max_retries = max_retries
+        self.expected_output_tokens = expected_output_tokens
+        # Segundos esperados por cuota en la última llamada (para los logs); uno por hilo
+        self._local = threading.local()
+        self.use_cache = use_cache and os.getenv("LLM_CACHE_BYPASS", "") not in ("1", "true", "True")
+        self._cache = cache
+        # Contadores propios de este cliente (el caché compartido lleva los globales)
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    @property
+    def model_name(self):
+        name = getattr(self.model, "model_name", None)
+        return name if isinstance(name, str) else None
+
+    @property
+    def last_wait(self):
+        return getattr(self._local, "last_wait", 0.0)
+
+    @last_wait.setter
+    def last_wait(self, value):
+        self._local.last_wait = value
+
+    @property
+    def cache(self):
+        if self._cache is None and self.use_cache:
+            self._cache = get_shared_cache()
+        return self._cache
+
+    def generate(self, prompt, generation_config=None, cache_if=None, bypass_cache=False, expected_output_tokens=None,
+                 site="general", tags=None):
+        """
+        Retorna el texto de la respuesta. Solo se cachean respuestas exitosas que
+        cumplan cache_if(texto) (ej. JSON válido); las excepciones nunca se cachean.
+        expected_output_tokens ajusta la reserva de TPM para respuestas largas (prompts por lote).
+        site y tags ({"client_keys": [...], "trend_key": ...}) etiquetan la llamada en el registro de uso.
+        """
+        self.last_wait = 0.0
+        cache, key, cached = self._lookup(prompt, generation_config, bypass_cache, site, tags)
+        if cached is not None:
+            return cached
+
+        response, latency_ms = self._call_with_retries(
+            prompt, lambda: self._generate_content(prompt, generation_config), expected_output_tokens)
+        text = response.text
+        self._record_usage(site, tags, prompt, text, response, latency_ms)
+
+        if cache and isinstance(text, str) and text.strip() and (cache_if is None or cache_if(text)):
+            cache.set(key, text)
+        return text
+
+    def generate_stream(self, prompt, generation_config=None, cache_if=None, bypass_cache=False, expected_output_tokens=None,
+                        site="general", tags=None):
+        """
+        Igual que generate, pero es un generador de fragmentos de texto a medida que Gemini los produce
+        (generate_content(stream=True)). Un acierto de caché entrega la respuesta completa en un solo fragmento.
+        Los reintentos ante 429 solo aplican antes del primer fragmento; el uso y el caché se registran al final.
+        """
+        self.last_wait = 0.0
+        cache, key, cached = self._lookup(prompt, generation_config, bypass_cache, site, tags)
+        if cached is not None:
+            yield cached
+            return
+
+        started = time.perf_counter()
+        (response, chunks, first), _ = self._call_with_retries(
+            prompt, lambda: self._open_stream(prompt, generation_config), expected_output_tokens)
+        parts = []
+        chunk = first
+        while chunk is not None:
+            piece = _chunk_text(chunk)
+            if piece:
+                parts.append(piece)
+                yield piece
+            chunk = next(chunks, None)
+        text = "".join(parts)
+        self._record_usage(site, tags, prompt, text, response, (time.perf_counter() - started) * 1000)
+
+        if cache and text.strip() and (cache_if is None or cache_if(text)):
+            cache.set(key, text)
+
+    def _lookup(self, prompt, generation_config, bypass_cache, site, tags):
+        """
+        (cache, key, texto cacheado o None). Un acierto queda registrado como llamada cacheada.
+        """
+        cache = None if bypass_cache or not self.use_cache or not self.model_name else self.cache
+        key = cache_key(self.model_name, prompt, generation_config) if cache else None
+        if not cache:
+            return None, None, None
+        cached = cache.get(key)
+        with self._stats_lock:
+            if cached is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if cached is not None and self.usage is not None:
+            self.usage.record(site, self.model_name, latency_ms=0, cached=True, tags=tags)
+        return cache, key, cached
+
+    def _generate_content(self, prompt, generation_config):
+        if generation_config is None:
+            return self.model.generate_content(prompt)
+        return self.model.generate_content(prompt, generation_config=generation_config)
+
+    def _open_stream(self, prompt, generation_config):
+        # El primer fragmento se pide dentro del intento: un 429 puede llegar recién al iterar
+        if generation_config is None:
+            response = self.model.generate_content(prompt, stream=True)
+        else:
+            response = self.model.generate_content(prompt, generation_config=generation_config, stream=True)
+        chunks = iter(response)
+        return response, chunks, next(chunks, None)
+
+    def _call_with_retries(self, prompt, request, expected_output_tokens=None):
+        """
+        Admisión por el limitador y reintentos con backoff ante 429 / ResourceExhausted.
+        request() hace la llamada; retorna (su resultado, latencia en ms).
+        """
+        output_tokens = expected_output_tokens or self.expected_output_tokens
+        for attempt in range(self.max_retries + 1):
+            self.last_wait += self.rate_limiter.acquire(estimate_tokens(prompt) + output_tokens)
+            try:
+                started = time.perf_counter()
+                result = request()
+                self.rate_limiter.record_success()
+                return result, (time.perf_counter() - started) * 1000
+            except Exception as e:
+                if attempt >= self.max_retries or not is_rate_limit_error(e):
+                    raise
+                delay = self.rate_limiter.penalize(attempt, retry_after_seconds(e))
+                print(f"      ⏳ Cuota Gemini agotada (429), reintento {attempt + 1}/{self.max_retries} en {delay:.1f}s...")
+
+    def _record_usage(self, site, tags, prompt, text, response, latency_ms):
+        if self.usage is None:
+            return
+        prompt_tokens, output_tokens, total_tokens = usage_counts(response)
+        estimated = prompt_tokens is None or output_tokens is None
+        if estimated:
+            # Sin usage_metadata: estimamos por caracteres para no perder la llamada
+            prompt_tokens = estimate_tokens(prompt) if prompt_tokens is None else prompt_tokens
+            output_tokens = estimate_tokens(text if isinstance(text, str) else "") if output_tokens is None else output_tokens
+        self.usage.record(site, self.model_name, prompt_tokens, output_tokens, total_tokens,
+                          latency_ms=latency_ms, wait_s=self.last_wait, estimated=estimated, tags=tags)
+
+    def cache_stats(self):
+        return {"hits": self.hits, "misses": self.misses}
@@ -1,19 +1,123 @@
+import hashlib
 import json
 import os
-import time
+import queue
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 import google.generativeai as genai
 from dotenv import load_dotenv
 from db_client import DatabaseClient
+from llm_client import LLMClient, is_json, parse_json, partial_json_fields
+from rate_limiter import estimate_tokens
+from usage import UsageTracker
+from client_digest import ClientDigester, DEFAULT_DIGEST_TOKENS, digest_to_text, is_fresh
+from vector_index import SimilarityIndex, VectorCache, DEFAULT_CACHE_PATH
+from priority import MatchBudget, rank_pairs
 
 # Cargar variables de entorno (.env)
 load_dotenv()
 
+if os.getenv("GEMINI_BACKEND", "").lower() == "fake":
+    import fake_gemini as genai # Sustituto local sin red ni cuota (benchmarks, demos)
+
+CLIENT_CONTEXT_CHARS = 4000 # Contexto tecnológico máximo por cliente en el prompt
+GROUP_PROMPT_TOKENS = 700 # Instrucciones fijas del prompt por lote
+GROUP_OUTPUT_TOKENS = 450 # Respuesta esperada por cliente (score, razones, pitch)
+DEFAULT_MODEL = "gemini-flash-latest"
+TRIAGE_OUTPUT_TOKENS = 80 # Score + una línea de razón
+PROMPT_VERSION = "match-v1" # Subirla al cambiar los prompts o el criterio de puntaje: invalida el ledger
+TRIAGE_PROMPT_VERSION = "triage-v1" # Pares descartados por el triage: en el ledger no cuentan como análisis completo
+PITCH_DELTA_CHARS = 40 # Texto mínimo de pitch nuevo por evento en modo streaming
+STREAM_POLL_S = 0.05 # Cada cuánto se revisan los eventos de streaming mientras corren las llamadas
+
+def _sha256(values):
+    return hashlib.sha256(json.dumps(values, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+def client_key(client):
+    return str(client.get('id') or client.get('name'))
+
+def trend_key(trend):
+    return trend.get('url') or str(trend.get('id') or trend.get('title'))
+
+def client_context(client, use_digest=True, token_budget=DEFAULT_DIGEST_TOKENS):
+    """
+    Contexto del cliente que va al prompt: el resumen estructurado si está vigente, si no el texto crudo truncado.
+    """
+    if use_digest and is_fresh(client, token_budget):
+        return digest_to_text(client['context_digest'])
+    return (client.get('tech_context_raw') or '')[:CLIENT_CONTEXT_CHARS]
+
+def client_hash(client, context=None):
+    # Solo lo que entra al prompt: si cambia, el par se reevalúa
+    if context is None:
+        context = client_context(client, use_digest=False)
+    return _sha256([client.get('name'), client.get('industry'), context])
+
+def trend_hash(trend):
+    return _sha256([trend.get('title'), trend.get('source'), trend.get('summary')])
+
+def group_clients_by_budget(clients, token_budget, base_tokens=0, max_group_size=10, context_of=None):
+    """
+    Agrupa clientes (en orden) para compartir un prompt: cada grupo cabe en token_budget
+    contando entrada (perfil) y salida esperada por cliente. Siempre al menos uno por grupo.
+    """
+    context_of = context_of or (lambda c: client_context(c, use_digest=False))
+    groups, current, used = [], [], base_tokens
+    for client in clients:
+        cost = estimate_tokens(context_of(client)) + GROUP_OUTPUT_TOKENS
+        if current and (used + cost > token_budget or len(current) >= max_group_size):
+            groups.append(current)
+            current, used = [], base_tokens
+        current.append(client)
+        used += cost
+    if current:
+        groups.append(current)
+    return groups
+
 class OpportunityMatcher:
-    def __init__(self, trends_path=None, clients_path=None):
+    def __init__(self, trends_path=None, clients_path=None, prefilter_pool=100, prefilter_threshold=None,
+                 vector_cache_path=DEFAULT_CACHE_PATH, use_llm_cache=True, max_concurrency=1,
+                 batch_clients=False, batch_token_budget=8000, use_digest=True, digest_token_budget=DEFAULT_DIGEST_TOKENS,
+                 cascade=False, triage_threshold=40, triage_top_k=None, triage_model=None, pitch_model=None,
+                 stream_pitch=False):
         # Paths ya no se usan con Supabase, pero mantenemos firma por compatibilidad si es necesario
         self.trends_path = trends_path
         self.clients_path = clients_path
+
+        # Pre-filtro local (TF-IDF): tendencias candidatas y similitud mínima opcional
+        self.prefilter_pool = prefilter_pool
+        self.prefilter_threshold = prefilter_threshold
+        self.vector_cache_path = vector_cache_path
+        self._vector_cache = None
+
+        # Pares cliente-tendencia evaluados en paralelo (1 = secuencial); la cuota la cuida el limitador compartido
+        self.max_concurrency = max(1, int(max_concurrency or 1))
+
+        # Modo por lote: una tendencia y varios clientes por prompt, agrupados por presupuesto de tokens
+        self.batch_clients = batch_clients
+        self.batch_token_budget = batch_token_budget
+
+        # Resumen estructurado del contexto del cliente en vez del texto crudo
+        self.use_digest = use_digest
+        self.digest_token_budget = digest_token_budget
+
+        # Cascada: triage barato para todos los pares y análisis completo (pitch) solo para los ganadores
+        self.cascade = cascade
+        self.triage_threshold = triage_threshold
+        self.triage_top_k = triage_top_k
+        pitch_model = pitch_model or os.getenv("GEMINI_PITCH_MODEL", DEFAULT_MODEL)
+        triage_model = triage_model or os.getenv("GEMINI_TRIAGE_MODEL", pitch_model)
+
+        # Streaming del análisis completo: puntaje, razones y pitch se emiten a medida que Gemini los genera
+        self.stream_pitch = stream_pitch
+        self._stream_queue = None
+
+        # Corrida con checkpoints (run_matching_cycle(run_id=...)): cada par se guarda al terminar
+        self._run_id = None
+        self._progress = None
+
+        # Modo anytime (run_matching_cycle(max_calls=..., max_tokens=...)): pares por prioridad hasta agotar el presupuesto
+        self._budget = None
         
         # Configuración de Gemini
         api_key = os.getenv("GEMINI_API_KEY")
@@ -22,8 +126,20 @@ class OpportunityMatcher:
             self.model = None
         else:
             genai.configure(api_key=api_key)
-            # Usamos gemini-flash-latest por eficiencia y compatibilidad
-            self.model = genai.GenerativeModel('gemini-flash-latest')
+            # Usamos gemini-flash-latest por eficiencia y compatibilidad (configurable por etapa)
+            self.model = genai.GenerativeModel(pitch_model)
+        # Todas las llamadas a Gemini pasan por LLMClient (caché de respuestas en disco)
+        # Tokens, latencia y costo de cada llamada (se persisten con save_usage)
+        self.usage = UsageTracker()
+        self.llm = LLMClient(self.model, use_cache=use_llm_cache, usage=self.usage) if self.model else None
+        if self.model and triage_model != pitch_model:
+            self.triage_llm = LLMClient(genai.GenerativeModel(triage_model), use_cache=use_llm_cache, usage=self.usage)
+        else:
+            self.triage_llm = self.llm
+        self.digester = ClientDigester(self.llm, token_budget=digest_token_budget) if self.llm else None
+
+    def client_context(self, client):
+        return client_context(client, use_digest=self.use_digest, token_budget=self.digest_token_budget)
 
     def load_data(self, limit=20):
         try:
@@ -54,8 +170,8 @@ class OpportunityMatcher:
         Nombre: {client.get('name')}
         Industria: {client.get('industry', 'Desconocida')}
         
-        CONTEXTO TECNOLÓGICO (Infraestructura, stack, dolores, proyectos previos - Texto Crudo):
-        "{(client.get('tech_context_raw') or '')[:4000]}" 
+        CONTEXTO TECNOLÓGICO (Infraestructura, stack, dolores, proyectos previos):
+        "{self.client_context(client)}" 
         
         --- TENDENCIA / NOTICIA ---
         Título: {trend.get('title')}
@@ -79,14 +195,184 @@ class OpportunityMatcher:
         }}
         """
 
+        config = {"response_mime_type": "application/json"}
+        tags = {"client_keys": [client_key(client)], "trend_key": trend_key(trend)}
+        stream = self._stream_queue
         try:
-            response = self.model.generate_content(prompt, generation_config={"response_mime_type": "application/json"})
-            return json.loads(response.text)
+            if stream is not None:
+                text = self._stream_match(prompt, config, tags, client, trend, stream)
+            else:
+                text = self.llm.generate(prompt, generation_config=config, cache_if=is_json, site="match", tags=tags)
+            analysis = json.loads(text)
         except Exception as e:
             print(f"⚠️ Error en llamada a Gemini: {e}")
-            return {"match_score": 0, "reasoning": [f"Error LLM: {str(e)}"], "generated_pitch": ""}
+            analysis = {"match_score": 0, "reasoning": [f"Error LLM: {str(e)}"], "generated_pitch": "", "error": True}
+        if stream is not None:
+            stream.put({"type": "pitch_end", "data": dict(self._stream_info(client, trend), match_score=analysis.get('match_score', 0),
+                                                          error=bool(analysis.get('error')))})
+        return analysis
+
+    @staticmethod
+    def _stream_info(client, trend):
+        return {"key": f"{client_key(client)}:{trend_key(trend)}", "client": client.get('name'), "trend": trend.get('title')}
 
-    def generate_tech_context(self, client_name, industry_hint=None):
+    def _stream_match(self, prompt, config, tags, client, trend, stream):
+        """
+        Análisis completo por streaming: encola eventos pitch_start, pitch_score, pitch_reasoning y pitch_delta
+        a medida que el JSON parcial trae cada campo. pitch_delta lleva solo el tramo nuevo del pitch (el consumidor
+        lo acumula), así cada evento guardado en job_events no crece con el largo del texto. Retorna el texto completo.
+        """
+        info = self._stream_info(client, trend)
+        stream.put({"type": "pitch_start", "data": dict(info)})
+        text, score, reasons, sent = "", None, 0, 0
+        for piece in self.llm.generate_stream(prompt, generation_config=config, cache_if=is_json, site="match", tags=tags):
+            text += piece
+            fields = partial_json_fields(text)
+            if score is None and fields["match_score"] is not None:
+                score = fields["match_score"]
+                stream.put({"type": "pitch_score", "data": dict(info, match_score=score)})
+            if len(fields["reasoning"]) > reasons:
+                reasons = len(fields["reasoning"])
+                stream.put({"type": "pitch_reasoning", "data": dict(info, reasoning=fields["reasoning"])})
+            pitch = fields["generated_pitch"]
+            if len(pitch) - sent >= PITCH_DELTA_CHARS or (fields["pitch_done"] and len(pitch) > sent):
+                stream.put({"type": "pitch_delta", "data": dict(info, delta=pitch[sent:])})
+                sent = len(pitch)
+        return text
+
+    def triage_match(self, trend, client):
+        """
+        Etapa 1 de la cascada: puntaje y una línea de razón, con pocos tokens de salida.
+        """
+        if not self.model:
+            return {"match_score": 0, "reasoning": ["Falta API Key"], "generated_pitch": "", "error": True}
+
+        prompt = f"""
+        ACTÚA COMO: Consultor de Desarrollo de Negocio TI.
+        TAREA: Estimar qué tan probable es VENDER un proyecto de desarrollo, integración o modernización al cliente a partir de la noticia.
+
+        CLIENTE: {client.get('name')} ({client.get('industry', 'Desconocida')})
+        CONTEXTO: "{self.client_context(client)}"
+
+        NOTICIA: {trend.get('title')}
+        RESUMEN: {trend.get('summary')}
+
+        SALIDA (JSON Estricto, sin texto adicional):
+        {{"match_score": <numero_0_a_100>, "reason": "<una línea>"}}
+        """
+
+        try:
+            text = self.triage_llm.generate(
+                prompt,
+                generation_config={"response_mime_type": "application/json", "max_output_tokens": TRIAGE_OUTPUT_TOKENS},
+                cache_if=is_json,
+                expected_output_tokens=TRIAGE_OUTPUT_TOKENS,
+                site="triage",
+                tags={"client_keys": [client_key(client)], "trend_key": trend_key(trend)}
+            )
+            data = parse_json(text)
+            score = data.get("match_score", 0)
+            if isinstance(score, bool) or not isinstance(score, (int, float)):
+                raise ValueError(f"match_score inválido: {score!r}")
+            return {"match_score": score, "reasoning": [str(data.get("reason") or "")], "generated_pitch": "", "triage": True}
+        except Exception as e:
+            print(f"⚠️ Error en triage con Gemini: {e}")
+            return {"match_score": 0, "reasoning": [f"Error LLM: {str(e)}"], "generated_pitch": "", "error": True}
+
+    def analyze_trend_for_clients(self, trend, clients):
+        """
+        Evalúa una tendencia contra un grupo de clientes en un solo prompt.
+        Retorna una lista alineada con clients; None donde la entrada falta o es inválida
+        (el llamador reintenta esos pares de a uno).
+        """
+        if not self.model:
+            return [None] * len(clients)
+
+        profiles = "\n".join(
+            f"""
+        [{i}] Nombre: {client.get('name')}
+            Industria: {client.get('industry', 'Desconocida')}
+            Contexto: "{self.client_context(client)}"
+        """ for i, client in enumerate(clients, start=1)
+        )
+
+        prompt = f"""
+        ACTÚA COMO: Arquitecto de Soluciones TI Senior y Consultor de Desarrollo de Negocio en una Consultora de Software Líder.
+        
+        TU TAREA: Para CADA cliente de la lista, identificar si la siguiente **Tendencia Tecnológica** habilita una oportunidad para VENDERLE un proyecto de desarrollo, integración o modernización.
+        
+        --- TENDENCIA / NOTICIA ---
+        Título: {trend.get('title')}
+        Fuente: {trend.get('source')}
+        Resumen: {trend.get('summary')}
+        
+        --- CLIENTES (Contexto tecnológico) ---
+        {profiles}
+        
+        --- INSTRUCCIONES DE ANÁLISIS ---
+        1. Foco en SOLUCIONES: No busques solo "interés genérico". Busca: ¿Podemos migrar algo? ¿Automatizar un proceso? ¿Implementar un lago de datos? ¿Desplegar un modelo de IA local? ¿Modernizar una app legacy?
+        2. Conecta con el Contexto de cada cliente por separado: Si usa Azure, propón soluciones en Azure. Si tiene problemas de logística, propón optimización de rutas, etc.
+        3. Se Proactivo: Cada propuesta debe sonar a "Podemos construir esto para ustedes".
+        
+        --- FORMATO DE SALIDA (JSON Estricto: un arreglo con un objeto por cliente, en el mismo orden) ---
+        [
+            {{
+                "client": "<Nombre exacto del cliente>",
+                "match_score": <numero_0_a_100>,
+                "reasoning": ["Oportunidad técnica", "Valor de negocio", "Viabilidad según su stack"],
+                "generated_pitch": "Borrador de correo directo al CTO/Gerente proponiendo una PoC o Arquitectura."
+            }}
+        ]
+        """
+
+        try:
+            text = self.llm.generate(
+                prompt,
+                generation_config={"response_mime_type": "application/json"},
+                cache_if=is_json,
+                expected_output_tokens=GROUP_OUTPUT_TOKENS * len(clients),
+                site="match_batch",
+                tags={"client_keys": [client_key(c) for c in clients], "trend_key": trend_key(trend)}
+            )
+            entries = parse_json(text)
+        except Exception as e:
+            print(f"⚠️ Error en llamada por lote a Gemini: {e}")
+            return [None] * len(clients)
+        return self._align_group_entries(entries, clients)
+
+    @staticmethod
+    def _align_group_entries(entries, clients):
+        """
+        Asocia cada entrada de la respuesta con su cliente por nombre; las inválidas quedan en None.
+        """
+        if isinstance(entries, dict):
+            entries = entries.get("results") or entries.get("matches") or []
+        if not isinstance(entries, list):
+            return [None] * len(clients)
+
+        by_name = {}
+        for entry in entries:
+            if not isinstance(entry, dict):
+                continue
+            score = entry.get("match_score")
+            if isinstance(score, bool) or not isinstance(score, (int, float)) or not 0 <= score <= 100:
+                continue
+            by_name.setdefault(str(entry.get("client", "")).strip().lower(), entry)
+
+        aligned = []
+        for client in clients:
+            entry = by_name.get(str(client.get('name', '')).strip().lower())
+            if entry is None:
+                aligned.append(None)
+                continue
+            aligned.append({
+                "match_score": entry["match_score"],
+                "reasoning": entry.get("reasoning") if isinstance(entry.get("reasoning"), list) else [],
+                "generated_pitch": entry.get("generated_pitch") or ""
+            })
+        return aligned
+
+    def generate_tech_context(self, client_name, industry_hint=None, client_id=None):
         """
         Genera un perfil tecnológico estratégico usando el conocimiento interno del LLM.
         """
@@ -107,14 +393,71 @@ class OpportunityMatcher:
         """
         
         try:
-            response = self.model.generate_content(prompt)
-            return response.text
+            # El uso se etiqueta con el id del cliente, como el resto de las llamadas (el dashboard lo resuelve a nombre)
+            return self.llm.generate(prompt, site="tech_context", tags={"client_keys": [client_id]})
         except Exception as e:
             return f"Error al generar contexto: {e}"
 
-    def run_matching_cycle(self, specific_client_name=None, trend_limit=5):
+    def prefilter_trends(self, trend_limit):
+        """
+        Selecciona localmente, por similitud TF-IDF con el contexto del cliente, las
+        tendencias que vale la pena enviar al LLM. Retorna una lista de tendencias por cliente.
+        """
+        if self._vector_cache is None:
+            self._vector_cache = VectorCache(self.vector_cache_path)
+        index = SimilarityIndex(cache=self._vector_cache)
+        selection = index.select_candidates(self.trends, self.clients, top_k=trend_limit, threshold=self.prefilter_threshold)
+        return [[self.trends[i] for i, _ in candidates] for candidates in selection]
+
+    def _pending_pairs(self, pairs):
+        """
+        Descarta los pares ya evaluados con las mismas entradas (ledger). Retorna (pendientes, omitidos).
+        Un descarte del triage solo cuenta en corridas con cascada y si sigue bajo el umbral actual.
+        """
+        rows = DatabaseClient().fetch_match_ledger(client_keys={client_key(c) for c, _ in pairs})
+        ledger = {(row['client_key'], row['trend_key']): row for row in rows}
+        pending = []
+        for client, trend in pairs:
+            row = ledger.get((client_key(client), trend_key(trend)))
+            if row and row.get('client_hash') == client_hash(client, self.client_context(client)) and row.get('trend_hash') == trend_hash(trend) \
+                    and self._ledger_verdict_current(row):
+                continue
+            pending.append((client, trend))
+        return pending, len(pairs) - len(pending)
+
+    def _ledger_verdict_current(self, row):
+        if row.get('model') == self.llm.model_name and row.get('prompt_version') == PROMPT_VERSION:
+            return True
+        return self.cascade and row.get('model') == self.triage_llm.model_name \
+            and row.get('prompt_version') == TRIAGE_PROMPT_VERSION and (row.get('match_score') or 0) < self.triage_threshold
+
+    def _ledger_row(self, client, trend, score, triage=False):
+        llm = self.triage_llm if triage else self.llm
+        return {
+            "client_key": client_key(client),
+            "trend_key": trend_key(trend),
+            "client_hash": client_hash(client, self.client_context(client)),
+            "trend_hash": trend_hash(trend),
+            "model": llm.model_name,
+            "prompt_version": TRIAGE_PROMPT_VERSION if triage else PROMPT_VERSION,
+            "match_score": score,
+            "evaluated_at": datetime.now().isoformat(),
+            **({"run_id": self._run_id} if self._run_id is not None else {})
+        }
+
+    def run_matching_cycle(self, specific_client_name=None, trend_limit=5, prefilter=False, incremental=True, run_id=None,
+                           max_calls=None, max_tokens=None):
+        """
+        Con run_id, cada par evaluado queda guardado de inmediato (oportunidad, ledger y avance en runs):
+        volver a llamar con el mismo run_id y los mismos parámetros reanuda la corrida sin repetir pares.
+        Con max_calls y/o max_tokens (modo anytime) se consideran todos los pares cliente-tendencia del pool,
+        se evalúan por prioridad estimada (similitud, frescura, categoría de la fuente) y se corta al agotar el presupuesto.
+        """
+        self._run_id = run_id
+        budgeted = max_calls is not None or max_tokens is not None
         yield {"type": "log", "message": f"[{datetime.now().strftime('%H:%M:%S')}] 🧠 Iniciando análisis cognitivo con Gemini..."}
-        self.load_data(limit=trend_limit)
+        # Con pre-filtro (o presupuesto) se cargan más tendencias candidatas y solo las más afines llegan al LLM
+        self.load_data(limit=max(trend_limit, self.prefilter_pool) if prefilter or budgeted else trend_limit)
         
         # Filtering Logic
         if specific_client_name and specific_client_name != "Todos":
@@ -122,8 +465,6 @@ class OpportunityMatcher:
             if not self.clients:
                  yield {"type": "log", "message": f"⚠️ Cliente '{specific_client_name}' no encontrado en DB."}
         
-        opportunities = []
-        
         if not self.model:
             yield {"type": "log", "message": "🚫 Deteniendo: Falta configurar API Key."}
             yield {"type": "result", "data": []}
@@ -131,51 +472,453 @@ class OpportunityMatcher:
 
         yield {"type": "log", "message": f"📊 Datos cargados: {len(self.clients)} clientes, {len(self.trends)} tendencias."}
 
-        for client in self.clients:
-            yield {"type": "log", "message": f"🏢 Analizando cartera de: {client['name']}..."}
+        # Resúmenes de contexto: solo se regeneran los de clientes cuyo texto crudo cambió
+        if self.use_digest:
+            refreshed = yield from self.digester.refresh(self.clients, DatabaseClient())
+            if refreshed:
+                yield {"type": "log", "message": f"🧾 {refreshed} resúmenes de contexto regenerados."}
+
+        if budgeted:
+            # El presupuesto reemplaza a trend_limit: todos los pares compiten por prioridad
+            selection = [self.trends for _ in self.clients]
+        elif prefilter:
+            selection = self.prefilter_trends(trend_limit)
+            total_pairs = len(self.clients) * len(self.trends)
+            selected_pairs = sum(len(c) for c in selection)
+            yield {"type": "log", "message": f"🧭 Pre-filtro local: {selected_pairs} de {total_pairs} pares cliente-tendencia irán a Gemini."}
+        else:
             # Analizamos las top N tendencias para tener variedad sin saturar la API
-            for trend in self.trends[:trend_limit]: 
-                yield {"type": "log", "message": f"   ⚡ Cruzando con: {trend['title'][:40]}..."}
-                
-                analysis = self.analyze_match_with_llm(trend, client)
-                score = analysis.get('match_score', 0)
-                
-                # Guardamos incluso score bajo para validar que funcionó, aunque filtremos en UI
-                if score > 10: 
-                    yield {"type": "log", "message": f"      🚀 MATCH DETECTADO ({score}%): {trend['title'][:30]}..."}
-                    result = {
-                        "client": client['name'],
-                        "trend": trend['title'],
-                        "trend_url": trend.get('url'),
-                        "match_score": score,
-                        "reasoning": analysis.get('reasoning', []),
-                        "generated_pitch": analysis.get('generated_pitch', ''),
-                        "timestamp": str(datetime.now())
-                    }
-                    opportunities.append(result)
-                    
-                    # Delay significativo debido a cuota Free Tier (RPM límite)
-                    yield {"type": "log", "message": "      ⏳ Esperando 5s por quota API..."}
-                    time.sleep(5) 
+            selection = [self.trends[:trend_limit] for _ in self.clients]
+
+        # Orden canónico de los pares: define el orden del resultado, sin importar cuándo termine cada uno
+        pairs = [(client, trend) for client, client_trends in zip(self.clients, selection) for trend in client_trends]
+
+        # Matching incremental: solo pares nuevos o con entradas distintas a las del ledger
+        if incremental and pairs:
+            try:
+                pairs, skipped = self._pending_pairs(pairs)
+                if skipped:
+                    yield {"type": "log", "message": f"📒 Ledger: {skipped} pares sin cambios desde su última evaluación, se omiten."}
+            except Exception as e:
+                yield {"type": "log", "message": f"⚠️ No se pudo leer el ledger, se evalúan todos los pares: {e}"}
+
+        if run_id is not None:
+            pairs = yield from self._resume_pairs(run_id, pairs)
+
+        if budgeted and pairs:
+            pairs = yield from self.prioritize_pairs(pairs)
+            if self.cascade or self.batch_clients:
+                yield {"type": "log", "message": "💸 Modo anytime: se evalúa par a par (sin cascada ni lotes) para respetar la prioridad."}
+
+        results = [None] * len(pairs)
+        self._ledger_rows = []
+
+        def record(index, analysis, wait):
+            client, trend = pairs[index]
+            results[index] = yield from self._pair_events(client, trend, analysis, wait)
+
+        if self.cascade and pairs and not budgeted:
+            # Etapa 1: triage de todos los pares con respuesta corta
+            triage = {}
+
+            def keep_triage(index, analysis, wait):
+                triage[index] = analysis
+                if wait >= 0.5:
+                    yield {"type": "log", "message": f"      ⏳ Esperó {wait:.1f}s por cuota API."}
+
+            yield {"type": "log", "message": f"🔎 Etapa 1 (triage, {self.triage_llm.model_name or 'modelo por defecto'}): {len(pairs)} pares."}
+            yield from self._run_units([[index] for index in range(len(pairs))], pairs, self._triage_unit, keep_triage)
+
+            winners = self._cascade_winners(pairs, triage)
+            top_k = f", top-{self.triage_top_k} por cliente" if self.triage_top_k else ""
+            yield {"type": "log", "message": f"🎯 Etapa 2 (pitch): {len(winners)} de {len(pairs)} pares superan el triage (umbral {self.triage_threshold}{top_k})."}
+
+            # Los descartados quedan en el ledger con su puntaje de triage, sin oportunidad
+            for index in range(len(pairs)):
+                if index not in winners:
+                    client, trend = pairs[index]
+                    yield from self._pair_events(client, trend, triage[index], 0, triage=True)
+            units = self._work_units(pairs, winners) if self.batch_clients else [[index] for index in winners]
+        else:
+            # Unidad de trabajo = una llamada (un par, o una tendencia con un grupo de clientes)
+            units = self._work_units(pairs) if self.batch_clients and not budgeted else [[index] for index in range(len(pairs))]
+
+        if self.batch_clients and not budgeted:
+            yield {"type": "log", "message": f"📦 Modo por lote: {sum(len(u) for u in units)} pares en {len(units)} prompts."}
+        # Solo el análisis completo por par se transmite en streaming (triage y lotes responden de una vez)
+        self._stream_queue = queue.Queue() if self.stream_pitch else None
+        self._budget = MatchBudget(self.usage, max_calls=max_calls, max_tokens=max_tokens) if budgeted else None
+        try:
+            evaluated = yield from self._run_units(units, pairs, self._evaluate_unit, record)
+            if budgeted:
+                spent = self._budget.state()
+                left = len(pairs) - evaluated
+                reason = "Presupuesto agotado" if left else "Presupuesto suficiente"
+                yield {"type": "log", "message": f"💸 {reason}: {spent['calls']} llamadas, {spent['tokens']} tokens; {left} pares sin evaluar."}
+        finally:
+            self._stream_queue = None
+            self._budget = None
+
+        opportunities = [result for result in results if result is not None]
+
+        # Los pares sin match quedan registrados ya; los matches, al guardarse la oportunidad
+        if self._ledger_rows:
+            try:
+                DatabaseClient().upsert_match_ledger(self._ledger_rows)
+                yield {"type": "log", "message": f"📒 Ledger: {len(self._ledger_rows)} pares registrados."}
+            except Exception as e:
+                yield {"type": "log", "message": f"⚠️ No se pudo actualizar el ledger: {e}"}
         
+        cache_stats = self.llm.cache_stats()
+        yield {"type": "log", "message": f"🗄️ Caché LLM: {cache_stats['hits']} aciertos, {cache_stats['misses']} fallos."}
+        usage = self.usage.totals()
+        yield {"type": "log", "message": f"💰 Uso Gemini: {usage['calls']} llamadas, {usage['prompt_tokens']} tokens entrada / {usage['output_tokens']} salida (~US${usage['cost_usd']:.4f})."}
         yield {"type": "result", "data": opportunities}
 
+    def _run_units(self, units, pairs, evaluate, handle):
+        """
+        Evalúa las unidades de trabajo con evaluate(unit, pairs), en secuencia o en paralelo
+        (max_concurrency), y entrega cada par evaluado a handle(índice, análisis, espera),
+        un generador de eventos. Emite los eventos a medida que terminan las llamadas.
+        Con presupuesto (modo anytime) se detiene en la primera unidad que no cabe.
+        Retorna cuántos pares se evaluaron.
+        """
+        total = sum(len(unit) for unit in units)
+        admitted = self._admitted(units, pairs)
+        evaluate = self._spending(evaluate)
+        done = 0
+        if self.max_concurrency <= 1:
+            current_client = None
+            for unit in admitted:
+                client, trend = pairs[unit[0]]
+                if len(unit) > 1:
+                    yield {"type": "log", "message": f"   ⚡ Cruzando {trend['title'][:40]}... con {len(unit)} clientes"}
+                else:
+                    if client is not current_client:
+                        current_client = client
+                        yield {"type": "log", "message": f"🏢 Analizando cartera de: {client['name']}..."}
+                    yield {"type": "log", "message": f"   ⚡ Cruzando con: {trend['title'][:40]}..."}
+                analyses, wait_s, fallbacks = yield from self._evaluate_streaming(evaluate, unit, pairs)
+                if fallbacks:
+                    yield {"type": "log", "message": f"      ↩️ {fallbacks} respuestas del lote inválidas, reevaluadas de a una."}
+                for position, (index, analysis) in enumerate(analyses):
+                    done += 1
+                    # La espera de la llamada se informa una sola vez por unidad
+                    yield from handle(index, analysis, wait_s if position == 0 else 0)
+            return done
+
+        workers = min(self.max_concurrency, len(units)) or 1
+        yield {"type": "log", "message": f"⚡ Evaluando {total} pares con hasta {workers} llamadas en paralelo..."}
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # Envío perezoso: nunca más de workers llamadas en vuelo, así el presupuesto se revisa antes de cada una
+            order, pending = {}, set()
+
+            def submit():
+                unit = next(admitted, None)
+                if unit is not None:
+                    future = pool.submit(evaluate, unit, pairs)
+                    order[future] = len(order)
+                    pending.add(future)
+
+            for _ in range(workers):
+                submit()
+            try:
+                while pending:
+                    finished, _ = wait(pending, timeout=STREAM_POLL_S, return_when=FIRST_COMPLETED)
+                    pending.difference_update(finished)
+                    yield from self._drain_stream()
+                    for future in sorted(finished, key=order.get):
+                        submit()
+                        analyses, wait_s, fallbacks = future.result()
+                        if fallbacks:
+                            yield {"type": "log", "message": f"      ↩️ {fallbacks} respuestas del lote inválidas, reevaluadas de a una."}
+                        for position, (index, analysis) in enumerate(analyses):
+                            done += 1
+                            client, trend = pairs[index]
+                            yield {"type": "log", "message": f"   ✔️ [{done}/{total}] {client['name']} × {trend['title'][:40]}"}
+                            yield from handle(index, analysis, wait_s if position == 0 else 0)
+            finally:
+                # Generador cerrado a mitad (cancelación): las llamadas aún no iniciadas no se hacen
+                for future in pending:
+                    future.cancel()
+        return done
+
+    def _unit_tokens(self, unit, pairs):
+        # Estimación previa de una llamada: instrucciones, contexto de los clientes, tendencia y respuesta esperada
+        trend = pairs[unit[0]][1]
+        contexts = sum(estimate_tokens(self.client_context(pairs[i][0])) for i in unit)
+        return GROUP_PROMPT_TOKENS + contexts + estimate_tokens(f"{trend.get('title')} {trend.get('summary')}") \
+            + len(unit) * self.llm.expected_output_tokens
+
+    def _admitted(self, units, pairs):
+        """
+        Unidades en orden mientras quepan en el presupuesto (reservándolo); sin presupuesto, todas.
+        """
+        for unit in units:
+            if self._budget is not None and not self._budget.admit(self._unit_tokens(unit, pairs)):
+                return
+            yield unit
+
+    def _spending(self, evaluate):
+        # Libera la reserva del presupuesto al terminar la llamada (lo real ya quedó en el UsageTracker)
+        budget = self._budget
+        if budget is None:
+            return evaluate
+
+        def run(unit, pairs):
+            try:
+                return evaluate(unit, pairs)
+            finally:
+                budget.release(self._unit_tokens(unit, pairs))
+        return run
+
+    def prioritize_pairs(self, pairs):
+        """
+        Ordena los pares por prioridad estimada sin LLM (ver priority.rank_pairs): similitud TF-IDF
+        cliente-tendencia, frescura de la noticia y afinidad industria-categoría de la fuente.
+        Generador de eventos log; retorna los pares ordenados.
+        """
+        if self._vector_cache is None:
+            self._vector_cache = VectorCache(self.vector_cache_path)
+        clients = list({client_key(c): c for c, _ in pairs}.values())
+        trends = list({trend_key(t): t for _, t in pairs}.values())
+        scores = SimilarityIndex(cache=self._vector_cache).similarity(trends, clients)
+        rows = {client_key(c): i for i, c in enumerate(clients)}
+        columns = {trend_key(t): j for j, t in enumerate(trends)}
+        sources = {}
+        try:
+            sources = {s.get('name'): s for s in DatabaseClient().fetch_rss_sources()}
+        except Exception as e:
+            yield {"type": "log", "message": f"⚠️ No se pudieron leer las fuentes, la prioridad ignora su categoría: {e}"}
+        ranked = rank_pairs(pairs, lambda c, t: float(scores[rows[client_key(c)], columns[trend_key(t)]]), sources)
+        yield {"type": "log", "message": f"🥇 Modo anytime: {len(pairs)} pares ordenados por prioridad estimada (máx. {ranked[0][0]:.2f})."}
+        return [pairs[index] for _, index in ranked]
+
+    def _evaluate_streaming(self, evaluate, unit, pairs):
+        """
+        evaluate(unit, pairs) en modo secuencial. Con streaming corre en un hilo aparte para emitir
+        los eventos parciales mientras Gemini responde.
+        """
+        if self._stream_queue is None:
+            return evaluate(unit, pairs)
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            future = pool.submit(evaluate, unit, pairs)
+            while not future.done():
+                wait([future], timeout=STREAM_POLL_S)
+                yield from self._drain_stream()
+        yield from self._drain_stream()
+        return future.result()
+
+    def _drain_stream(self):
+        # Eventos de streaming encolados por los hilos de evaluación, en orden de llegada
+        while self._stream_queue is not None:
+            try:
+                yield self._stream_queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def _triage_unit(self, unit, pairs):
+        client, trend = pairs[unit[0]]
+        analysis = self.triage_match(trend, client)
+        return [(unit[0], analysis)], self.triage_llm.last_wait, 0
+
+    def _cascade_winners(self, pairs, triage):
+        """
+        Índices (en orden canónico) de los pares que pasan a la etapa 2: puntaje de triage
+        >= triage_threshold, o entre los top-K de su cliente (con puntaje > 10).
+        """
+        winners = {i for i, analysis in triage.items() if not analysis.get('error') and analysis['match_score'] >= self.triage_threshold}
+        if self.triage_top_k:
+            by_client = {}
+            for index, analysis in triage.items():
+                if not analysis.get('error') and analysis['match_score'] > 10:
+                    by_client.setdefault(client_key(pairs[index][0]), []).append(index)
+            for indexes in by_client.values():
+                ranked = sorted(indexes, key=lambda i: (-triage[i]['match_score'], i))
+                winners.update(ranked[:self.triage_top_k])
+        return sorted(winners)
+
+    def _work_units(self, pairs, subset=None):
+        """
+        Agrupa los índices de pares (todos, o solo subset) por tendencia y, dentro de cada una, por presupuesto de tokens.
+        """
+        by_trend = {}
+        for index in (range(len(pairs)) if subset is None else subset):
+            trend = pairs[index][1]
+            key = trend.get('id') or trend.get('url') or trend.get('title')
+            by_trend.setdefault(key, []).append(index)
+
+        units = []
+        for indexes in by_trend.values():
+            trend = pairs[indexes[0]][1]
+            base = GROUP_PROMPT_TOKENS + estimate_tokens(f"{trend.get('title')} {trend.get('summary')}")
+            position = 0
+            group_clients = [pairs[i][0] for i in indexes]
+            for group in group_clients_by_budget(group_clients, self.batch_token_budget, base_tokens=base, context_of=self.client_context):
+                units.append(indexes[position:position + len(group)])
+                position += len(group)
+        return units
+
+    def _evaluate_unit(self, unit, pairs):
+        """
+        Evalúa una unidad de trabajo en el hilo actual.
+        Retorna ([(índice_par, análisis)], segundos esperados por cuota, pares reevaluados de a uno).
+        """
+        if len(unit) == 1:
+            client, trend = pairs[unit[0]]
+            analysis = self.analyze_match_with_llm(trend, client)
+            return [(unit[0], analysis)], self.llm.last_wait, 0
+
+        trend = pairs[unit[0]][1]
+        analyses = self.analyze_trend_for_clients(trend, [pairs[i][0] for i in unit])
+        wait, fallbacks = self.llm.last_wait, 0
+        for position, analysis in enumerate(analyses):
+            if analysis is None:
+                # Fallback por par ante entradas faltantes o malformadas
+                analyses[position] = self.analyze_match_with_llm(trend, pairs[unit[position]][0])
+                wait += self.llm.last_wait
+                fallbacks += 1
+        return list(zip(unit, analyses)), wait, fallbacks
+
+    def _pair_events(self, client, trend, analysis, wait, triage=False):
+        """
+        Emite los eventos de un par ya evaluado (log y resultado parcial).
+        Retorna la oportunidad, o None si no supera el umbral. Con triage (descarte de la cascada) nunca hay oportunidad.
+        """
+        result = None
+        score = analysis.get('match_score', 0)
+        # Los errores de la API no se registran en el ledger: el par se reintenta en la próxima corrida
+        ledger_row = None if analysis.get('error') else self._ledger_row(client, trend, score, triage=triage)
+
+        # Guardamos incluso score bajo para validar que funcionó, aunque filtremos en UI
+        if score > 10 and not triage:
+            yield {"type": "log", "message": f"      🚀 MATCH DETECTADO ({score}%): {trend['title'][:30]}..."}
+            result = {
+                "client": client['name'],
+                "trend": trend['title'],
+                "trend_url": trend.get('url'),
+                "match_score": score,
+                "reasoning": analysis.get('reasoning', []),
+                "generated_pitch": analysis.get('generated_pitch', ''),
+                "timestamp": str(datetime.now()),
+                "ledger": ledger_row
+            }
+            yield {"type": "partial", "data": result}
+
+        ledger_saved = False
+        if self._run_id is not None:
+            ledger_saved = yield from self._checkpoint(result, ledger_row, error=bool(analysis.get('error')))
+        # Ledger pendiente: se escribe al final de la corrida (el de una oportunidad aún sin guardar va junto con ella)
+        if ledger_row and not ledger_saved and (result is None or result.get("saved")):
+            self._ledger_rows.append(ledger_row)
+
+        # La cuota la administra el limitador compartido: informamos la espera real
+        if wait >= 0.5:
+            throttle = self.llm.rate_limiter.state()
+            yield {"type": "log", "message": f"      ⏳ Esperó {wait:.1f}s por cuota API (efectivo {throttle['effective_rpm']} RPM)."}
+        return result
+
+    def _resume_pairs(self, run_id, pairs):
+        """
+        Descarta los pares ya guardados por esta corrida (reanudación) y registra el avance inicial.
+        Generador de eventos log; retorna los pares pendientes.
+        """
+        db = DatabaseClient()
+        done = set()
+        try:
+            done = {(row['client_key'], row['trend_key']) for row in db.fetch_match_ledger(run_id=run_id)}
+        except Exception as e:
+            yield {"type": "log", "message": f"⚠️ No se pudieron leer los checkpoints de la corrida #{run_id}: {e}"}
+        pending = [(c, t) for c, t in pairs if (client_key(c), trend_key(t)) not in done]
+        if len(pending) < len(pairs):
+            yield {"type": "log", "message": f"⏯️ Reanudando corrida #{run_id}: {len(pairs) - len(pending)} pares ya evaluados, quedan {len(pending)}."}
+        self._progress = {"total": len(done) + len(pending), "done": len(done), "opportunities": 0, "errors": 0}
+        self._save_progress(db)
+        return pending
+
+    def _save_progress(self, db):
+        try:
+            db.update_run_progress(self._run_id, self._progress)
+        except Exception as e:
+            print(f"⚠️ No se pudo actualizar el avance de la corrida {self._run_id}: {e}")
+
+    def _checkpoint(self, result, ledger_row, error=False):
+        """
+        Guarda de inmediato un par evaluado: su oportunidad (si hubo match), su fila de ledger y el avance.
+        Oportunidad y ledger se escriben por separado: si falla solo el ledger, la oportunidad no se repite
+        y el ledger se reintenta al final de la corrida. Los pares con error de la API no se guardan:
+        se reintentan al reanudar. Retorna si la fila de ledger quedó escrita.
+        """
+        db = DatabaseClient()
+        opportunity_saved = ledger_saved = False
+        if not error:
+            if result is not None:
+                try:
+                    db.save_opportunity(self._opportunity_row(result))
+                    result["saved"] = opportunity_saved = True
+                except Exception as e:
+                    yield {"type": "log", "message": f"⚠️ Checkpoint fallido, la oportunidad se guardará al final: {e}"}
+            if ledger_row:
+                try:
+                    db.upsert_match_ledger([ledger_row])
+                    ledger_saved = True
+                except Exception as e:
+                    yield {"type": "log", "message": f"⚠️ Checkpoint del ledger fallido, se reintentará al final: {e}"}
+        self._progress["done"] += int(ledger_saved and (result is None or opportunity_saved))
+        self._progress["errors"] += int(error)
+        self._progress["opportunities"] += int(opportunity_saved)
+        self._save_progress(db)
+        return ledger_saved
+
+    def save_usage(self, run_id=None):
+        """
+        Persiste en llm_calls el uso registrado desde la última vez, asociado a run_id.
+        """
+        try:
+            return self.usage.flush(DatabaseClient(), run_id)
+        except Exception as e:
+            print(f"⚠️ No se pudo guardar el uso de Gemini: {e}")
+            return 0
+
+    def _opportunity_row(self, op):
+        data = {
+            "client_name": op.get("client"),
+            "trend_title": op.get("trend"),
+            "match_score": op.get("match_score"),
+            "reasoning": op.get("reasoning"),
+            "generated_pitch": op.get("generated_pitch")
+        }
+        if self._run_id is not None:
+            data["run_id"] = self._run_id
+        return data
+
     def save_opportunities(self, opportunities):
+        # Las ya guardadas por checkpoint (corridas con run_id) no se duplican
+        opportunities = [op for op in opportunities if not op.get("saved")]
+        if not opportunities:
+            return
         db = DatabaseClient()
         print(f"💾 Guardando {len(opportunities)} oportunidades en Cloud...")
         for op in opportunities:
-             data = {
-                    "client_name": op.get("client"),
-                    "trend_title": op.get("trend"),
-                    "match_score": op.get("match_score"),
-                    "reasoning": op.get("reasoning"), 
-                    "generated_pitch": op.get("generated_pitch")
-             }
-             db.save_opportunity(data)
+             db.save_opportunity(self._opportunity_row(op))
+
+        # Registrar en el ledger los pares cuya oportunidad ya quedó guardada
+        ledger_rows = [op["ledger"] for op in opportunities if op.get("ledger")]
+        if ledger_rows:
+            try:
+                db.upsert_match_ledger(ledger_rows)
+            except Exception as e:
+                print(f"⚠️ No se pudo actualizar el ledger: {e}")
         print("✅ Guardado exitoso.")
 
 if __name__ == "__main__":
     matcher = OpportunityMatcher()
-    matches = matcher.run_matching_cycle()
+    matches = []
+    for update in matcher.run_matching_cycle():
+        if update["type"] == "log":
+            print(update["message"])
+        elif update["type"] == "result":
+            matches = update["data"]
     if matches:
         matcher.save_opportunities(matches)
+    matcher.save_usage()
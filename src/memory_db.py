@@ -0,0 +1,248 @@
+import copy
+import threading
+from datetime import datetime, timezone
+from itertools import count
+
+from db_client import OPPORTUNITY_CARD_COLUMNS, OPPORTUNITY_DETAIL_COLUMNS, TREND_LIST_COLUMNS
+
+def _project(row, columns):
+    if columns.strip() == "*":
+        return copy.deepcopy(row)
+    return {name: copy.deepcopy(row.get(name)) for name in (c.strip() for c in columns.split(","))}
+
+def _keyset(rows, column, cursor, limit, columns):
+    # Mismo contrato que DatabaseClient: orden (column, id) descendente, una fila de más para el cursor siguiente
+    rows = sorted(rows, key=lambda r: (str(r[column]), r["id"]), reverse=True)
+    if cursor:
+        rows = [r for r in rows if (str(r[column]), r["id"]) < (str(cursor[0]), cursor[1])]
+    page = [_project(r, columns) for r in rows[:limit]]
+    next_cursor = (rows[limit - 1][column], rows[limit - 1]["id"]) if len(rows) > limit else None
+    return page, next_cursor
+
+class InMemoryDatabase:
+    """
+    Sustituto en memoria de DatabaseClient (misma interfaz que usan ingestor, matcher y scheduler)
+    para benchmarks y pruebas end-to-end sin Supabase.
+    """
+    def __init__(self, clients=None, sources=None, trends=None):
+        self._lock = threading.Lock()
+        self._ids = count(1)
+        self.clients = [self._with_id(c) for c in clients or []]
+        self.rss_sources = [self._with_id(s) for s in sources or []]
+        self.trends = [self._with_id(t) for t in trends or []]
+        # Como el backfill del esquema: tendencias sin source_id se ligan a su fuente por nombre
+        source_ids = {s["name"]: s["id"] for s in self.rss_sources}
+        for trend in self.trends:
+            if trend.get("source_id") is None:
+                trend["source_id"] = source_ids.get(trend.get("source"))
+        self.opportunities = []
+        self.match_ledger = {}
+        self.llm_calls = []
+        self.runs = []
+        self.jobs = []
+        self.job_events = []
+
+    def _with_id(self, row):
+        row = copy.deepcopy(row)
+        row.setdefault("id", next(self._ids))
+        return row
+
+    # --- CLIENTES ---
+    def fetch_clients(self):
+        with self._lock:
+            return copy.deepcopy(self.clients)
+
+    def update_client_digest(self, client_id, digest, digest_hash):
+        with self._lock:
+            for client in self.clients:
+                if client["id"] == client_id:
+                    client.update(context_digest=copy.deepcopy(digest), context_digest_hash=digest_hash)
+
+    # --- TENDENCIAS ---
+    def save_trends(self, trends, chunk_size=500, max_retries=3, backoff=1.0, count_existing=False):
+        with self._lock:
+            by_url = {t.get("url"): t for t in self.trends}
+            inserted = updated = 0
+            for trend in trends:
+                existing = by_url.get(trend.get("url"))
+                if existing:
+                    existing.update(copy.deepcopy(trend))
+                    updated += 1
+                else:
+                    row = self._with_id(trend)
+                    row.setdefault("published_at", datetime.now(timezone.utc).isoformat())
+                    self.trends.append(row)
+                    by_url[row.get("url")] = row
+                    inserted += 1
+        return [{"chunk": 0, "rows": len(trends), "inserted": inserted, "updated": updated, "failed": 0, "attempts": 1, "error": None}]
+
+    def fetch_trends(self, limit=20, active_only=True):
+        with self._lock:
+            # Como la vista active_trends: solo se excluyen las tendencias de fuentes pausadas
+            paused = {s["id"] for s in self.rss_sources if not s.get("is_active", True)}
+            rows = [t for t in self.trends if not active_only or t.get("source_id") not in paused]
+            rows.sort(key=lambda t: str(t.get("published_at") or ""), reverse=True)
+            return copy.deepcopy(rows[:limit])
+
+    def fetch_trends_page(self, source=None, cursor=None, limit=50, columns=TREND_LIST_COLUMNS):
+        with self._lock:
+            rows = [t for t in self.trends if t.get("published_at") and (not source or t.get("source") == source)]
+            return _keyset(rows, "published_at", cursor, limit, columns)
+
+    def fetch_trend_fingerprints(self, limit=2000):
+        with self._lock:
+            return copy.deepcopy([t for t in self.trends if t.get("fingerprint")][:limit])
+
+    # --- FUENTES ---
+    def fetch_rss_sources(self):
+        with self._lock:
+            names = {c["id"]: c["name"] for c in self.clients}
+            return [dict(copy.deepcopy(s), clients={"name": names[s["client_id"]]} if s.get("client_id") in names else None)
+                    for s in self.rss_sources]
+
+    def update_source_state(self, source_id, fields):
+        with self._lock:
+            for source in self.rss_sources:
+                if source["id"] == source_id:
+                    source.update(copy.deepcopy(fields))
+
+    # --- OPORTUNIDADES Y LEDGER ---
+    def save_opportunity(self, opportunity):
+        with self._lock:
+            row = self._with_id(opportunity)
+            row.setdefault("created_at", datetime.now(timezone.utc).isoformat())
+            self.opportunities.append(row)
+
+    def fetch_opportunities(self):
+        with self._lock:
+            return copy.deepcopy(list(reversed(self.opportunities)))
+
+    def fetch_opportunities_page(self, client_name=None, min_score=None, cursor=None, limit=20, columns=OPPORTUNITY_CARD_COLUMNS):
+        with self._lock:
+            rows = [op for op in self.opportunities if (not client_name or op.get("client_name") == client_name)
+                    and (min_score is None or (op.get("match_score") or 0) >= min_score)]
+            return _keyset(rows, "created_at", cursor, limit, columns)
+
+    def fetch_opportunity_detail(self, opportunity_id):
+        with self._lock:
+            row = next((op for op in self.opportunities if op["id"] == opportunity_id), None)
+            return _project(row, OPPORTUNITY_DETAIL_COLUMNS) if row else None
+
+    def delete_opportunity(self, opportunity_id):
+        with self._lock:
+            self.opportunities = [op for op in self.opportunities if op["id"] != opportunity_id]
+
+    def fetch_match_ledger(self, client_keys=None, run_id=None):
+        with self._lock:
+            return [copy.deepcopy(row) for row in self.match_ledger.values()
+                    if (not client_keys or row["client_key"] in client_keys) and (run_id is None or row.get("run_id") == run_id)]
+
+    def upsert_match_ledger(self, rows, chunk_size=500):
+        with self._lock:
+            for row in rows:
+                self.match_ledger[(row["client_key"], row["trend_key"])] = copy.deepcopy(row)
+
+    # --- USO Y CORRIDAS ---
+    def save_llm_calls(self, calls, chunk_size=500):
+        with self._lock:
+            self.llm_calls.extend(copy.deepcopy(calls))
+
+    def start_run(self, kind, params=None):
+        with self._lock:
+            run = self._with_id({"kind": kind, "status": "running", "params": params or {},
+                                 "started_at": datetime.now(timezone.utc).isoformat()})
+            self.runs.append(run)
+            return copy.deepcopy(run)
+
+    def finish_run(self, run_id, status, duration_s, items, errors):
+        with self._lock:
+            for run in self.runs:
+                if run["id"] == run_id:
+                    run.update(status=status, duration_s=round(duration_s, 2), items=items, errors=errors,
+                               finished_at=datetime.now(timezone.utc).isoformat())
+
+    def fetch_runs(self, kind=None, limit=20):
+        with self._lock:
+            rows = [r for r in reversed(self.runs) if not kind or r["kind"] == kind]
+            return copy.deepcopy(rows[:limit])
+
+    def fetch_run(self, run_id):
+        with self._lock:
+            return copy.deepcopy(next((r for r in self.runs if r["id"] == run_id), None))
+
+    def fetch_resumable_runs(self, kind="matching", limit=20):
+        with self._lock:
+            rows = [r for r in reversed(self.runs) if r["kind"] == kind and r["status"] in ("running", "failed", "cancelled")]
+            return copy.deepcopy(rows[:limit])
+
+    # --- JOBS ---
+    def enqueue_job(self, kind, params, dedupe_key):
+        with self._lock:
+            if any(j["dedupe_key"] == dedupe_key and j["status"] in ("queued", "running") for j in self.jobs):
+                raise ValueError("duplicate key value violates unique constraint jobs_dedupe_active_idx")
+            job = self._with_id({"kind": kind, "params": params or {}, "dedupe_key": dedupe_key, "status": "queued",
+                                 "cancel_requested": False, "run_id": None, "error": None,
+                                 "created_at": datetime.now(timezone.utc).isoformat()})
+            self.jobs.append(job)
+            return copy.deepcopy(job)
+
+    def fetch_active_job(self, dedupe_key):
+        with self._lock:
+            return copy.deepcopy(next((j for j in self.jobs if j["dedupe_key"] == dedupe_key and j["status"] in ("queued", "running")), None))
+
+    def fetch_job(self, job_id):
+        with self._lock:
+            return copy.deepcopy(next((j for j in self.jobs if j["id"] == job_id), None))
+
+    def fetch_jobs(self, kind=None, statuses=None, limit=20):
+        with self._lock:
+            rows = [j for j in reversed(self.jobs) if (not kind or j["kind"] == kind) and (not statuses or j["status"] in statuses)]
+            return copy.deepcopy(rows[:limit])
+
+    def claim_job(self, worker, max_running=2, stale_seconds=600):
+        with self._lock:
+            now = datetime.now(timezone.utc)
+            for job in self.jobs:
+                if job["status"] == "running" and (now - datetime.fromisoformat(job["heartbeat_at"])).total_seconds() > stale_seconds:
+                    job.update(status="failed", error="Worker sin latido", finished_at=now.isoformat())
+            if sum(j["status"] == "running" for j in self.jobs) >= max_running:
+                return None
+            job = next((j for j in self.jobs if j["status"] == "queued"), None)
+            if job is None:
+                return None
+            job.update(status="running", worker=worker, started_at=now.isoformat(), heartbeat_at=now.isoformat())
+            return copy.deepcopy(job)
+
+    def update_job(self, job_id, fields):
+        with self._lock:
+            for job in self.jobs:
+                if job["id"] == job_id:
+                    job.update(copy.deepcopy(fields))
+
+    def request_job_cancel(self, job_id):
+        with self._lock:
+            for job in self.jobs:
+                if job["id"] == job_id and job["status"] == "queued":
+                    job.update(status="cancelled", finished_at=datetime.now(timezone.utc).isoformat())
+                elif job["id"] == job_id and job["status"] == "running":
+                    job["cancel_requested"] = True
+
+    def add_job_events(self, rows, chunk_size=500):
+        with self._lock:
+            self.job_events.extend(self._with_id(row) for row in rows)
+
+    def fetch_job_events(self, job_id, after_id=0, limit=500):
+        with self._lock:
+            return copy.deepcopy([e for e in self.job_events if e["job_id"] == job_id and e["id"] > after_id][:limit])
+
+    def update_run_progress(self, run_id, progress):
+        with self._lock:
+            for run in self.runs:
+                if run["id"] == run_id:
+                    run.update(progress=copy.deepcopy(progress), checkpoint_at=datetime.now(timezone.utc).isoformat())
+
+    def reopen_run(self, run_id):
+        with self._lock:
+            for run in self.runs:
+                if run["id"] == run_id:
+                    run.update(status="running", finished_at=None)
@@ -28,9 +28,10 @@ def migrate():
         with open("c:/repos/InnovA/src/trends_db.json", 'r', encoding='utf-8') as f:
             trends = json.load(f)
             print(f"📦 Migrando {len(trends)} tendencias...")
-            # db.save_trends maneja lista
-            db.save_trends(trends)
-            print("   ✅ Tendencias guardadas.")
+            # db.save_trends guarda por lotes con reintentos
+            summaries = db.save_trends(trends)
+            failed = sum(s["failed"] for s in summaries)
+            print(f"   ✅ Tendencias guardadas ({len(summaries)} lotes, {failed} fallidas).")
     except Exception as e:
         print(f"   ❌ Error migrando tendencias: {e}")
         
@@ -0,0 +1,105 @@
+import threading
+from datetime import datetime, timezone
+
+from dedup import normalize_text, STOPWORDS
+from feed_health import parse_timestamp
+
+# Pesos de la prioridad estimada de un par (suman 1): afinidad de palabras, frescura y categoría de la fuente
+WEIGHTS = {"similarity": 0.5, "recency": 0.3, "category": 0.2}
+RECENCY_HALF_LIFE_H = 72 # Una noticia de 3 días vale la mitad que una de hoy
+
+def _words(text):
+    return {w for w in normalize_text(text).split() if w not in STOPWORDS and len(w) > 2}
+
+def recency_score(published_at, now=None, half_life_hours=RECENCY_HALF_LIFE_H):
+    """
+    1.0 para una noticia recién publicada, decae a la mitad cada half_life_hours. 0 sin fecha.
+    """
+    published = parse_timestamp(published_at)
+    if published is None:
+        return 0.0
+    if published.tzinfo is None:
+        published = published.replace(tzinfo=timezone.utc)
+    age_hours = max(0.0, ((now or datetime.now(timezone.utc)) - published).total_seconds() / 3600)
+    return 0.5 ** (age_hours / half_life_hours)
+
+def category_score(client, source):
+    """
+    Afinidad entre la industria del cliente y la categoría de la fuente (Jaccard de palabras).
+    Una fuente exclusiva del cliente vale 1.0.
+    """
+    if not source:
+        return 0.0
+    if source.get('client_id') is not None and source.get('client_id') == client.get('id'):
+        return 1.0
+    industry, category = _words(client.get('industry')), _words(source.get('category'))
+    if not industry or not category:
+        return 0.0
+    return len(industry & category) / len(industry | category)
+
+def rank_pairs(pairs, similarity_of, sources_by_name=None, now=None, weights=WEIGHTS):
+    """
+    Prioridad estimada (0-1, sin LLM) de cada par (cliente, tendencia). similarity_of(cliente, tendencia)
+    da la afinidad de palabras clave (coseno TF-IDF). Retorna [(prioridad, índice_par)] de mayor a menor;
+    en empate se conserva el orden original.
+    """
+    sources_by_name = sources_by_name or {}
+    now = now or datetime.now(timezone.utc)
+    ranked = []
+    for index, (client, trend) in enumerate(pairs):
+        priority = (weights["similarity"] * max(0.0, similarity_of(client, trend))
+                    + weights["recency"] * recency_score(trend.get('published_at'), now)
+                    + weights["category"] * category_score(client, sources_by_name.get(trend.get('source'))))
+        ranked.append((round(priority, 4), index))
+    ranked.sort(key=lambda item: (-item[0], item[1]))
+    return ranked
+
+class MatchBudget:
+    """
+    Presupuesto de una corrida anytime: máximo de llamadas reales a Gemini y/o de tokens.
+    Lo gastado sale del UsageTracker (los aciertos de caché no cuentan); lo que está en vuelo
+    se reserva con una estimación para no pasarse con llamadas en paralelo.
+    """
+    def __init__(self, usage, max_calls=None, max_tokens=None):
+        self.usage = usage
+        self.max_calls = max_calls
+        self.max_tokens = max_tokens
+        self._lock = threading.Lock()
+        self._reserved_calls = 0
+        self._reserved_tokens = 0
+        self._base_calls, self._base_tokens = self._spent()
+        self.rejected = False
+
+    def _spent(self):
+        calls = [c for c in self.usage.calls() if not c.get('cached')]
+        return len(calls), sum(c.get('total_tokens') or 0 for c in calls)
+
+    def spent(self):
+        calls, tokens = self._spent()
+        return calls - self._base_calls, tokens - self._base_tokens
+
+    def admit(self, estimated_tokens):
+        """
+        Reserva una llamada de estimated_tokens si cabe en el presupuesto. Retorna si se admitió.
+        """
+        with self._lock:
+            calls, tokens = self.spent()
+            if self.max_calls is not None and calls + self._reserved_calls + 1 > self.max_calls:
+                self.rejected = True
+                return False
+            if self.max_tokens is not None and tokens + self._reserved_tokens + estimated_tokens > self.max_tokens:
+                self.rejected = True
+                return False
+            self._reserved_calls += 1
+            self._reserved_tokens += estimated_tokens
+            return True
+
+    def release(self, estimated_tokens):
+        # La llamada terminó: lo real ya está en el UsageTracker
+        with self._lock:
+            self._reserved_calls -= 1
+            self._reserved_tokens -= estimated_tokens
+
+    def state(self):
+        calls, tokens = self.spent()
+        return {"calls": calls, "tokens": tokens, "max_calls": self.max_calls, "max_tokens": self.max_tokens}
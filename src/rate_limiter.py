@@ -0,0 +1,158 @@
+import os
+import random
+import re
+import threading
+import time
+
+DEFAULT_RPM = 15 # Free Tier de Gemini Flash
+DEFAULT_TPM = 1_000_000
+
+def estimate_tokens(text):
+    # Aproximación estándar: ~4 caracteres por token
+    return max(1, len(text or "") // 4)
+
+def is_rate_limit_error(error):
+    """
+    True si la excepción es un 429 / ResourceExhausted de la API de Gemini.
+    """
+    try:
+        from google.api_core.exceptions import ResourceExhausted, TooManyRequests
+        if isinstance(error, (ResourceExhausted, TooManyRequests)):
+            return True
+    except ImportError:
+        pass
+    message = str(error).lower()
+    return "429" in message or "resourceexhausted" in message or "resource has been exhausted" in message
+
+def retry_after_seconds(error):
+    """
+    Extrae el tiempo de espera sugerido por la API (retry_delay / Retry-After), si viene.
+    """
+    match = re.search(r"retry[_ -]?(?:delay|after|in)\D{0,20}(\d+(?:\.\d+)?)", str(error), re.IGNORECASE)
+    return float(match.group(1)) if match else None
+
+class TokenBucket:
+    """
+    Balde de tokens con recarga continua. reserve() descuenta aunque quede en deuda
+    y retorna cuántos segundos hay que esperar para saldarla.
+    """
+    def __init__(self, capacity, refill_per_second):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.refill_per_second)
+        self.updated = now
+
+    def reserve(self, amount, now):
+        self._refill(now)
+        self.level -= amount
+        if self.level >= 0:
+            return 0.0
+        return -self.level / self.refill_per_second
+
+    def available(self, now):
+        self._refill(now)
+        return self.level
+
+class RateLimiter:
+    """
+    Admisión por token bucket con presupuestos RPM (requests) y TPM (tokens).
+    Adaptativo: ante un 429 reduce a la mitad la tasa efectiva y bloquea con backoff
+    exponencial con jitter (o el retry-after informado); cada éxito la recupera de a poco.
+    """
+    def __init__(self, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM, base_backoff=2.0, max_backoff=60.0, sleep=time.sleep):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._requests = TokenBucket(rpm, rpm / 60)
+        self._tokens = TokenBucket(tpm, tpm / 60)
+        self._rate_factor = 1.0
+        self._blocked_until = 0.0
+        self.last_wait = 0.0
+        self.total_wait = 0.0
+        self.throttled_calls = 0
+        self.rate_limited_errors = 0
+
+    def _apply_rate_factor(self):
+        self._requests.refill_per_second = self.rpm * self._rate_factor / 60
+        self._tokens.refill_per_second = self.tpm * self._rate_factor / 60
+
+    def acquire(self, estimated_tokens=1):
+        """
+        Bloquea hasta que haya cupo para una request de estimated_tokens. Retorna los segundos esperados.
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = max(
+                self._requests.reserve(1, now),
+                self._tokens.reserve(min(estimated_tokens, self.tpm), now),
+                self._blocked_until - now
+            )
+            wait = max(0.0, wait)
+            self.last_wait = wait
+            if wait > 0:
+                self.total_wait += wait
+                self.throttled_calls += 1
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+
+    def record_success(self):
+        with self._lock:
+            if self._rate_factor < 1.0:
+                self._rate_factor = min(1.0, self._rate_factor + 0.05)
+                self._apply_rate_factor()
+
+    def penalize(self, attempt, retry_after=None):
+        """
+        Registra un 429: baja la tasa efectiva y bloquea nuevas admisiones. Retorna el backoff aplicado.
+        """
+        with self._lock:
+            self.rate_limited_errors += 1
+            self._rate_factor = max(0.1, self._rate_factor / 2)
+            self._apply_rate_factor()
+            backoff = min(self.max_backoff, self.base_backoff * (2 ** attempt))
+            delay = retry_after if retry_after is not None else random.uniform(backoff / 2, backoff)
+            self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+            return delay
+
+    def state(self):
+        """
+        Estado actual del throttling, para mostrarlo en logs o en el dashboard.
+        """
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "rpm": self.rpm,
+                "tpm": self.tpm,
+                "effective_rpm": round(self.rpm * self._rate_factor, 1),
+                "requests_available": round(self._requests.available(now), 2),
+                "tokens_available": int(self._tokens.available(now)),
+                "blocked_for": round(max(0.0, self._blocked_until - now), 2),
+                "last_wait": round(self.last_wait, 2),
+                "total_wait": round(self.total_wait, 2),
+                "throttled_calls": self.throttled_calls,
+                "rate_limited_errors": self.rate_limited_errors
+            }
+
+_shared_limiter = None
+_shared_limiter_lock = threading.Lock()
+
+def get_rate_limiter():
+    """
+    Limitador compartido por todos los llamadores de Gemini del proceso (GEMINI_RPM, GEMINI_TPM).
+    """
+    global _shared_limiter
+    with _shared_limiter_lock:
+        if _shared_limiter is None:
+            _shared_limiter = RateLimiter(
+                rpm=int(os.getenv("GEMINI_RPM", DEFAULT_RPM)),
+                tpm=int(os.getenv("GEMINI_TPM", DEFAULT_TPM))
+            )
+        return _shared_limiter
@@ -0,0 +1,321 @@
+import argparse
+import glob
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from db_client import DatabaseClient
+from ingestor import InnovationIngestor
+from matcher import OpportunityMatcher
+
+DEFAULT_LOCK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".innova_scheduler.lock")
+
+class RunLock:
+    """
+    Lock de archivo para evitar corridas superpuestas (varios procesos o un cron lento).
+    Un lock más antiguo que stale_after segundos se considera abandonado y se reemplaza; mientras
+    se tiene, un hilo renueva su mtime cada refresh_every segundos para que una corrida larga no lo pierda.
+    """
+    def __init__(self, path=DEFAULT_LOCK_PATH, stale_after=3 * 3600, refresh_every=None):
+        self.path = path
+        self.stale_after = stale_after
+        self.refresh_every = refresh_every or min(60, stale_after / 4)
+        self.acquired = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def acquire(self):
+        for _ in range(2):
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if self._is_stale():
+                    self._remove()
+                    continue
+                return False
+            with os.fdopen(fd, "w") as f:
+                f.write(f"{os.getpid()} {datetime.now().isoformat()}\n")
+            self.acquired = True
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._refresh_loop, daemon=True)
+            self._thread.start()
+            return True
+        return False
+
+    def release(self):
+        if self.acquired:
+            self._stop.set()
+            self._thread.join()
+            self._remove()
+            self.acquired = False
+
+    def refresh(self):
+        # Latido: el mtime marca que el dueño sigue vivo
+        try:
+            os.utime(self.path)
+        except OSError as e:
+            print(f"⚠️ No se pudo renovar el lock {self.path}: {e}")
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.refresh_every):
+            self.refresh()
+
+    def _is_stale(self):
+        try:
+            return time.time() - os.path.getmtime(self.path) > self.stale_after
+        except OSError:
+            return True # Desapareció entre medio: se puede reintentar
+
+    def _remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def held(self):
+        # Tomado por alguien que sigue latiendo
+        return os.path.exists(self.path) and not self._is_stale()
+
+    def __enter__(self):
+        if not self.acquire():
+            raise RuntimeError(f"Otra ejecución tiene el lock: {self.path}")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+def job_lock_path(cycle_path, job_id):
+    return f"{cycle_path}.job-{job_id}"
+
+def running_job_locks(cycle_path, stale_after=3 * 3600):
+    """
+    Locks vigentes de trabajos de la cola (jobs.py) junto al lock del cron.
+    """
+    return [path for path in glob.glob(job_lock_path(cycle_path, "*")) if RunLock(path, stale_after).held()]
+
+class CycleLock(RunLock):
+    """
+    Lock de un ciclo del cron: exclusivo entre ciclos y no se toma mientras haya trabajos de la cola en curso.
+    """
+    def acquire(self):
+        if not super().acquire():
+            return False
+        if running_job_locks(self.path, self.stale_after):
+            self.release()
+            return False
+        return True
+
+class JobLock(RunLock):
+    """
+    Lock de un trabajo de la cola: uno por trabajo, así los trabajos no se excluyen entre sí (eso lo regula
+    max_running en claim_job), pero ninguno corre durante un ciclo del cron. Cada lado crea su lock y luego
+    revisa el del otro: ante una carrera ambos ceden, nunca corren juntos.
+    """
+    def __init__(self, cycle_path, job_id, **kwargs):
+        super().__init__(job_lock_path(cycle_path, job_id), **kwargs)
+        self.cycle = RunLock(cycle_path, self.stale_after)
+
+    def acquire(self):
+        if not super().acquire():
+            return False
+        if self.cycle.held():
+            self.release()
+            return False
+        return True
+
+class RunCancelled(Exception):
+    """
+    La corrida se detuvo a pedido (cancelación de un job); lo ya guardado se conserva.
+    """
+
+def consume_events(events, log=print, on_event=None, cancelled=None):
+    """
+    Consume un generador de eventos {"type": "log"/"result"/...} del ingestor o matcher.
+    on_event(evento) recibe cada evento; si cancelled() se vuelve verdadero se cierra el generador
+    y se lanza RunCancelled. Retorna (data_del_resultado, errores).
+    """
+    data, errors = [], []
+    for update in events:
+        if on_event is not None:
+            on_event(update)
+        if cancelled is not None and cancelled():
+            events.close()
+            raise RunCancelled("Corrida cancelada")
+        if update["type"] == "log":
+            log(update["message"])
+            if "❌" in update["message"]:
+                errors.append(update["message"].strip())
+        elif update["type"] == "result":
+            data = update["data"]
+    return data, errors
+
+def _record_run(kind, params, job, run_id=None, on_event=None):
+    """
+    Ejecuta job(run_id) registrando duración, items y errores en la tabla runs.
+    job retorna (items, errores); run_id puede ser None si no se pudo registrar la corrida.
+    Con run_id se reabre esa corrida (reanudación) en vez de crear una nueva.
+    on_event recibe {"type": "run", "run_id": ...} al registrarse la corrida.
+    """
+    db = DatabaseClient()
+    try:
+        if run_id is not None:
+            db.reopen_run(run_id)
+        else:
+            run_id = db.start_run(kind, params)["id"]
+    except Exception as e:
+        print(f"⚠️ No se pudo registrar la corrida '{kind}': {e}")
+    if on_event is not None and run_id is not None:
+        on_event({"type": "run", "run_id": run_id})
+
+    started = time.perf_counter()
+    status, items, errors = "completed", 0, []
+    try:
+        items, errors = job(run_id)
+    except RunCancelled as e:
+        status = "cancelled"
+        errors.append(str(e))
+        print(f"🛑 Corrida '{kind}' cancelada.")
+    except Exception as e:
+        status = "failed"
+        errors.append(str(e))
+        print(f"❌ Corrida '{kind}' fallida: {e}")
+
+    duration = time.perf_counter() - started
+    print(f"🏁 {kind}: {status} en {duration:.1f}s ({items} items, {len(errors)} errores).")
+    if run_id is not None:
+        try:
+            db.finish_run(run_id, status, duration, items, errors)
+        except Exception as e:
+            print(f"⚠️ No se pudo cerrar la corrida {run_id}: {e}")
+    return status
+
+def run_ingest(parse_workers=0, log=print, on_event=None, cancelled=None):
+    def job(run_id):
+        ingestor = InnovationIngestor(parse_workers=parse_workers)
+        trends, errors = consume_events(ingestor.fetch_trends(), log=log, on_event=on_event, cancelled=cancelled)
+        ingestor.save_usage(run_id)
+        if trends:
+            summaries = ingestor.save_trends(trends)
+            errors += [f"Lote {s['chunk']}: {s['error']}" for s in summaries if s.get("failed")]
+        else:
+            ingestor.commit_source_state()
+        return len(trends), errors
+    return _record_run("ingest", {"parse_workers": parse_workers}, job, on_event=on_event)
+
+def run_matching(client_name=None, trend_limit=5, prefilter=False, concurrency=1, batch_clients=False, incremental=True,
+                 cascade=False, triage_threshold=40, triage_top_k=None, max_calls=None, max_tokens=None, resume_run_id=None,
+                 stream_pitch=False, log=print, on_event=None, cancelled=None):
+    def job(run_id):
+        matcher = OpportunityMatcher(max_concurrency=concurrency, batch_clients=batch_clients,
+                                     cascade=cascade, triage_threshold=triage_threshold, triage_top_k=triage_top_k,
+                                     stream_pitch=stream_pitch)
+        # Con run_id cada par queda guardado al terminar: si la corrida se corta, se puede reanudar
+        try:
+            events = matcher.run_matching_cycle(specific_client_name=client_name, trend_limit=trend_limit, prefilter=prefilter, incremental=incremental, run_id=run_id,
+                                                max_calls=max_calls, max_tokens=max_tokens)
+            matches, errors = consume_events(events, log=log, on_event=on_event, cancelled=cancelled)
+        finally:
+            # El uso de las llamadas hechas se guarda aunque la corrida se cancele
+            matcher.save_usage(run_id)
+        if matches:
+            matcher.save_opportunities(matches)
+        return len(matches), errors
+    params = {"client": client_name, "trend_limit": trend_limit, "prefilter": prefilter, "concurrency": concurrency, "batch_clients": batch_clients,
+              "incremental": incremental, "cascade": cascade, "triage_threshold": triage_threshold, "triage_top_k": triage_top_k,
+              "max_calls": max_calls, "max_tokens": max_tokens}
+    return _record_run("matching", params, job, run_id=resume_run_id, on_event=on_event)
+
+# Parámetros guardados en runs.params -> argumentos de run_matching
+MATCHING_PARAMS = {"client": "client_name", "trend_limit": "trend_limit", "prefilter": "prefilter", "concurrency": "concurrency",
+                   "batch_clients": "batch_clients", "incremental": "incremental", "cascade": "cascade",
+                   "triage_threshold": "triage_threshold", "triage_top_k": "triage_top_k",
+                   "max_calls": "max_calls", "max_tokens": "max_tokens"}
+
+def matching_kwargs(params):
+    # runs.params (o params de un job) -> argumentos de run_matching
+    return {arg: params[key] for key, arg in MATCHING_PARAMS.items() if key in params}
+
+def resume_matching(run_id, **hooks):
+    """
+    Reanuda una corrida de matching interrumpida con sus parámetros originales; omite los pares ya guardados.
+    hooks (log, on_event, cancelled) se pasan a run_matching.
+    """
+    run = DatabaseClient().fetch_run(run_id)
+    if not run or run.get("kind") != "matching":
+        print(f"⚠️ No existe la corrida de matching #{run_id}.")
+        return None
+    return run_matching(resume_run_id=run_id, **matching_kwargs(run.get("params") or {}), **hooks)
+
+def run_cycle(args):
+    """
+    Una pasada completa (ingesta y/o matching) protegida por el lock.
+    """
+    lock = CycleLock(args.lock_file)
+    if not lock.acquire():
+        print(f"⏭️ Otra ejecución en curso ({args.lock_file}), se omite este ciclo.")
+        return False
+    try:
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] ⏰ Iniciando ciclo programado...")
+        if not args.skip_ingest:
+            run_ingest(parse_workers=args.parse_workers)
+        if not args.skip_matching:
+            run_matching(client_name=args.client, trend_limit=args.trend_limit, prefilter=args.prefilter, concurrency=args.concurrency, batch_clients=args.batch_clients, incremental=not args.full_rescore,
+                         cascade=args.cascade, triage_threshold=args.triage_threshold, triage_top_k=args.triage_top_k,
+                         max_calls=args.max_calls, max_tokens=args.max_tokens)
+        return True
+    finally:
+        lock.release()
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="InnovA Radar: ingesta y matching programados (sin UI).")
+    parser.add_argument("--once", action="store_true", help="Ejecutar un solo ciclo y salir")
+    parser.add_argument("--interval", type=int, default=3600, help="Segundos entre ciclos (modo daemon)")
+    parser.add_argument("--skip-ingest", action="store_true", help="No ejecutar la ingesta RSS")
+    parser.add_argument("--parse-workers", type=int, default=0, help="Procesos para parsear feeds (0 = sin pool)")
+    parser.add_argument("--skip-matching", action="store_true", help="No ejecutar el matching con IA")
+    parser.add_argument("--client", default=None, help="Limitar el matching a un cliente")
+    parser.add_argument("--trend-limit", type=int, default=5, help="Tendencias a analizar por cliente")
+    parser.add_argument("--prefilter", action="store_true", help="Pre-filtro local TF-IDF antes de llamar a Gemini")
+    parser.add_argument("--concurrency", type=int, default=4, help="Pares cliente-tendencia evaluados en paralelo")
+    parser.add_argument("--batch-clients", action="store_true", help="Un prompt por tendencia con varios clientes")
+    parser.add_argument("--full-rescore", action="store_true", help="Reevaluar también los pares ya registrados en el ledger")
+    parser.add_argument("--cascade", action="store_true", help="Triage breve de todos los pares y pitch solo para los ganadores")
+    parser.add_argument("--triage-threshold", type=int, default=40, help="Puntaje de triage mínimo para la etapa de pitch")
+    parser.add_argument("--triage-top-k", type=int, default=None, help="Además, los K mejores pares de triage por cliente")
+    parser.add_argument("--max-calls", type=int, default=None, help="Modo anytime: tope de llamadas a Gemini, pares por prioridad")
+    parser.add_argument("--max-tokens", type=int, default=None, help="Modo anytime: tope de tokens de Gemini, pares por prioridad")
+    parser.add_argument("--resume", type=int, default=None, metavar="RUN_ID", help="Reanudar una corrida de matching interrumpida y salir")
+    parser.add_argument("--lock-file", default=DEFAULT_LOCK_PATH, help="Ruta del archivo de lock")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.resume is not None:
+        lock = CycleLock(args.lock_file)
+        if not lock.acquire():
+            print(f"⏭️ Otra ejecución en curso ({args.lock_file}), no se puede reanudar ahora.")
+            return
+        try:
+            resume_matching(args.resume)
+        finally:
+            lock.release()
+        return
+    if args.once:
+        run_cycle(args)
+        return
+
+    print(f"📅 Scheduler activo: un ciclo cada {args.interval}s (Ctrl+C para detener).")
+    try:
+        while True:
+            started = time.monotonic()
+            run_cycle(args)
+            time.sleep(max(0, args.interval - (time.monotonic() - started)))
+    except KeyboardInterrupt:
+        print("👋 Scheduler detenido.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import os
+import threading
+from datetime import datetime, timezone
+
+from feed_health import percentile
+
+# Precio de lista aproximado en USD por millón de tokens (entrada, salida).
+# Se puede sobrescribir con GEMINI_PRICE_INPUT / GEMINI_PRICE_OUTPUT para el modelo en uso.
+MODEL_PRICES = {
+    "gemini-pro": (0.50, 1.50),
+    "gemini-flash-latest": (0.30, 2.50),
+    "gemini-1.5-flash": (0.075, 0.30),
+    "gemini-1.5-pro": (1.25, 5.00),
+}
+DEFAULT_PRICE = (0.30, 2.50)
+
+def _model_key(model_name):
+    return (model_name or "").split("/")[-1]
+
+def model_price(model_name):
+    price = MODEL_PRICES.get(_model_key(model_name), DEFAULT_PRICE)
+    return (
+        float(os.getenv("GEMINI_PRICE_INPUT", price[0])),
+        float(os.getenv("GEMINI_PRICE_OUTPUT", price[1]))
+    )
+
+def estimate_cost(model_name, prompt_tokens, output_tokens):
+    input_price, output_price = model_price(model_name)
+    return ((prompt_tokens or 0) * input_price + (output_tokens or 0) * output_price) / 1_000_000
+
+def _count(value):
+    # usage_metadata puede faltar (respuestas simuladas, versiones viejas del SDK)
+    return value if isinstance(value, int) and not isinstance(value, bool) else None
+
+def usage_counts(response):
+    """
+    (prompt_tokens, output_tokens, total_tokens) desde response.usage_metadata; None si no viene.
+    """
+    metadata = getattr(response, "usage_metadata", None)
+    if metadata is None:
+        return None, None, None
+    return (
+        _count(getattr(metadata, "prompt_token_count", None)),
+        _count(getattr(metadata, "candidates_token_count", None)),
+        _count(getattr(metadata, "total_token_count", None))
+    )
+
+def summarize_calls(calls, by):
+    """
+    Agrega llamadas por "site", "run_id", "model" o "client". Por cliente, el costo y los tokens
+    de una llamada por lote se reparten en partes iguales entre sus clientes.
+    Latencia p50/p95 solo sobre llamadas reales (no aciertos de caché).
+    """
+    groups = {}
+    for call in calls:
+        if by == "client":
+            keys = call.get("client_keys") or [None]
+            share = 1 / len(keys)
+        else:
+            keys, share = [call.get(by)], 1
+        for key in keys:
+            group = groups.setdefault(key, {by: key, "calls": 0, "cached": 0, "prompt_tokens": 0, "output_tokens": 0, "cost_usd": 0.0, "latencies": []})
+            group["calls"] += 1
+            group["cached"] += int(bool(call.get("cached")))
+            group["prompt_tokens"] += (call.get("prompt_tokens") or 0) * share
+            group["output_tokens"] += (call.get("output_tokens") or 0) * share
+            group["cost_usd"] += float(call.get("cost_usd") or 0) * share
+            if not call.get("cached") and call.get("latency_ms") is not None:
+                group["latencies"].append(call["latency_ms"])
+
+    rows = []
+    for group in groups.values():
+        latencies = group.pop("latencies")
+        real_calls = group["calls"] - group["cached"]
+        group["prompt_tokens"] = round(group["prompt_tokens"])
+        group["output_tokens"] = round(group["output_tokens"])
+        group["avg_prompt_tokens"] = round(group["prompt_tokens"] / real_calls) if real_calls else 0
+        group["cost_usd"] = round(group["cost_usd"], 6)
+        group["latency_p50_ms"] = percentile(latencies, 50)
+        group["latency_p95_ms"] = percentile(latencies, 95)
+        rows.append(group)
+    return sorted(rows, key=lambda r: -r["cost_usd"])
+
+class UsageTracker:
+    """
+    Registro en memoria (seguro entre hilos) de cada llamada a Gemini: tokens, latencia, costo,
+    sitio de llamada y claves de cliente/tendencia. flush() lo persiste en llm_calls.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = []
+
+    def record(self, site, model, prompt_tokens=None, output_tokens=None, total_tokens=None,
+               latency_ms=None, wait_s=0.0, cached=False, estimated=False, tags=None):
+        tags = tags or {}
+        prompt_tokens = prompt_tokens or 0
+        output_tokens = output_tokens or 0
+        call = {
+            "site": site,
+            "model": model,
+            "client_keys": [str(k) for k in tags.get("client_keys", []) if k is not None],
+            "trend_key": tags.get("trend_key"),
+            "prompt_tokens": prompt_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": total_tokens or prompt_tokens + output_tokens,
+            "latency_ms": None if latency_ms is None else int(latency_ms),
+            "wait_s": round(wait_s or 0.0, 2),
+            "cost_usd": 0.0 if cached else round(estimate_cost(model, prompt_tokens, output_tokens), 6),
+            "cached": cached,
+            "estimated": estimated,
+            "created_at": datetime.now(timezone.utc).isoformat()
+        }
+        with self._lock:
+            self._calls.append(call)
+        return call
+
+    def calls(self):
+        with self._lock:
+            return list(self._calls)
+
+    def summary(self):
+        """
+        Totales por sitio de llamada (ver summarize_calls).
+        """
+        return {row["site"]: row for row in summarize_calls(self.calls(), "site")}
+
+    def totals(self):
+        calls = self.calls()
+        return {
+            "calls": len(calls),
+            "prompt_tokens": sum(c["prompt_tokens"] for c in calls),
+            "output_tokens": sum(c["output_tokens"] for c in calls),
+            "cost_usd": round(sum(c["cost_usd"] for c in calls), 6)
+        }
+
+    def flush(self, db, run_id=None):
+        """
+        Persiste las llamadas registradas (etiquetadas con run_id) y vacía el registro. Retorna cuántas guardó.
+        """
+        with self._lock:
+            calls, self._calls = self._calls, []
+        if not calls:
+            return 0
+        try:
+            db.save_llm_calls([dict(call, run_id=run_id) for call in calls])
+        except Exception:
+            # Se devuelven al registro para no perderlas si el llamador reintenta
+            with self._lock:
+                self._calls = calls + self._calls
+            raise
+        return len(calls)
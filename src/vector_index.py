@@ -0,0 +1,131 @@
+import hashlib
+import os
+
+import numpy as np
+
+from dedup import normalize_text, STOPWORDS
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CACHE_PATH = os.path.join(PROJECT_ROOT, ".cache", "vectors.npz")
+DIMENSIONS = 4096 # Feature hashing: vocabulario abierto sin ajustar un modelo
+
+def _tokens(text):
+    return [w for w in normalize_text(text).split() if w not in STOPWORDS and len(w) > 2]
+
+def term_vector(text, dimensions=DIMENSIONS):
+    """
+    Vector de frecuencias (TF sublineal) con feature hashing. No depende del corpus,
+    por eso se puede cachear por documento; el IDF se aplica al construir el índice.
+    """
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for token in _tokens(text):
+        bucket = int.from_bytes(hashlib.md5(token.encode("utf-8")).digest()[:4], "big") % dimensions
+        vector[bucket] += 1
+    return np.log1p(vector)
+
+def trend_text(trend):
+    return f"{trend.get('title') or ''} {trend.get('summary') or ''}"
+
+def client_text(client):
+    return f"{client.get('industry') or ''} {client.get('tech_context_raw') or ''}"
+
+class VectorCache:
+    """
+    Caché en disco (npz) de vectores por documento, invalidada por hash de contenido:
+    si una tendencia o cliente cambia, su vector se recalcula.
+    """
+    def __init__(self, path=DEFAULT_CACHE_PATH, dimensions=DIMENSIONS):
+        self.path = path
+        self.dimensions = dimensions
+        self._vectors = {} # key -> (content_hash, vector)
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            data = np.load(self.path, allow_pickle=False)
+            if data["matrix"].shape[1] != self.dimensions:
+                return
+            for key, content_hash, vector in zip(data["keys"], data["hashes"], data["matrix"]):
+                self._vectors[str(key)] = (str(content_hash), vector)
+        except Exception as e:
+            print(f"⚠️ Caché de vectores ilegible, se reconstruye: {e}")
+
+    def get(self, key, text):
+        content_hash = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        cached = self._vectors.get(key)
+        if cached and cached[0] == content_hash:
+            return cached[1]
+        vector = term_vector(text, self.dimensions)
+        self._vectors[key] = (content_hash, vector)
+        self._dirty = True
+        return vector
+
+    def save(self):
+        if not self._dirty or not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        keys = list(self._vectors)
+        np.savez_compressed(
+            self.path,
+            keys=np.array(keys),
+            hashes=np.array([self._vectors[k][0] for k in keys]),
+            matrix=np.stack([self._vectors[k][1] for k in keys]) if keys else np.zeros((0, self.dimensions), dtype=np.float32)
+        )
+        self._dirty = False
+
+class SimilarityIndex:
+    """
+    Similitud coseno TF-IDF entre clientes y tendencias, 100% local (NumPy).
+    """
+    def __init__(self, cache=None, dimensions=DIMENSIONS):
+        self.cache = cache
+        self.dimensions = dimensions
+
+    def _vector(self, key, text):
+        if self.cache is not None:
+            return self.cache.get(key, text)
+        return term_vector(text, self.dimensions)
+
+    def similarity(self, trends, clients):
+        """
+        Matriz (clientes x tendencias) de similitud coseno.
+        """
+        if not trends or not clients:
+            return np.zeros((len(clients), len(trends)), dtype=np.float32)
+
+        trend_matrix = np.stack([self._vector(f"trend:{t.get('id') or t.get('url')}", trend_text(t)) for t in trends])
+        client_matrix = np.stack([self._vector(f"client:{c.get('id') or c.get('name')}", client_text(c)) for c in clients])
+        if self.cache is not None:
+            self.cache.save()
+
+        # IDF sobre el corpus actual (tendencias + clientes)
+        corpus = np.vstack([trend_matrix, client_matrix])
+        document_frequency = (corpus > 0).sum(axis=0)
+        idf = np.log((1 + len(corpus)) / (1 + document_frequency)) + 1
+
+        def _normalize(matrix):
+            weighted = matrix * idf
+            norms = np.linalg.norm(weighted, axis=1, keepdims=True)
+            return weighted / np.where(norms == 0, 1, norms)
+
+        return _normalize(client_matrix) @ _normalize(trend_matrix).T
+
+    def select_candidates(self, trends, clients, top_k=None, threshold=None):
+        """
+        Para cada cliente, índices de tendencias a evaluar ordenados por similitud:
+        las top_k más similares y/o las que superan threshold.
+        En empate se conserva el orden original (más recientes primero).
+        """
+        scores = self.similarity(trends, clients)
+        selection = []
+        for row in scores:
+            order = sorted(range(len(trends)), key=lambda i: -row[i])
+            if threshold is not None:
+                order = [i for i in order if row[i] >= threshold]
+            if top_k is not None:
+                order = order[:top_k]
+            selection.append([(i, float(row[i])) for i in order])
+        return selection
@@ -0,0 +1,16 @@
+import pytest
+import sys
+import os
+
+# Asegurar que pytest encuentra 'src'
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+import rate_limiter
+
+@pytest.fixture(autouse=True)
+def no_quota_waits():
+    """Limitador compartido sin esperas reales para que los tests no duerman por cuota"""
+    previous = rate_limiter._shared_limiter
+    rate_limiter._shared_limiter = rate_limiter.RateLimiter(rpm=100_000, tpm=100_000_000, sleep=lambda s: None)
+    yield
+    rate_limiter._shared_limiter = previous
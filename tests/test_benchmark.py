@@ -0,0 +1,54 @@
+import pytest
+import sys
+import os
+import json
+
+# Asegurar que pytest encuentra 'src'
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+import fake_gemini
+import matcher
+from benchmark import build_dataset, bench_ingest, bench_matching, check_regressions, SCENARIOS
+from rate_limiter import is_rate_limit_error
+
+def test_fake_gemini_is_deterministic_and_injects_429():
+    """Verifica respuestas JSON deterministas por tipo de prompt y 429 reconocibles por el limitador"""
+    fake_gemini.install(seed=1)
+    model = fake_gemini.GenerativeModel("gemini-test")
+    prompt = "ACTÚA COMO: Arquitecto de Soluciones\nNombre: Banco\nTítulo: IA en banca"
+
+    first, second = model.generate_content(prompt), model.generate_content(prompt)
+    data = json.loads(first.text)
+    assert first.text == second.text
+    assert 0 <= data["match_score"] <= 100 and data["generated_pitch"]
+    assert first.usage_metadata.total_token_count > 0
+    assert model.model_name == "models/gemini-test"
+
+    fake_gemini.install(rate_429=1.0)
+    with pytest.raises(Exception) as error:
+        model.generate_content(prompt)
+    assert is_rate_limit_error(error.value)
+    assert fake_gemini.backend.stats()["errors_429"] == 1
+
+def test_benchmark_end_to_end_offline():
+    """Verifica ingesta y matching end-to-end contra los sustitutos, y que el parche se restaure"""
+    original_genai, original_db = matcher.genai, matcher.DatabaseClient
+    dataset = build_dataset(clients=3, sources=2, entries_per_source=4, client_sources=1)
+
+    ingest, db = bench_ingest(dataset, feed_latency_ms=0)
+    assert ingest["trends"] > 0 and ingest["errors"] == 0
+    assert ingest["calls_by_kind"].get("relevance_batch", 0) >= 1 # Fuente exclusiva de cliente
+
+    single = bench_matching(db, "concurrente", SCENARIOS["concurrente"], trend_limit=2)
+    batch = bench_matching(db, "lote", SCENARIOS["lote"], trend_limit=2)
+    assert single["pairs"] == batch["pairs"] == 6
+    assert batch["calls_by_kind"]["match_batch"] < single["calls_by_kind"]["match"]
+
+    assert matcher.genai is original_genai and matcher.DatabaseClient is original_db
+
+def test_check_regressions():
+    """Verifica la detección de caídas de throughput frente a la corrida base"""
+    baseline = [{"scenario": "lote", "pairs_per_s": 100.0}, {"scenario": "ingesta", "trends_per_s": 50.0}]
+    reports = [{"scenario": "lote", "pairs_per_s": 70.0}, {"scenario": "ingesta", "trends_per_s": 45.0}]
+
+    assert check_regressions(reports, baseline, tolerance=0.2) == ["lote: 70.0 pairs_per_s (base 100.0)"]
@@ -0,0 +1,66 @@
+import sys
+import os
+import json
+from unittest.mock import MagicMock
+
+# Asegurar que pytest encuentra 'src'
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from client_digest import ClientDigester, digest_hash, digest_to_text, fit_to_budget, is_fresh, normalize_digest
+from rate_limiter import estimate_tokens
+
+def test_normalize_and_render_digest():
+    """Verifica que la respuesta se lleve a la forma de client_db.json y se renderice compacta"""
+    digest = normalize_digest({"industry": "Banca", "tech_stack": {"cloud": ["AWS", ""], "mainframe": ["z/OS"]},
+                               "pain_points": ["Fraude"], "strategic_goals": "no es lista"})
+
+    assert digest["tech_stack"] == {"cloud": ["AWS"], "backend": [], "frontend": [], "data": []}
+    assert digest["strategic_goals"] == []
+    assert digest_to_text(digest) == "Industria: Banca\nStack: cloud: AWS\nDolores: Fraude"
+
+def test_fit_to_budget_trims_longest_list():
+    """Verifica que el resumen se recorte hasta caber en el presupuesto de tokens"""
+    digest = normalize_digest({"pain_points": [f"Dolor número {i} bastante descriptivo" for i in range(20)],
+                               "strategic_goals": ["Meta"]})
+
+    fitted = fit_to_budget(digest, token_budget=40)
+
+    assert estimate_tokens(digest_to_text(fitted)) <= 40
+    assert fitted["strategic_goals"] == ["Meta"]
+    assert len(digest["pain_points"]) == 20 # El original no se modifica
+
+def test_refresh_only_stale_clients():
+    """Verifica que solo se regeneren resúmenes de clientes cuyo texto crudo cambió"""
+    llm = MagicMock()
+    llm.generate.return_value = json.dumps({"industry": "Minería", "pain_points": ["Camiones"]})
+    db = MagicMock()
+    clients = [
+        {"id": 1, "name": "Nuevo", "tech_context_raw": "texto"},
+        {"id": 2, "name": "Vigente", "tech_context_raw": "igual", "context_digest": {"industry": "X"}, "context_digest_hash": digest_hash("igual")},
+        {"id": 3, "name": "Editado", "tech_context_raw": "cambió", "context_digest": {"industry": "X"}, "context_digest_hash": digest_hash("antes")},
+        {"id": 4, "name": "Vacío", "tech_context_raw": ""},
+    ]
+
+    events = ClientDigester(llm).refresh(clients, db)
+    logs = []
+    try:
+        while True:
+            logs.append(next(events))
+    except StopIteration as stop:
+        refreshed = stop.value
+
+    assert refreshed == 2
+    assert [c[0][0] for c in db.update_client_digest.call_args_list] == [1, 3]
+    assert all(is_fresh(c) for c in clients[:3])
+    assert clients[0]["context_digest"]["pain_points"] == ["Camiones"]
+
+def test_refresh_keeps_raw_on_error():
+    """Verifica que un error del LLM deje al cliente con su texto crudo"""
+    llm = MagicMock()
+    llm.generate.return_value = "no es json"
+    clients = [{"id": 1, "name": "A", "tech_context_raw": "texto"}]
+
+    events = list(ClientDigester(llm).refresh(clients, MagicMock()))
+
+    assert "context_digest" not in clients[0]
+    assert any("texto crudo" in e["message"] for e in events)
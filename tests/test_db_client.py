@@ -78,3 +78,130 @@ def test_add_rss_source(mock_supabase):
     # Verificar que insert fue llamado con los datos correctos
     args, _ = db.client.table.return_value.insert.call_args
     assert args[0]["url"] == "http://x.com"
+
+def test_save_trends_chunked_with_retry(mock_supabase):
+    """Verifica el upsert por lotes: tamaño de lote, reintento y resumen por lote"""
+    db = DatabaseClient()
+    db.client = mock_supabase
+
+    existing = MagicMock()
+    existing.data = [{"url": "http://t/0"}]
+    mock_supabase.table.return_value.select.return_value.in_.return_value.execute.return_value = existing
+    # Lote 0: falla una vez y luego pasa. Lote 1: pasa. Lote 2: falla siempre.
+    mock_supabase.table.return_value.upsert.return_value.execute.side_effect = [
+        Exception("timeout"), MagicMock(), MagicMock(), Exception("413"), Exception("413")
+    ]
+
+    trends = ({"title": f"T{i}", "url": f"http://t/{i}"} for i in range(5))
+    with patch('db_client.time.sleep') as mock_sleep:
+        summaries = db.save_trends(trends, chunk_size=2, max_retries=1, count_existing=True)
+
+    assert [len(c.args[0]) for c in mock_supabase.table.return_value.upsert.call_args_list] == [2, 2, 2, 1, 1]
+    assert summaries[0] == {"chunk": 0, "rows": 2, "inserted": 1, "updated": 1, "failed": 0, "attempts": 2, "error": None}
+    assert summaries[1]["failed"] == 0
+    assert summaries[2]["failed"] == 1 and summaries[2]["error"] == "413"
+    assert (summaries[2]["inserted"], summaries[2]["updated"]) == (0, 0) # Contado, pero no se escribió nada
+    assert mock_sleep.call_count == 2
+    # El conteo corre una vez por lote, fuera de los reintentos
+    assert mock_supabase.table.return_value.select.return_value.in_.call_count == 3
+
+def test_save_trends_count_never_blocks_the_write(mock_supabase):
+    """Verifica que sin conteo no haya consulta previa y que un conteo fallido no impida el upsert"""
+    db = DatabaseClient()
+    db.client = mock_supabase
+    trends = [{"title": f"T{i}", "url": f"http://t/{i}"} for i in range(3)]
+
+    summaries = db.save_trends(trends)
+    mock_supabase.table.return_value.select.assert_not_called()
+    assert summaries[0]["failed"] == 0 and summaries[0]["inserted"] is None
+
+    mock_supabase.table.return_value.select.return_value.in_.return_value.execute.side_effect = Exception("414 URI Too Long")
+    summaries = db.save_trends(trends, count_existing=True)
+    assert mock_supabase.table.return_value.upsert.call_count == 2
+    assert summaries[0]["failed"] == 0 and summaries[0]["updated"] is None
+
+    # Un lote fallido sin conteo también reporta None (desconocido), igual que uno guardado
+    mock_supabase.table.return_value.upsert.return_value.execute.side_effect = Exception("500")
+    with patch('db_client.time.sleep'):
+        summaries = db.save_trends(trends, max_retries=0)
+    assert summaries[0]["failed"] == 3 and summaries[0]["inserted"] is None and summaries[0]["updated"] is None
+
+def test_save_trends_dedupes_urls_in_chunk(mock_supabase):
+    """Verifica que un lote no envíe dos filas con la misma URL"""
+    db = DatabaseClient()
+    db.client = mock_supabase
+
+    db.save_trends([{"title": "v1", "url": "http://x"}, {"title": "v2", "url": "http://x"}])
+
+    rows = mock_supabase.table.return_value.upsert.call_args[0][0]
+    assert len(rows) == 1 and rows[0]["title"] == "v2"
+
+def test_fetch_opportunities_page_keyset_query(mock_supabase):
+    """Verifica el filtro en la base, la proyección liviana y el cursor (created_at, id) del feed"""
+    db = DatabaseClient()
+    db.client = mock_supabase
+    query = MagicMock()
+    for method in ("select", "eq", "gte", "or_", "order", "limit"):
+        getattr(query, method).return_value = query
+    mock_supabase.table.return_value = query
+    query.execute.return_value.data = [{"id": i, "created_at": f"2026-01-0{i}"} for i in (3, 2, 1)]
+
+    rows, cursor = db.fetch_opportunities_page(client_name="A", min_score=70, cursor=("2026-01-04", 9), limit=2)
+
+    columns = query.select.call_args[0][0]
+    assert "generated_pitch" not in columns and "reasoning" not in columns
+    query.eq.assert_called_once_with("client_name", "A")
+    query.gte.assert_called_once_with("match_score", 70)
+    query.or_.assert_called_once_with('created_at.lt."2026-01-04",and(created_at.eq."2026-01-04",id.lt.9)')
+    query.limit.assert_called_once_with(3) # Una fila de más para saber si hay página siguiente
+    assert [r["id"] for r in rows] == [3, 2] and cursor == ("2026-01-02", 2)
+
+def test_in_memory_keyset_pages():
+    """Verifica que el sustituto en memoria pagine igual: sin repetir ni saltar filas, con empates de fecha"""
+    from memory_db import InMemoryDatabase
+
+    db = InMemoryDatabase()
+    for i in range(5):
+        db.save_opportunity({"client_name": "A" if i % 2 else "B", "trend_title": f"T{i}", "match_score": 50 + 10 * i,
+                             "generated_pitch": "largo", "created_at": "2026-01-01" if i < 3 else f"2026-01-0{i}"})
+    seen, cursor = [], None
+    while True:
+        rows, cursor = db.fetch_opportunities_page(cursor=cursor, limit=2)
+        seen += [r["trend_title"] for r in rows]
+        assert all("generated_pitch" not in r for r in rows)
+        if cursor is None:
+            break
+    assert seen == ["T4", "T3", "T2", "T1", "T0"]
+
+    rows, _ = db.fetch_opportunities_page(client_name="A", min_score=70)
+    assert [r["trend_title"] for r in rows] == ["T3"]
+    assert db.fetch_opportunity_detail(rows[0]["id"])["generated_pitch"] == "largo"
+
+def test_fetch_active_trends_single_round_trip(mock_supabase):
+    """Verifica que las tendencias activas salgan de la vista active_trends en una sola consulta"""
+    db = DatabaseClient()
+    db.client = mock_supabase
+    query = mock_supabase.table.return_value.select.return_value.order.return_value.limit.return_value
+    query.execute.return_value.data = [{"title": "T"}]
+
+    assert db.fetch_trends(limit=7) == [{"title": "T"}]
+    mock_supabase.table.assert_called_once_with("active_trends")
+    mock_supabase.table.return_value.select.return_value.order.assert_called_once_with("published_at", desc=True)
+    mock_supabase.table.return_value.select.return_value.order.return_value.limit.assert_called_once_with(7)
+
+def test_in_memory_active_trends_join_by_source_key():
+    """Verifica que el filtro de fuentes activas use la clave de la fuente y no su nombre"""
+    from memory_db import InMemoryDatabase
+
+    sources = [{"id": 1, "name": "Activa", "url": "http://a"}, {"id": 2, "name": "Pausada", "url": "http://p", "is_active": False}]
+    trends = [{"title": "A", "url": "http://t/a", "source": "Activa"}, {"title": "P", "url": "http://t/p", "source": "Pausada"}]
+    db = InMemoryDatabase(sources=sources, trends=trends)
+    assert [t["title"] for t in db.fetch_trends()] == ["A"]
+
+    db.rss_sources[0]["name"] = "Activa (renombrada)"
+    assert [t["title"] for t in db.fetch_trends()] == ["A"]
+    assert len(db.fetch_trends(active_only=False)) == 2
+
+    # Sin source_id (migrada o de una fuente borrada): sigue visible
+    db.trends.append({"title": "M", "url": "http://t/m", "source": "Migrada", "source_id": None})
+    assert sorted(t["title"] for t in db.fetch_trends()) == ["A", "M"]
@@ -0,0 +1,33 @@
+import sys
+import os
+
+# Asegurar que pytest encuentra 'src'
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from dedup import NearDuplicateIndex, trend_fingerprint, add_alternate_source, normalize_text
+
+def test_normalize_text():
+    """Verifica que se eliminen HTML, acentos y puntuación"""
+    assert normalize_text("<p>Migración a la Nube!</p>") == "migracion a la nube"
+
+def test_fingerprint_near_duplicates():
+    """Verifica que variaciones menores generen huellas cercanas y noticias distintas no"""
+    index = NearDuplicateIndex(max_distance=6)
+    canonical = {"title": "OpenAI launches GPT-5", "url": "http://a.com/gpt5"}
+    index.add(trend_fingerprint("OpenAI launches GPT-5 with improved reasoning",
+                                "OpenAI today announced GPT-5, its newest model with improved reasoning and lower cost for enterprises."), canonical)
+
+    copy = trend_fingerprint("OpenAI launches GPT-5, with improved reasoning",
+                             "OpenAI today announced GPT-5, its newest model with improved reasoning and lower costs for enterprises.")
+    other = trend_fingerprint("Nvidia reports record quarter", "Nvidia revenue grew 80 percent on data center demand.")
+
+    assert index.find(copy) is canonical
+    assert index.find(other) is None
+
+def test_add_alternate_source():
+    """Verifica que las fuentes alternativas no se repitan ni incluyan la URL canónica"""
+    canonical = {"url": "http://a.com/x"}
+    assert add_alternate_source(canonical, "B", "http://b.com/x")
+    assert not add_alternate_source(canonical, "B", "http://b.com/x")
+    assert not add_alternate_source(canonical, "A", "http://a.com/x")
+    assert canonical["alternate_sources"] == [{"source": "B", "url": "http://b.com/x"}]
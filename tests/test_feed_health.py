@@ -0,0 +1,39 @@
+import sys
+import os
+from datetime import datetime, timedelta, timezone
+
+# Asegurar que pytest encuentra 'src'
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from feed_health import percentile, record_success, record_failure, circuit_open_until, parse_timestamp
+
+NOW = datetime(2026, 1, 1, 12, 0, tzinfo=timezone.utc)
+
+def test_percentile():
+    """Verifica percentiles por rango más cercano"""
+    samples = list(range(1, 101))
+    assert percentile(samples, 50) == 50
+    assert percentile(samples, 95) == 95
+    assert percentile([], 50) is None
+
+def test_record_success_resets_circuit():
+    """Verifica que un éxito cierre el circuito y actualice la ventana de latencias"""
+    source = {"consecutive_failures": 4, "latency_samples": [100, 300]}
+    fields = record_success(source, 200, 1024, now=NOW)
+    assert fields["consecutive_failures"] == 0
+    assert fields["circuit_open_until"] is None
+    assert fields["latency_samples"] == [100, 300, 200]
+    assert fields["latency_p50_ms"] == 200
+
+def test_record_failure_exponential_backoff():
+    """Verifica que el backoff se duplique con cada fallo sobre el umbral"""
+    first = record_failure({"consecutive_failures": 1}, "boom", now=NOW)
+    assert first["circuit_open_until"] is None
+
+    third = record_failure({"consecutive_failures": 2}, "boom", now=NOW)
+    fourth = record_failure({"consecutive_failures": 3}, "boom", now=NOW)
+    assert parse_timestamp(third["circuit_open_until"]) == NOW + timedelta(minutes=15)
+    assert parse_timestamp(fourth["circuit_open_until"]) == NOW + timedelta(minutes=30)
+
+    assert circuit_open_until(fourth, now=NOW) is not None
+    assert circuit_open_until(fourth, now=NOW + timedelta(hours=1)) is None
@@ -6,6 +6,7 @@ import os
 # Asegurar que pytest encuentra 'src'
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
 
+import feedparser
 from ingestor import InnovationIngestor
 
 # XML de ejemplo para simular un feed RSS
@@ -80,4 +81,332 @@ def test_save_trends_calls_db(mock_db):
     
     ingestor.save_trends(dummy_trends)
     
-    mock_db.save_trends.assert_called_once_with(dummy_trends)
+    mock_db.save_trends.assert_called_once_with(dummy_trends, count_existing=True)
+
+def test_fetch_trends_concurrent_completion_order(mock_db):
+    """Verifica que las fuentes se descarguen en paralelo y se reporten en orden de llegada"""
+    import threading
+
+    mock_db.fetch_rss_sources.return_value = [
+        {"url": "http://slow.com/feed", "name": "SlowFeed", "is_active": True},
+        {"url": "http://fast.com/feed", "name": "FastFeed", "is_active": True},
+    ]
+
+    ingestor = InnovationIngestor(max_workers=4, per_host_limit=1)
+    release_slow = threading.Event()
+
+    def fake_get(url, timeout=None, **kwargs):
+        if "slow" in url:
+            release_slow.wait(2)
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.content = MOCK_RSS_MULTI if "slow" in url else MOCK_RSS_CONTENT
+        return mock_response
+
+    with patch('requests.Session.get', side_effect=fake_get):
+        events = ingestor.fetch_trends()
+        logs = []
+        for event in events:
+            if event["type"] == "log":
+                logs.append(event["message"])
+                if "FastFeed: 1" in event["message"]:
+                    release_slow.set()
+            elif event["type"] == "result":
+                trends = event["data"]
+
+    fast_idx = next(i for i, m in enumerate(logs) if "FastFeed: 1" in m)
+    slow_idx = next(i for i, m in enumerate(logs) if "SlowFeed: 4" in m)
+    assert fast_idx < slow_idx
+    assert len(trends) == 5
+
+def test_fetch_trends_conditional_get(mock_db):
+    """Verifica el GET condicional: 304 y hash idéntico omiten el parseo; los cambios se persisten al guardar"""
+    import hashlib
+
+    same_body = MOCK_RSS_CONTENT.encode()
+    mock_db.fetch_rss_sources.return_value = [
+        {"id": 1, "url": "http://a.com/feed", "name": "NotModified", "is_active": True, "etag": '"v1"'},
+        {"id": 2, "url": "http://b.com/feed", "name": "SameBody", "is_active": True,
+         "content_hash": hashlib.sha256(same_body).hexdigest()},
+        {"id": 3, "url": "http://c.com/feed", "name": "Changed", "is_active": True},
+    ]
+
+    ingestor = InnovationIngestor()
+    sent_headers = {}
+
+    def fake_get(url, timeout=None, headers=None, **kwargs):
+        sent_headers[url] = headers or {}
+        mock_response = MagicMock()
+        mock_response.status_code = 304 if "a.com" in url else 200
+        mock_response.content = same_body
+        mock_response.headers = {"ETag": '"v2"'}
+        return mock_response
+
+    with patch('requests.Session.get', side_effect=fake_get), patch('ingestor.feedparser.parse', wraps=feedparser.parse) as mock_parse:
+        events = list(ingestor.fetch_trends())
+
+    trends = events[-1]["data"]
+    assert sent_headers["http://a.com/feed"]["If-None-Match"] == '"v1"'
+    assert mock_parse.call_count == 1 # Solo la fuente modificada se parsea
+    assert [t["source"] for t in trends] == ["Changed"]
+    assert any("sin cambios (304: 1, hash: 1)" in e.get("message", "") for e in events)
+
+    mock_db.update_source_state.reset_mock() # Ignorar la salud de fuentes persistida al final de la ingesta
+    ingestor.save_trends(trends)
+    mock_db.update_source_state.assert_called_once()
+    args, _ = mock_db.update_source_state.call_args
+    assert args[0] == 3
+    assert args[1]["etag"] == '"v2"'
+
+MOCK_RSS_MULTI = """
+<rss version="2.0">
+<channel>
+    <title>Tech News</title>
+    <item><title>Newest</title><link>http://technews.com/3</link><pubDate>Sat, 20 Dec 2025 10:00:00 GMT</pubDate></item>
+    <item><title>Middle</title><link>http://technews.com/2</link><pubDate>Fri, 19 Dec 2025 10:00:00 GMT</pubDate></item>
+    <item><title>Seen</title><link>http://technews.com/1</link><pubDate>Thu, 18 Dec 2025 23:00:00 GMT</pubDate></item>
+    <item><title>Old</title><link>http://technews.com/0</link><pubDate>Wed, 17 Dec 2025 10:00:00 GMT</pubDate></item>
+</channel>
+</rss>
+"""
+
+def test_fetch_trends_watermark(mock_db):
+    """Verifica que solo se procesen entradas más nuevas que la marca de agua, con máximo por fuente"""
+    mock_db.fetch_rss_sources.return_value = [
+        {"id": 7, "url": "http://mock-feed.com", "name": "MockFeed", "is_active": True,
+         "last_entry_id": "http://technews.com/1", "last_entry_published": "2025-12-18T23:00:00+00:00"}
+    ]
+
+    ingestor = InnovationIngestor(max_entries_per_source=1)
+
+    with patch('requests.Session.get') as mock_get:
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.content = MOCK_RSS_MULTI
+        mock_response.headers = {}
+        mock_get.return_value = mock_response
+
+        events = list(ingestor.fetch_trends())
+
+    # Con tope por fuente se procesan las más antiguas; la marca avanza solo hasta la procesada
+    trends = events[-1]["data"]
+    assert [t["title"] for t in trends] == ["Middle"]
+    assert any("1 artículos nuevos exceden" in e.get("message", "") for e in events)
+
+    state = ingestor._pending_source_state[7]
+    assert state["last_entry_id"] == "http://technews.com/2"
+    assert state["last_entry_published"].startswith("2025-12-19T10:00:00")
+
+def test_fetch_trends_capped_feed_is_fetched_again(mock_db):
+    """Verifica que las entradas que exceden el tope se ingieran en la corrida siguiente (sin 304 ni hash igual)"""
+    source = {"id": 7, "url": "http://mock-feed.com", "name": "MockFeed", "is_active": True,
+              "last_entry_id": "http://technews.com/1", "last_entry_published": "2025-12-18T23:00:00+00:00"}
+    mock_db.fetch_rss_sources.return_value = [source]
+    ingestor = InnovationIngestor(max_entries_per_source=1)
+
+    def conditional_get(url, headers=None, **kwargs):
+        response = MagicMock()
+        response.headers = {"ETag": "v1"}
+        response.content = MOCK_RSS_MULTI
+        response.status_code = 304 if (headers or {}).get("If-None-Match") == "v1" else 200
+        return response
+
+    titles = []
+    with patch('requests.Session.get', side_effect=conditional_get):
+        for _ in range(2):
+            events = list(ingestor.fetch_trends())
+            titles += [t["title"] for t in events[-1]["data"]]
+            source.update(ingestor._pending_source_state[7])
+            ingestor.commit_source_state()
+
+    assert titles == ["Middle", "Newest"]
+    assert source["etag"] == "v1" and source["last_entry_id"] == "http://technews.com/3"
+
+def test_evaluate_news_batch_with_llm_fallback():
+    """Verifica el modo batch: una llamada por lote, fallback individual y pass-through ante error"""
+    with patch.dict(os.environ, {"GEMINI_API_KEY": "fake_key"}), patch('ingestor.genai'):
+        ingestor = InnovationIngestor()
+
+    articles = [("A", "sum A"), ("B", "sum B"), ("C", "sum C")]
+
+    batch_response = MagicMock()
+    batch_response.text = '[{"index": 0, "is_relevant": true, "new_summary": "tech A"}, {"index": 1, "is_relevant": false, "new_summary": ""}, {"index": 2, "oops": 1}]'
+    single_response = MagicMock()
+    single_response.text = '{"is_relevant": true, "new_summary": "tech C"}'
+    ingestor.model.generate_content.side_effect = [batch_response, single_response]
+
+    results = ingestor.evaluate_news_batch_with_llm(articles, "Codelco")
+
+    assert results == [(True, "tech A"), (False, ""), (True, "tech C")]
+    assert ingestor.model.generate_content.call_count == 2 # 1 batch + 1 fallback
+
+    ingestor.model.generate_content.side_effect = Exception("Quota")
+    results = ingestor.evaluate_news_batch_with_llm(articles, "Codelco")
+    assert results == [(True, "sum A"), (True, "sum B"), (True, "sum C")]
+
+def test_fetch_trends_groups_near_duplicates(mock_db):
+    """Verifica que la misma noticia en dos medios quede como una tendencia con fuente alternativa"""
+    copy_a = MOCK_RSS_CONTENT
+    copy_b = MOCK_RSS_CONTENT.replace("http://technews.com/ai", "http://othernews.com/robots").replace("The robots are here.", "<p>The robots are here</p>")
+    mock_db.fetch_rss_sources.return_value = [
+        {"url": "http://a.com/feed", "name": "FeedA", "is_active": True},
+        {"url": "http://b.com/feed", "name": "FeedB", "is_active": True},
+    ]
+    mock_db.fetch_trend_fingerprints.return_value = []
+
+    ingestor = InnovationIngestor(max_workers=1)
+
+    def fake_get(url, timeout=None, **kwargs):
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.content = copy_a if "a.com" in url else copy_b
+        return mock_response
+
+    with patch('requests.Session.get', side_effect=fake_get):
+        events = list(ingestor.fetch_trends())
+
+    trends = events[-1]["data"]
+    assert len(trends) == 1
+    assert trends[0]["url"] == "http://technews.com/ai"
+    assert trends[0]["alternate_sources"] == [{"source": "FeedB", "url": "http://othernews.com/robots"}]
+
+def test_fetch_trends_groups_duplicates_within_batch_before_llm(mock_db):
+    """Verifica que dos copias de la misma noticia en un lote lleguen una sola vez a la IA"""
+    feed = """<?xml version="1.0"?><rss version="2.0"><channel><title>Mock</title>
+    <item><title>Codelco deploys AI for mining operations</title><link>http://news.com/1</link><description>Codelco deploys an AI platform across its mining operations in Chile.</description></item>
+    <item><title>Codelco deploys AI for mining operations</title><link>http://news.com/1-amp</link><description>Codelco deploys an AI platform across its mining operations in Chile</description></item>
+    </channel></rss>"""
+    mock_db.fetch_rss_sources.return_value = [{"url": "http://c.com/feed", "name": "FeedC", "is_active": True,
+                                               "client_id": 3, "clients": {"name": "Codelco"}}]
+    mock_db.fetch_trend_fingerprints.return_value = []
+
+    with patch.dict(os.environ, {"GEMINI_API_KEY": "fake_key"}), patch('ingestor.genai'):
+        ingestor = InnovationIngestor(use_llm_cache=False)
+    ingestor.model.generate_content.return_value = MagicMock(text='{"is_relevant": true, "new_summary": "IA en minería"}')
+
+    with patch('requests.Session.get') as mock_get:
+        mock_get.return_value = MagicMock(status_code=200, content=feed, headers={})
+        events = list(ingestor.fetch_trends())
+
+    assert ingestor.model.generate_content.call_count == 1 # Un solo artículo evaluado
+    trends = events[-1]["data"]
+    assert len(trends) == 1 and trends[0]["alternate_sources"] == [{"source": "FeedC", "url": "http://news.com/1-amp"}]
+
+def test_fetch_trends_groups_duplicates_across_runs(mock_db):
+    """Verifica que una copia de una tendencia ya guardada actualice la canónica en vez de insertarse"""
+    from dedup import trend_fingerprint
+
+    mock_db.fetch_rss_sources.return_value = [{"url": "http://b.com/feed", "name": "FeedB", "is_active": True}]
+    mock_db.fetch_trend_fingerprints.return_value = [{
+        "title": "AI takes over", "source": "FeedA", "url": "http://first.com/ai",
+        "summary": "The robots are here.", "published_at": "2025-12-18T23:00:00+00:00",
+        "fingerprint": trend_fingerprint("AI takes over", "The robots are here."), "alternate_sources": []
+    }]
+
+    ingestor = InnovationIngestor()
+
+    with patch('requests.Session.get') as mock_get:
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.content = MOCK_RSS_CONTENT
+        mock_get.return_value = mock_response
+        events = list(ingestor.fetch_trends())
+
+    trends = events[-1]["data"]
+    assert len(trends) == 1
+    assert trends[0]["url"] == "http://first.com/ai"
+    assert trends[0]["alternate_sources"] == [{"source": "FeedB", "url": "http://technews.com/ai"}]
+
+def test_fetch_trends_circuit_breaker(mock_db):
+    """Verifica que una fuente con circuito abierto se omita y que los fallos abran el circuito"""
+    mock_db.fetch_rss_sources.return_value = [
+        {"id": 1, "url": "http://dead.com/feed", "name": "Dead", "is_active": True,
+         "consecutive_failures": 5, "circuit_open_until": "2999-01-01T00:00:00+00:00"},
+        {"id": 2, "url": "http://flaky.com/feed", "name": "Flaky", "is_active": True, "consecutive_failures": 2},
+    ]
+
+    ingestor = InnovationIngestor()
+
+    with patch('requests.Session.get') as mock_get:
+        mock_get.side_effect = Exception("Timeout")
+        events = list(ingestor.fetch_trends())
+
+    assert mock_get.call_count == 1 # Solo Flaky se consulta
+    assert any("Dead: suspendida" in e.get("message", "") for e in events)
+
+    mock_db.update_source_state.assert_called_once()
+    source_id, fields = mock_db.update_source_state.call_args[0]
+    assert source_id == 2
+    assert fields["consecutive_failures"] == 3
+    assert fields["circuit_open_until"] is not None
+
+def test_fetch_trends_cancelled_keeps_source_health(mock_db):
+    """Verifica que la salud de las fuentes ya consultadas se guarde aunque la ingesta se cancele a mitad"""
+    mock_db.fetch_rss_sources.return_value = [{"id": 2, "url": "http://flaky.com/feed", "name": "Flaky", "is_active": True}]
+
+    ingestor = InnovationIngestor()
+
+    with patch('requests.Session.get') as mock_get:
+        mock_get.side_effect = Exception("Timeout")
+        events = ingestor.fetch_trends()
+        for event in events:
+            if "Error leyendo Flaky" in event.get("message", ""):
+                break
+        events.close() # Cancelación desde el dashboard o el worker
+
+    source_id, fields = mock_db.update_source_state.call_args[0]
+    assert source_id == 2 and fields["consecutive_failures"] == 1
+
+def test_select_new_entries_any_feed_order_without_losing_entries():
+    """Verifica la marca de agua con feeds del más antiguo al más nuevo y que el tope por fuente no pierda entradas"""
+    from ingestor import select_new_entries
+
+    def entry(i):
+        return {"link": f"http://t/{i}", "published_parsed": (2025, 12, 10 + i, 10, 0, 0)}
+
+    oldest_first = [entry(i) for i in range(4)]
+    new, watermark, dropped = select_new_entries(oldest_first, "http://t/0", "2025-12-10T10:00:00+00:00")
+    assert [e["link"] for e in new] == ["http://t/3", "http://t/2", "http://t/1"] and dropped == 0
+    assert watermark["last_entry_id"] == "http://t/3"
+
+    # Más nuevas que el tope: dos corridas las procesan todas
+    seen, mark = [], {"last_entry_id": "http://t/0", "last_entry_published": "2025-12-10T10:00:00+00:00"}
+    for expected_dropped in (1, 0):
+        new, watermark, dropped = select_new_entries(oldest_first[::-1], mark["last_entry_id"], mark["last_entry_published"], max_entries=2)
+        assert dropped == expected_dropped
+        seen += [e["link"] for e in new]
+        mark = watermark or mark
+    assert sorted(seen) == ["http://t/1", "http://t/2", "http://t/3"]
+
+    # Sin fechas: el id de la marca separa lo nuevo de lo visto
+    undated = [{"link": f"http://u/{i}"} for i in (3, 2, 1)]
+    new, watermark, _ = select_new_entries(undated, "http://u/2")
+    assert [e["link"] for e in new] == ["http://u/3"] and watermark["last_entry_id"] == "http://u/3"
+
+def test_normalize_feed_returns_compact_items():
+    """Verifica la normalización de un feed a diccionarios compactos"""
+    from ingestor import normalize_feed
+
+    parsed = normalize_feed(MOCK_RSS_MULTI, "MockFeed", last_entry_id="http://technews.com/1", max_entries=5)
+
+    assert parsed["entry_count"] == 4
+    assert [i["title"] for i in parsed["items"]] == ["Newest", "Middle"]
+    assert parsed["watermark"]["last_entry_id"] == "http://technews.com/3"
+    assert set(parsed["items"][0]) == {"id", "title", "source", "published", "url", "summary", "tags", "fingerprint", "alternate_sources"}
+
+def test_fetch_trends_with_process_pool(mock_db):
+    """Verifica que el parseo en pool de procesos produzca el mismo resultado"""
+    mock_db.fetch_rss_sources.return_value = [{"url": "http://mock-feed.com", "name": "MockFeed", "is_active": True}]
+    mock_db.fetch_trend_fingerprints.return_value = []
+
+    ingestor = InnovationIngestor(parse_workers=2)
+
+    with patch('requests.Session.get') as mock_get:
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.content = MOCK_RSS_MULTI.encode()
+        mock_get.return_value = mock_response
+        events = list(ingestor.fetch_trends())
+
+    trends = events[-1]["data"]
+    assert [t["title"] for t in trends] == ["Newest", "Middle", "Seen", "Old"]
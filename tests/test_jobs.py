@@ -0,0 +1,147 @@
+import pytest
+from unittest.mock import patch
+import sys
+import os
+
+# Asegurar que pytest encuentra 'src'
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+import jobs
+import scheduler
+from jobs import JobQueue, execute_job, worker_loop
+from memory_db import InMemoryDatabase
+from scheduler import consume_events
+
+@pytest.fixture
+def db():
+    return InMemoryDatabase()
+
+@pytest.fixture(autouse=True)
+def lock_path(tmp_path):
+    path = str(tmp_path / "run.lock")
+    with patch.object(jobs, "LOCK_PATH", path):
+        yield path
+
+def test_enqueue_dedupes_identical_pending_jobs(db):
+    """Verifica que el mismo trabajo pendiente no se encole dos veces"""
+    queue = JobQueue(db)
+    first = queue.enqueue("matching", {"client": "A", "trend_limit": 5})
+    second = queue.enqueue("matching", {"trend_limit": 5, "client": "A"})
+    other = queue.enqueue("matching", {"client": "B", "trend_limit": 5})
+
+    assert not first["deduplicated"] and second["deduplicated"]
+    assert second["id"] == first["id"] and other["id"] != first["id"]
+    with pytest.raises(ValueError):
+        queue.enqueue("desconocido")
+
+    # Terminado el primero, el mismo trabajo se puede volver a encolar
+    db.update_job(first["id"], {"status": "completed"})
+    assert not queue.enqueue("matching", {"client": "A", "trend_limit": 5})["deduplicated"]
+
+def test_claim_respects_concurrency_cap(db):
+    """Verifica el tope de trabajos simultáneos y la cancelación de uno en cola"""
+    queue = JobQueue(db)
+    ids = [queue.enqueue("ingest", {"n": i})["id"] for i in range(3)]
+
+    assert db.claim_job("w1", max_running=2)["id"] == ids[0]
+    assert db.claim_job("w2", max_running=2)["id"] == ids[1]
+    assert db.claim_job("w3", max_running=2) is None
+
+    queue.cancel(ids[2])
+    assert queue.get(ids[2])["status"] == "cancelled"
+    db.update_job(ids[0], {"status": "completed"})
+    assert db.claim_job("w3", max_running=2) is None # No quedan trabajos en cola
+
+def test_worker_runs_job_and_publishes_events(db):
+    """Verifica que el worker ejecute el trabajo, publique sus eventos y cierre el estado"""
+    def runner(params, log, on_event, cancelled):
+        events = iter([{"type": "run", "run_id": 9}, {"type": "log", "message": "hola"},
+                       {"type": "partial", "data": {"client": "A", "ledger": {"x": 1}}}, {"type": "result", "data": [1, 2]}])
+        consume_events(events, log=log, on_event=on_event, cancelled=cancelled)
+        return "completed"
+
+    queue = JobQueue(db)
+    job = queue.enqueue("matching", {"client": "A"})
+    with patch.dict(jobs.JOB_RUNNERS, {"matching": runner}):
+        assert worker_loop(name="w", once=True, db=db) == 1
+
+    finished = queue.get(job["id"])
+    assert (finished["status"], finished["run_id"]) == ("completed", 9)
+    assert finished["throttle"]["rpm"] > 0 # Cuota del limitador del worker, para el dashboard
+    events = queue.events(job["id"])
+    assert [e["type"] for e in events] == ["run", "log", "partial", "result"]
+    assert events[2]["data"] == {"client": "A"} # Sin la fila de ledger
+    assert events[3]["data"] == {"items": 2}
+    assert queue.events(job["id"], after_id=events[1]["id"])[0]["type"] == "partial"
+
+def test_cancel_running_job(db):
+    """Verifica que una cancelación pedida durante la ejecución detenga la corrida"""
+    queue = JobQueue(db)
+    job = queue.enqueue("ingest", {})
+    claimed = db.claim_job("w", max_running=1)
+
+    def runner(params, log, on_event, cancelled):
+        def events():
+            for i in range(1000):
+                if i == 3:
+                    queue.cancel(claimed["id"])
+                yield {"type": "log", "message": f"paso {i}"}
+                jobs.time.sleep(0.01)
+
+        def job(run_id):
+            consume_events(events(), log=log, on_event=on_event, cancelled=cancelled)
+            return 0, []
+        return scheduler._record_run("ingest", {}, job, on_event=on_event)
+
+    with patch.dict(jobs.JOB_RUNNERS, {"ingest": runner}), patch.object(jobs, "HEARTBEAT_S", 0.02), \
+            patch("scheduler.DatabaseClient", return_value=db):
+        assert execute_job(claimed, db) == "cancelled"
+
+    assert queue.get(job["id"])["status"] == "cancelled"
+    run = db.fetch_runs("ingest")[0]
+    assert run["status"] == "cancelled" and queue.get(job["id"])["run_id"] == run["id"]
+    assert len(queue.events(job["id"])) < 1000
+
+def test_job_waits_for_run_lock(db, lock_path):
+    """Verifica que un trabajo no corra mientras un ciclo del cron tiene el lock"""
+    queue = JobQueue(db)
+    job = queue.enqueue("ingest", {})
+    claimed = db.claim_job("w", max_running=1)
+    cron = scheduler.CycleLock(lock_path)
+    assert cron.acquire()
+    ran = []
+
+    def runner(params, log, on_event, cancelled):
+        ran.append(bool(scheduler.running_job_locks(lock_path)) and not cron.held())
+        return "completed"
+
+    with patch.dict(jobs.JOB_RUNNERS, {"ingest": runner}), patch.object(jobs, "HEARTBEAT_S", 0.02):
+        jobs.threading.Timer(0.1, cron.release).start()
+        assert execute_job(claimed, db) == "completed"
+
+    assert ran == [True] # Corrió con su lock tomado y sin el cron
+    assert not scheduler.running_job_locks(lock_path)
+    assert "esperando" in queue.events(job["id"])[0]["message"]
+
+    # Cancelado mientras espera: no llega a correr
+    second = queue.enqueue("ingest", {"n": 2})
+    claimed = db.claim_job("w", max_running=1)
+    assert cron.acquire()
+    with patch.dict(jobs.JOB_RUNNERS, {"ingest": runner}), patch.object(jobs, "HEARTBEAT_S", 0.02):
+        jobs.threading.Timer(0.05, queue.cancel, args=(second["id"],)).start()
+        assert execute_job(claimed, db) == "cancelled"
+    cron.release()
+    assert ran == [True]
+
+def test_jobs_run_concurrently_but_exclude_cron(lock_path):
+    """Verifica que los trabajos no se bloqueen entre sí y que el cron no arranque con trabajos en curso"""
+    first, second = scheduler.JobLock(lock_path, 1), scheduler.JobLock(lock_path, 2)
+    assert first.acquire() and second.acquire()
+
+    cron = scheduler.CycleLock(lock_path)
+    assert not cron.acquire() and not os.path.exists(lock_path)
+    first.release()
+    second.release()
+    assert cron.acquire()
+    assert not scheduler.JobLock(lock_path, 3).acquire()
+    cron.release()
@@ -0,0 +1,93 @@
+import pytest
+from unittest.mock import MagicMock
+import sys
+import os
+import time
+
+# Asegurar que pytest encuentra 'src'
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from llm_client import LLMClient, LLMCache, cache_key, is_json, partial_json_fields
+
+@pytest.fixture
+def cache():
+    return LLMCache(":memory:")
+
+@pytest.fixture
+def model():
+    model = MagicMock()
+    model.model_name = "models/gemini-test"
+    response = MagicMock()
+    response.text = '{"ok": true}'
+    model.generate_content.return_value = response
+    return model
+
+def test_generate_uses_cache(cache, model):
+    """Verifica que la segunda llamada idéntica se sirva desde el caché"""
+    llm = LLMClient(model, cache=cache)
+    assert llm.generate("prompt", generation_config={"a": 1}) == '{"ok": true}'
+    assert llm.generate("prompt", generation_config={"a": 1}) == '{"ok": true}'
+    assert model.generate_content.call_count == 1
+    assert llm.cache_stats() == {"hits": 1, "misses": 1}
+
+    # Otra configuración de generación es otra clave
+    llm.generate("prompt", generation_config={"a": 2})
+    assert model.generate_content.call_count == 2
+
+def test_generate_bypass(cache, model):
+    """Verifica el flag de bypass"""
+    llm = LLMClient(model, cache=cache)
+    llm.generate("prompt")
+    llm.generate("prompt", bypass_cache=True)
+    assert model.generate_content.call_count == 2
+    assert LLMClient(model, use_cache=False).cache_stats() == {"hits": 0, "misses": 0}
+
+def test_errors_are_never_cached(cache, model):
+    """Verifica que excepciones y respuestas inválidas no queden en caché"""
+    llm = LLMClient(model, cache=cache)
+    model.generate_content.side_effect = Exception("500 internal")
+    with pytest.raises(Exception):
+        llm.generate("prompt")
+
+    model.generate_content.side_effect = None
+    model.generate_content.return_value.text = "no es json"
+    llm.generate("prompt", cache_if=is_json)
+    assert cache.get(cache_key("models/gemini-test", "prompt")) is None
+
+def test_generate_stream_yields_chunks_and_caches(cache, model):
+    """Verifica que el streaming entregue los fragmentos, cachee el texto completo y sirva el acierto de una vez"""
+    chunks = [MagicMock(text='{"ok"'), MagicMock(text=': true}')]
+    stream = MagicMock()
+    stream.__iter__.return_value = iter(chunks)
+    model.generate_content.return_value = stream
+    llm = LLMClient(model, cache=cache)
+
+    assert list(llm.generate_stream("prompt", cache_if=is_json)) == ['{"ok"', ': true}']
+    model.generate_content.assert_called_once_with("prompt", stream=True)
+    assert list(llm.generate_stream("prompt", cache_if=is_json)) == ['{"ok": true}']
+    assert model.generate_content.call_count == 1
+
+def test_partial_json_fields():
+    """Verifica la extracción incremental de puntaje, razones completas y pitch parcial"""
+    text = '{"match_score": 82, "reasoning": ["Uno \\"A\\"", "Dos"], "generated_pitch": "Hola \\u00e9qu'
+    assert partial_json_fields(text[:16]) == {"match_score": None, "reasoning": [], "generated_pitch": "", "pitch_done": False}
+    fields = partial_json_fields(text)
+    assert fields["match_score"] == 82
+    assert fields["reasoning"] == ['Uno "A"', "Dos"]
+    assert fields["generated_pitch"] == "Hola \u00e9qu"
+    # Escape unicode a medias: se recorta hasta completarlo
+    assert partial_json_fields(text[:-4])["generated_pitch"] == "Hola "
+    assert partial_json_fields(text + 'ipo"}')["pitch_done"] is True
+
+def test_ttl_and_lru_eviction():
+    """Verifica la expiración por TTL y la expulsión de las entradas menos usadas"""
+    cache = LLMCache(":memory:", ttl=60, max_bytes=10)
+    cache.set("a", "12345")
+    cache.set("b", "12345")
+    cache.get("a") # 'a' pasa a ser la más reciente
+    cache.set("c", "12345")
+    assert cache.get("b") is None
+    assert cache.get("a") == "12345"
+
+    cache._conn.execute("update llm_cache set created_at = ?", (time.time() - 120,))
+    assert cache.get("a") is None
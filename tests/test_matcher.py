@@ -91,3 +91,346 @@ def test_run_matching_cycle(mock_db, mock_genai):
         assert len(opportunities) == 1
         assert opportunities[0]["client"] == "Client A"
         assert opportunities[0]["match_score"] == 95
+
+def test_run_matching_cycle_prefilter(mock_db, mock_genai, tmp_path):
+    """Verifica que el pre-filtro local limite los pares enviados al LLM"""
+    with patch.dict(os.environ, {"GEMINI_API_KEY": "fake_key"}):
+        matcher = OpportunityMatcher(vector_cache_path=str(tmp_path / "vectors.npz"), use_digest=False)
+
+        mock_db.fetch_clients.return_value = [{"id": 1, "name": "Minera", "tech_context_raw": "camiones autónomos mineros"}]
+        mock_db.fetch_trends.return_value = [
+            {"id": 1, "title": "Pagos móviles para banca", "summary": "billetera"},
+            {"id": 2, "title": "Camiones autónomos en minería", "summary": "faenas mineras"},
+            {"id": 3, "title": "Moda otoño", "summary": "tendencias retail"},
+        ]
+
+        mock_response = MagicMock()
+        mock_response.text = '{"match_score": 5, "reasoning": [], "generated_pitch": ""}'
+        matcher.model.generate_content.return_value = mock_response
+
+        events = list(matcher.run_matching_cycle(trend_limit=1, prefilter=True))
+
+        assert matcher.model.generate_content.call_count == 1
+        assert any("Camiones autónomos" in e.get("message", "") for e in events if e["type"] == "log")
+        mock_db.fetch_trends.assert_called_with(limit=100, active_only=True)
+
+def test_run_matching_cycle_concurrent_order(mock_db, mock_genai):
+    """Verifica que en modo concurrente se emitan parciales y el resultado final respete el orden de los pares"""
+    import threading
+    import time
+
+    with patch.dict(os.environ, {"GEMINI_API_KEY": "fake_key"}):
+        matcher = OpportunityMatcher(max_concurrency=4, use_llm_cache=False)
+
+        mock_db.fetch_clients.return_value = [{"name": "Client A"}, {"name": "Client B"}]
+        mock_db.fetch_trends.return_value = [{"title": f"Trend {i}", "url": f"http://t{i}.com"} for i in range(3)]
+
+        in_flight, peak = [0], [0]
+        lock = threading.Lock()
+
+        def slow_generate(prompt, generation_config=None):
+            with lock:
+                in_flight[0] += 1
+                peak[0] = max(peak[0], in_flight[0])
+            # Los primeros pares tardan más: terminan en orden inverso
+            delay = 0.05 if "Trend 0" in prompt else 0.01
+            time.sleep(delay)
+            with lock:
+                in_flight[0] -= 1
+            response = MagicMock()
+            response.text = '{"match_score": 80, "reasoning": [], "generated_pitch": "x"}'
+            return response
+
+        matcher.model.generate_content.side_effect = slow_generate
+
+        events = list(matcher.run_matching_cycle(trend_limit=3))
+
+        partials = [e["data"] for e in events if e["type"] == "partial"]
+        result = [e for e in events if e["type"] == "result"][0]["data"]
+
+        assert len(partials) == 6
+        assert peak[0] > 1
+        assert [(r["client"], r["trend"]) for r in result] == [
+            (c, f"Trend {i}") for c in ("Client A", "Client B") for i in range(3)
+        ]
+
+def test_group_clients_by_budget():
+    """Verifica que los grupos respeten el presupuesto de tokens y conserven el orden"""
+    from matcher import group_clients_by_budget, GROUP_OUTPUT_TOKENS
+
+    clients = [{"name": f"C{i}", "tech_context_raw": "x" * 400} for i in range(5)] # ~100 tokens c/u
+    per_client = 100 + GROUP_OUTPUT_TOKENS
+
+    groups = group_clients_by_budget(clients, token_budget=2 * per_client + 50, base_tokens=50)
+
+    assert [[c["name"] for c in g] for g in groups] == [["C0", "C1"], ["C2", "C3"], ["C4"]]
+    # Un cliente que no cabe solo igual forma su propio grupo
+    assert len(group_clients_by_budget(clients[:1], token_budget=10)) == 1
+
+def test_run_matching_cycle_batch_clients_with_fallback(mock_db, mock_genai):
+    """Verifica el modo por lote: un prompt por tendencia y fallback por par ante entradas inválidas"""
+    with patch.dict(os.environ, {"GEMINI_API_KEY": "fake_key"}):
+        matcher = OpportunityMatcher(batch_clients=True, use_llm_cache=False)
+
+        mock_db.fetch_clients.return_value = [{"name": "Client A"}, {"name": "Client B"}, {"name": "Client C"}]
+        mock_db.fetch_trends.return_value = [{"title": "Trend 1", "url": "http://t1.com"}]
+
+        batch_response = MagicMock()
+        batch_response.text = json.dumps([
+            {"client": "Client B", "match_score": 70, "reasoning": ["ok"], "generated_pitch": "B"},
+            {"client": "Client A", "match_score": 90, "reasoning": ["ok"], "generated_pitch": "A"},
+            {"client": "Client C", "match_score": "alto"}, # Malformada -> fallback
+        ])
+        single_response = MagicMock()
+        single_response.text = '{"match_score": 40, "reasoning": [], "generated_pitch": "C"}'
+        matcher.model.generate_content.side_effect = [batch_response, single_response]
+
+        events = list(matcher.run_matching_cycle(trend_limit=1))
+        result = [e for e in events if e["type"] == "result"][0]["data"]
+
+        assert matcher.model.generate_content.call_count == 2
+        assert [(r["client"], r["match_score"]) for r in result] == [("Client A", 90), ("Client B", 70), ("Client C", 40)]
+        assert any("reevaluadas" in e.get("message", "") for e in events if e["type"] == "log")
+
+def test_run_matching_cycle_incremental_ledger(mock_db, mock_genai):
+    """Verifica que el ledger omita pares sin cambios y reevalúe los que cambiaron"""
+    from matcher import client_key, trend_key, client_hash, trend_hash, PROMPT_VERSION
+
+    with patch.dict(os.environ, {"GEMINI_API_KEY": "fake_key"}):
+        matcher = OpportunityMatcher(use_llm_cache=False, use_digest=False)
+
+        client = {"id": 1, "name": "Client A", "tech_context_raw": "SAP"}
+        unchanged = {"title": "Trend 1", "url": "http://t1.com", "summary": "igual"}
+        edited = {"title": "Trend 2", "url": "http://t2.com", "summary": "nuevo resumen"}
+        mock_db.fetch_clients.return_value = [client]
+        mock_db.fetch_trends.return_value = [unchanged, edited]
+
+        def ledger_row(trend, summary_hash):
+            return {"client_key": client_key(client), "trend_key": trend_key(trend), "client_hash": client_hash(client),
+                    "trend_hash": summary_hash, "model": matcher.llm.model_name, "prompt_version": PROMPT_VERSION, "match_score": 5}
+        mock_db.fetch_match_ledger.return_value = [ledger_row(unchanged, trend_hash(unchanged)), ledger_row(edited, "hash-viejo")]
+
+        mock_response = MagicMock()
+        mock_response.text = '{"match_score": 5, "reasoning": [], "generated_pitch": ""}'
+        matcher.model.generate_content.return_value = mock_response
+
+        events = list(matcher.run_matching_cycle(trend_limit=2))
+
+        assert matcher.model.generate_content.call_count == 1
+        assert any("1 pares sin cambios" in e.get("message", "") for e in events if e["type"] == "log")
+        rows = mock_db.upsert_match_ledger.call_args[0][0]
+        assert [(r["trend_key"], r["trend_hash"]) for r in rows] == [("http://t2.com", trend_hash(edited))]
+
+def test_run_matching_cycle_uses_client_digest(mock_db, mock_genai):
+    """Verifica que el resumen se genere una vez, se guarde y reemplace al texto crudo en el prompt"""
+    from client_digest import digest_hash
+
+    with patch.dict(os.environ, {"GEMINI_API_KEY": "fake_key"}):
+        matcher = OpportunityMatcher(use_llm_cache=False)
+
+        raw = "Menú Inicio Contacto. " * 200 + "Usamos SAP y Azure."
+        fresh = {"id": 2, "name": "Client B", "tech_context_raw": "Oracle",
+                 "context_digest": {"industry": "", "tech_stack": {"data": ["Oracle"]}, "pain_points": [], "strategic_goals": []},
+                 "context_digest_hash": digest_hash("Oracle")}
+        mock_db.fetch_clients.return_value = [{"id": 1, "name": "Client A", "tech_context_raw": raw}, fresh]
+        mock_db.fetch_trends.return_value = [{"title": "Trend 1", "url": "http://t1.com"}]
+
+        digest_response = MagicMock()
+        digest_response.text = json.dumps({"industry": "Retail", "tech_stack": {"cloud": ["Azure"], "backend": ["SAP"]},
+                                           "pain_points": ["Stock lento"], "strategic_goals": []})
+        match_response = MagicMock()
+        match_response.text = '{"match_score": 5, "reasoning": [], "generated_pitch": ""}'
+        matcher.model.generate_content.side_effect = [digest_response, match_response, match_response]
+
+        list(matcher.run_matching_cycle(trend_limit=1))
+
+        # Solo el cliente con texto crudo nuevo se resume
+        mock_db.update_client_digest.assert_called_once()
+        assert mock_db.update_client_digest.call_args[0][0] == 1
+        prompts = [c[0][0] for c in matcher.model.generate_content.call_args_list[1:]]
+        assert "cloud: Azure" in prompts[0] and "Menú Inicio" not in prompts[0]
+        assert "data: Oracle" in prompts[1]
+
+def _cascade_model(triage_scores):
+    """Modelo simulado: responde triage o análisis completo según el prompt"""
+    calls = {"triage": [], "full": []}
+
+    def generate(prompt, generation_config=None):
+        title = next(t for t in triage_scores if t in prompt)
+        response = MagicMock()
+        if "TAREA: Estimar" in prompt:
+            calls["triage"].append(title)
+            response.text = json.dumps({"match_score": triage_scores[title], "reason": "breve"})
+        else:
+            calls["full"].append(title)
+            response.text = json.dumps({"match_score": 75, "reasoning": ["a", "b", "c"], "generated_pitch": f"Pitch {title}"})
+        return response
+    return generate, calls
+
+def test_run_matching_cycle_cascade(mock_db, mock_genai):
+    """Verifica que solo los pares que superan el triage reciban el análisis completo"""
+    with patch.dict(os.environ, {"GEMINI_API_KEY": "fake_key"}):
+        matcher = OpportunityMatcher(cascade=True, triage_threshold=40, use_llm_cache=False)
+
+        mock_db.fetch_clients.return_value = [{"id": 1, "name": "Client A"}]
+        mock_db.fetch_trends.return_value = [{"title": t, "url": f"http://{t}"} for t in ("Alfa", "Beta", "Gamma")]
+        generate, calls = _cascade_model({"Alfa": 80, "Beta": 20, "Gamma": 50})
+        matcher.model.generate_content.side_effect = generate
+
+        events = list(matcher.run_matching_cycle(trend_limit=3))
+        result = [e for e in events if e["type"] == "result"][0]["data"]
+
+        assert calls["triage"] == ["Alfa", "Beta", "Gamma"]
+        assert calls["full"] == ["Alfa", "Gamma"]
+        assert [(r["trend"], r["generated_pitch"]) for r in result] == [("Alfa", "Pitch Alfa"), ("Gamma", "Pitch Gamma")]
+        # El descartado queda en el ledger con su puntaje de triage
+        ledger = mock_db.upsert_match_ledger.call_args[0][0]
+        assert [(r["trend_key"], r["match_score"], r["prompt_version"]) for r in ledger] == [("http://Beta", 20, "triage-v1")]
+
+        # Un descarte del triage solo se omite en corridas con cascada y mientras siga bajo el umbral
+        mock_db.fetch_match_ledger.return_value = ledger
+        beta = [(mock_db.fetch_clients.return_value[0], mock_db.fetch_trends.return_value[1])]
+        assert matcher._pending_pairs(beta)[1] == 1
+        matcher.triage_threshold = 10
+        assert matcher._pending_pairs(beta)[1] == 0
+        matcher.cascade = False
+        assert matcher._pending_pairs(beta)[1] == 0
+
+def test_cascade_top_k_per_client(mock_db, mock_genai):
+    """Verifica que top-K por cliente promueva a los mejores aunque no lleguen al umbral"""
+    with patch.dict(os.environ, {"GEMINI_API_KEY": "fake_key"}):
+        matcher = OpportunityMatcher(cascade=True, triage_threshold=90, triage_top_k=1, use_llm_cache=False)
+
+        mock_db.fetch_clients.return_value = [{"id": 1, "name": "Client A"}, {"id": 2, "name": "Client B"}]
+        mock_db.fetch_trends.return_value = [{"title": t, "url": f"http://{t}"} for t in ("Alfa", "Beta")]
+        generate, calls = _cascade_model({"Alfa": 30, "Beta": 60})
+        matcher.model.generate_content.side_effect = generate
+
+        list(matcher.run_matching_cycle(trend_limit=2))
+
+        assert len(calls["triage"]) == 4
+        assert calls["full"] == ["Beta", "Beta"]
+
+@pytest.mark.parametrize("concurrency", [1, 3])
+def test_stream_pitch_events(mock_db, mock_genai, concurrency):
+    """Verifica los eventos de streaming por par: puntaje y razones antes del pitch, y el pitch completo al final"""
+    with patch.dict(os.environ, {"GEMINI_API_KEY": "fake_key"}):
+        matcher = OpportunityMatcher(stream_pitch=True, max_concurrency=concurrency, use_digest=False, use_llm_cache=False)
+
+        mock_db.fetch_clients.return_value = [{"id": 1, "name": "Client A"}, {"id": 2, "name": "Client B"}]
+        mock_db.fetch_trends.return_value = [{"title": "Trend X", "url": "http://x"}]
+        mock_db.fetch_match_ledger.return_value = []
+        pitch = "Propuesta de PoC con Azure. " * 5
+        text = json.dumps({"match_score": 77, "reasoning": ["Uno", "Dos"], "generated_pitch": pitch})
+
+        def generate(prompt, generation_config=None, stream=False):
+            assert stream
+            return [MagicMock(text=text[i:i + 15]) for i in range(0, len(text), 15)]
+        matcher.model.generate_content.side_effect = generate
+
+        events = list(matcher.run_matching_cycle(trend_limit=1))
+
+        for client in ("Client A", "Client B"):
+            kinds = [e["type"] for e in events if e["type"].startswith("pitch_") and e["data"]["client"] == client]
+            assert kinds[0] == "pitch_start" and kinds[1] == "pitch_score" and kinds[-1] == "pitch_end"
+            assert kinds.index("pitch_reasoning") < kinds.index("pitch_delta")
+            deltas = [e["data"]["delta"] for e in events if e["type"] == "pitch_delta" and e["data"]["client"] == client]
+            assert "".join(deltas) == pitch
+            # Cada evento lleva solo su tramo (no el texto acumulado)
+            assert all("text" not in e["data"] for e in events if e["type"] == "pitch_delta")
+            # El resultado parcial del par llega después de cerrar su streaming
+            end = next(i for i, e in enumerate(events) if e["type"] == "pitch_end" and e["data"]["client"] == client)
+            partial = next(i for i, e in enumerate(events) if e["type"] == "partial" and e["data"]["client"] == client)
+            assert end < partial
+
+        result = events[-1]["data"]
+        assert [r["client"] for r in result] == ["Client A", "Client B"]
+        assert all(r["generated_pitch"] == pitch and r["match_score"] == 77 for r in result)
+
+def test_checkpointed_run_resumes_without_repeating_pairs():
+    """Verifica que una corrida cortada a la mitad se reanude sin repetir llamadas ni duplicar oportunidades"""
+    from benchmark import offline
+    from memory_db import InMemoryDatabase
+
+    clients = [{"id": 1, "name": "Client A", "industry": "Banca"}, {"id": 2, "name": "Client B", "industry": "Salud"}]
+    sources = [{"id": 10, "name": "Fuente", "url": "http://feed", "is_active": True}]
+    trends = [{"title": f"Tendencia {i}", "url": f"http://t/{i}", "summary": "IA aplicada", "source": "Fuente"} for i in range(3)]
+    db = InMemoryDatabase(clients=clients, sources=sources, trends=trends)
+
+    with offline(db) as fake:
+        run_id = db.start_run("matching", {})["id"]
+        events = OpportunityMatcher(use_digest=False).run_matching_cycle(trend_limit=3, incremental=False, run_id=run_id)
+        for _ in events:
+            if (db.fetch_run(run_id).get("progress") or {}).get("done", 0) >= 2:
+                break
+        events.close() # Sesión interrumpida
+        assert fake.stats()["by_kind"]["match"] == 2
+        saved_before = len(db.opportunities)
+
+        matcher = OpportunityMatcher(use_digest=False)
+        events = list(matcher.run_matching_cycle(trend_limit=3, incremental=False, run_id=run_id))
+        matcher.save_opportunities(events[-1]["data"])
+
+        assert fake.stats()["by_kind"]["match"] == 6
+        assert any("Reanudando corrida" in e.get("message", "") for e in events)
+        assert db.fetch_run(run_id)["progress"] == {"total": 6, "done": 6, "opportunities": len(db.opportunities) - saved_before, "errors": 0}
+        assert len(db.fetch_match_ledger(run_id=run_id)) == 6
+        pairs = [(op["client_name"], op["trend_title"]) for op in db.opportunities]
+        assert len(pairs) == len(set(pairs))
+        assert all(op["run_id"] == run_id for op in db.opportunities)
+
+def test_checkpoint_retries_ledger_without_duplicating_opportunity():
+    """Verifica que si falla solo el ledger del checkpoint, la oportunidad no se duplique y el ledger se reintente"""
+    from benchmark import offline
+    from memory_db import InMemoryDatabase
+
+    class FlakyLedgerDatabase(InMemoryDatabase):
+        failures = 2
+
+        def upsert_match_ledger(self, rows, chunk_size=500):
+            if self.failures:
+                self.failures -= 1
+                raise Exception("timeout")
+            return super().upsert_match_ledger(rows, chunk_size)
+
+    clients = [{"id": 1, "name": "Client A", "industry": "Banca"}]
+    sources = [{"id": 10, "name": "Fuente", "url": "http://feed", "is_active": True}]
+    trends = [{"title": f"Tendencia {i}", "url": f"http://t/{i}", "summary": "IA aplicada", "source": "Fuente"} for i in range(3)]
+    db = FlakyLedgerDatabase(clients=clients, sources=sources, trends=trends)
+
+    with offline(db):
+        run_id = db.start_run("matching", {})["id"]
+        matcher = OpportunityMatcher(use_digest=False)
+        events = list(matcher.run_matching_cycle(trend_limit=3, incremental=False, run_id=run_id))
+        matcher.save_opportunities(events[-1]["data"])
+
+    assert len(db.fetch_match_ledger(run_id=run_id)) == 3 # Los dos fallidos se reintentaron al final
+    pairs = [(op["client_name"], op["trend_title"]) for op in db.opportunities]
+    assert events[-1]["data"] and len(pairs) == len(set(pairs)) == len(events[-1]["data"])
+
+@pytest.mark.parametrize("concurrency", [1, 3])
+def test_budgeted_run_evaluates_best_pairs_first(concurrency, tmp_path):
+    """Verifica que el modo anytime evalúe por prioridad y se detenga al agotar el presupuesto de llamadas"""
+    from benchmark import offline
+    from memory_db import InMemoryDatabase
+
+    clients = [{"id": 1, "name": "Client A", "industry": "Banca", "tech_context_raw": "Core bancario en Azure, pagos móviles"},
+               {"id": 2, "name": "Client B", "industry": "Salud", "tech_context_raw": "Historia clínica electrónica"}]
+    sources = [{"id": 10, "name": "Fuente", "url": "http://feed", "is_active": True, "category": "Tecnología"}]
+    trends = [{"title": f"Tendencia genérica {i}", "url": f"http://t/{i}", "summary": "Novedades varias", "source": "Fuente"} for i in range(4)]
+    trends.append({"title": "Pagos móviles en la banca", "url": "http://t/banca", "summary": "Core bancario en Azure para pagos móviles", "source": "Fuente"})
+    db = InMemoryDatabase(clients=clients, sources=sources, trends=trends)
+
+    with offline(db) as fake:
+        matcher = OpportunityMatcher(use_digest=False, max_concurrency=concurrency, cascade=True, batch_clients=True,
+                                     vector_cache_path=str(tmp_path / "vectors.npz"))
+        events = list(matcher.run_matching_cycle(trend_limit=1, incremental=False, max_calls=3))
+
+        assert fake.stats()["by_kind"] == {"match": 3} # Ni triage ni lotes, y nunca más del presupuesto
+        # Pares llamados, según el registro de uso (en paralelo, en orden de término)
+        evaluated = [(call["client_keys"][0], call["trend_key"]) for call in matcher.usage.calls()]
+        assert len(evaluated) == 3
+        assert ("1", "http://t/banca") in evaluated # El par más afín (Client A × banca) entra en el presupuesto
+        if concurrency == 1:
+            assert evaluated[0] == ("1", "http://t/banca") # En secuencia, además, va primero
+        assert any("Presupuesto agotado" in e.get("message", "") and "7 pares sin evaluar" in e["message"] for e in events)
@@ -0,0 +1,62 @@
+import pytest
+import sys
+import os
+from datetime import datetime, timedelta, timezone
+
+# Asegurar que pytest encuentra 'src'
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from priority import MatchBudget, category_score, rank_pairs, recency_score
+from usage import UsageTracker
+
+NOW = datetime(2026, 1, 10, 12, 0, tzinfo=timezone.utc)
+
+def test_recency_score_halves_every_half_life():
+    """Verifica el decaimiento exponencial de la frescura"""
+    assert recency_score(NOW.isoformat(), NOW) == pytest.approx(1.0)
+    assert recency_score((NOW - timedelta(hours=72)).isoformat(), NOW) == pytest.approx(0.5)
+    assert recency_score(None, NOW) == 0.0
+
+def test_category_score():
+    """Verifica la afinidad industria-categoría y la fuente propia del cliente"""
+    client = {"id": 1, "industry": "Banca y Finanzas"}
+    assert category_score(client, {"category": "Finanzas"}) == pytest.approx(0.5)
+    assert category_score(client, {"category": "Salud", "client_id": 1}) == 1.0
+    assert category_score(client, {"category": "Salud"}) == 0.0
+    assert category_score(client, None) == 0.0
+
+def test_rank_pairs_orders_by_priority_and_keeps_ties_stable():
+    """Verifica que los pares afines, recientes y de fuentes de su rubro queden primero"""
+    client = {"id": 1, "industry": "Banca"}
+    old = {"title": "Vieja", "source": "Blog", "published_at": (NOW - timedelta(days=30)).isoformat()}
+    fresh = {"title": "Nueva", "source": "Blog", "published_at": NOW.isoformat()}
+    banking = {"title": "Banca", "source": "Finanzas Hoy", "published_at": (NOW - timedelta(days=30)).isoformat()}
+    pairs = [(client, old), (client, fresh), (client, banking), (client, dict(old))]
+    sources = {"Finanzas Hoy": {"category": "Banca"}, "Blog": {"category": "Tecnología"}}
+
+    ranked = rank_pairs(pairs, lambda c, t: 0.0, sources, now=NOW)
+    assert [index for _, index in ranked] == [1, 2, 0, 3] # Frescura > categoría > nada; empate en orden original
+
+    # La similitud pesa más que la frescura
+    ranked = rank_pairs(pairs[:2], lambda c, t: 1.0 if t is old else 0.0, sources, now=NOW)
+    assert [index for _, index in ranked] == [0, 1]
+
+def test_match_budget_counts_real_calls_and_reservations():
+    """Verifica el tope de llamadas (sin contar aciertos de caché) y de tokens, incluyendo las reservas en vuelo"""
+    usage = UsageTracker()
+    usage.record("match", "m", 100, 50) # Anterior a la corrida: no cuenta
+    budget = MatchBudget(usage, max_calls=2)
+    assert budget.admit(500) and budget.admit(500)
+    assert not budget.admit(500) # Dos en vuelo
+    budget.release(500)
+    usage.record("match", "m", cached=True)
+    assert budget.admit(500)
+    budget.release(500)
+    budget.release(500)
+    usage.record("match", "m", 100, 50)
+    usage.record("match", "m", 100, 50)
+    assert not budget.admit(500)
+    assert budget.state() == {"calls": 2, "tokens": 300, "max_calls": 2, "max_tokens": None}
+
+    budget = MatchBudget(usage, max_tokens=1000)
+    assert budget.admit(600) and not budget.admit(600)
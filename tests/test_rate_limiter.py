@@ -0,0 +1,67 @@
+import pytest
+from unittest.mock import MagicMock
+import sys
+import os
+
+# Asegurar que pytest encuentra 'src'
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from rate_limiter import RateLimiter, is_rate_limit_error, retry_after_seconds
+from llm_client import LLMClient
+
+def test_token_bucket_admission():
+    """Verifica que al agotar el RPM la siguiente llamada espere lo que falta de recarga"""
+    waits = []
+    limiter = RateLimiter(rpm=2, tpm=1_000_000, sleep=waits.append)
+
+    assert limiter.acquire() == 0
+    assert limiter.acquire() == 0
+    wait = limiter.acquire()
+    assert 29 < wait <= 30 # 1 request cada 30s con 2 RPM
+    assert waits == [wait]
+    assert limiter.state()["throttled_calls"] == 1
+
+def test_token_budget_admission():
+    """Verifica el presupuesto de tokens por minuto"""
+    limiter = RateLimiter(rpm=100, tpm=1000, sleep=lambda s: None)
+    assert limiter.acquire(estimated_tokens=1000) == 0
+    assert limiter.acquire(estimated_tokens=500) > 0
+
+def test_penalize_backoff_and_recovery():
+    """Verifica que un 429 reduzca la tasa efectiva y honre retry-after"""
+    limiter = RateLimiter(rpm=10, sleep=lambda s: None)
+    assert limiter.penalize(attempt=0, retry_after=7) == 7
+    state = limiter.state()
+    assert state["effective_rpm"] == 5
+    assert 6 < state["blocked_for"] <= 7
+
+    delay = limiter.penalize(attempt=2)
+    assert 4 <= delay <= 8 # backoff 2*2^2 con jitter
+    limiter.record_success()
+    assert limiter.state()["effective_rpm"] == pytest.approx(3.0)
+
+def test_rate_limit_error_detection():
+    assert is_rate_limit_error(Exception("429 Resource has been exhausted"))
+    assert not is_rate_limit_error(Exception("Invalid JSON"))
+    assert retry_after_seconds(Exception("Please retry in 12.5s")) == 12.5
+
+def test_llm_client_retries_on_429():
+    """Verifica que LLMClient reintente tras un 429 y luego retorne la respuesta"""
+    limiter = RateLimiter(rpm=100, sleep=lambda s: None)
+    model = MagicMock()
+    ok = MagicMock()
+    ok.text = "hola"
+    model.generate_content.side_effect = [Exception("429 quota exceeded"), ok]
+
+    llm = LLMClient(model, use_cache=False, rate_limiter=limiter)
+    assert llm.generate("prompt") == "hola"
+    assert model.generate_content.call_count == 2
+    assert limiter.state()["rate_limited_errors"] == 1
+
+def test_llm_client_does_not_retry_other_errors():
+    limiter = RateLimiter(rpm=100, sleep=lambda s: None)
+    model = MagicMock()
+    model.generate_content.side_effect = Exception("500 internal")
+    with pytest.raises(Exception):
+        LLMClient(model, use_cache=False, rate_limiter=limiter).generate("prompt")
+    assert model.generate_content.call_count == 1
@@ -0,0 +1,103 @@
+import pytest
+from unittest.mock import patch
+import sys
+import os
+
+# Asegurar que pytest encuentra 'src'
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+import scheduler
+from scheduler import RunLock, consume_events
+
+@pytest.fixture
+def mock_db():
+    with patch('scheduler.DatabaseClient') as MockDB:
+        MockDB.return_value.start_run.return_value = {"id": 42}
+        yield MockDB.return_value
+
+def test_run_lock_prevents_overlap(tmp_path):
+    """Verifica que un segundo lock no se pueda tomar mientras el primero está activo"""
+    path = str(tmp_path / "test.lock")
+    first = RunLock(path)
+    second = RunLock(path)
+
+    assert first.acquire()
+    assert not second.acquire()
+    first.release()
+    assert second.acquire()
+    second.release()
+
+def test_run_lock_replaces_stale_lock(tmp_path):
+    """Verifica que un lock abandonado se reemplace"""
+    path = tmp_path / "test.lock"
+    path.write_text("999 old")
+    os.utime(path, (0, 0))
+
+    assert RunLock(str(path), stale_after=60).acquire()
+
+def test_run_lock_heartbeat_keeps_long_run_fresh(tmp_path):
+    """Verifica que el lock en uso renueve su mtime y no se tome como abandonado"""
+    path = str(tmp_path / "test.lock")
+    holder = RunLock(path, stale_after=60, refresh_every=0.01)
+    assert holder.acquire()
+    os.utime(path, (0, 0)) # Como si la corrida llevara horas
+    scheduler.time.sleep(0.1)
+
+    assert not RunLock(path, stale_after=60).acquire()
+    holder.release()
+    assert not os.path.exists(path)
+
+def test_consume_events_collects_result_and_errors():
+    """Verifica el consumo del generador de eventos"""
+    events = iter([
+        {"type": "log", "message": "ok"},
+        {"type": "log", "message": "  ❌ Error leyendo X"},
+        {"type": "result", "data": [1, 2]},
+    ])
+    data, errors = consume_events(events, log=lambda m: None)
+    assert data == [1, 2]
+    assert errors == ["❌ Error leyendo X"]
+
+def test_run_matching_records_run(mock_db):
+    """Verifica que el matching consuma el generador, guarde y registre la corrida"""
+    with patch('scheduler.OpportunityMatcher') as MockMatcher:
+        matcher = MockMatcher.return_value
+        matcher.run_matching_cycle.return_value = iter([{"type": "result", "data": [{"client": "A"}]}])
+
+        status = scheduler.run_matching(client_name="A", trend_limit=3)
+
+    assert status == "completed"
+    matcher.save_opportunities.assert_called_once_with([{"client": "A"}])
+    matcher.save_usage.assert_called_once_with(42)
+    mock_db.start_run.assert_called_once_with("matching", {"client": "A", "trend_limit": 3, "prefilter": False, "concurrency": 1, "batch_clients": False, "incremental": True, "cascade": False,
+                                                          "triage_threshold": 40, "triage_top_k": None, "max_calls": None, "max_tokens": None})
+    assert matcher.run_matching_cycle.call_args.kwargs["run_id"] == 42
+    run_id, run_status, _, items, errors = mock_db.finish_run.call_args[0]
+    assert (run_id, run_status, items, errors) == (42, "completed", 1, [])
+
+def test_resume_matching_reopens_run(mock_db):
+    """Verifica que reanudar reutilice la corrida y sus parámetros originales"""
+    mock_db.fetch_run.return_value = {"id": 7, "kind": "matching", "status": "running",
+                                      "params": {"client": "A", "trend_limit": 4, "cascade": True, "origin": "dashboard"}}
+    with patch('scheduler.OpportunityMatcher') as MockMatcher:
+        matcher = MockMatcher.return_value
+        matcher.run_matching_cycle.return_value = iter([{"type": "result", "data": []}])
+
+        assert scheduler.resume_matching(7) == "completed"
+
+    mock_db.start_run.assert_not_called()
+    mock_db.reopen_run.assert_called_once_with(7)
+    assert MockMatcher.call_args.kwargs["cascade"] is True
+    kwargs = matcher.run_matching_cycle.call_args.kwargs
+    assert (kwargs["specific_client_name"], kwargs["trend_limit"], kwargs["run_id"]) == ("A", 4, 7)
+    assert mock_db.finish_run.call_args[0][:2] == (7, "completed")
+
+def test_run_ingest_failure_is_recorded(mock_db):
+    """Verifica que una excepción marque la corrida como fallida"""
+    with patch('scheduler.InnovationIngestor') as MockIngestor:
+        MockIngestor.return_value.fetch_trends.side_effect = Exception("boom")
+        status = scheduler.run_ingest()
+
+    assert status == "failed"
+    assert mock_db.finish_run.call_args[0][1] == "failed"
+    assert mock_db.finish_run.call_args[0][4] == ["boom"]
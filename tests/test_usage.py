@@ -0,0 +1,95 @@
+import pytest
+from unittest.mock import MagicMock, patch
+import sys
+import os
+
+# Asegurar que pytest encuentra 'src'
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from llm_client import LLMClient, LLMCache
+from usage import UsageTracker, estimate_cost, summarize_calls
+
+@pytest.fixture
+def model():
+    model = MagicMock()
+    model.model_name = "models/gemini-1.5-flash"
+    response = MagicMock()
+    response.text = '{"ok": true}'
+    response.usage_metadata.prompt_token_count = 1200
+    response.usage_metadata.candidates_token_count = 300
+    response.usage_metadata.total_token_count = 1500
+    model.generate_content.return_value = response
+    return model
+
+def test_llm_client_records_usage_metadata(model):
+    """Verifica que cada llamada registre tokens de usage_metadata, costo, sitio y etiquetas"""
+    usage = UsageTracker()
+    llm = LLMClient(model, cache=LLMCache(":memory:"), usage=usage)
+
+    llm.generate("prompt", site="match", tags={"client_keys": [7], "trend_key": "http://t1"})
+    llm.generate("prompt", site="match", tags={"client_keys": [7], "trend_key": "http://t1"}) # Desde caché
+
+    real, cached = usage.calls()
+    assert (real["prompt_tokens"], real["output_tokens"], real["total_tokens"]) == (1200, 300, 1500)
+    assert real["client_keys"] == ["7"] and real["trend_key"] == "http://t1"
+    assert real["cost_usd"] == pytest.approx(estimate_cost("gemini-1.5-flash", 1200, 300))
+    assert real["latency_ms"] is not None and not real["estimated"]
+    assert cached["cached"] and cached["cost_usd"] == 0
+
+def test_llm_client_estimates_without_metadata(model):
+    """Verifica que sin usage_metadata se estimen los tokens por caracteres"""
+    model.generate_content.return_value = MagicMock(text="x" * 400, usage_metadata=None)
+    usage = UsageTracker()
+    LLMClient(model, use_cache=False, usage=usage).generate("p" * 800, site="digest")
+
+    call = usage.calls()[0]
+    assert (call["prompt_tokens"], call["output_tokens"], call["estimated"]) == (200, 100, True)
+
+def test_summarize_calls_by_client_splits_batches():
+    """Verifica que el costo de una llamada por lote se reparta entre sus clientes"""
+    calls = [
+        {"site": "match_batch", "client_keys": ["1", "2"], "prompt_tokens": 1000, "output_tokens": 200, "cost_usd": 0.02, "latency_ms": 900},
+        {"site": "match", "client_keys": ["1"], "prompt_tokens": 500, "output_tokens": 100, "cost_usd": 0.01, "latency_ms": 100},
+        {"site": "match", "client_keys": ["1"], "prompt_tokens": 0, "cached": True, "cost_usd": 0, "latency_ms": 0},
+    ]
+
+    by_client = {row["client"]: row for row in summarize_calls(calls, "client")}
+    by_site = {row["site"]: row for row in summarize_calls(calls, "site")}
+
+    assert by_client["1"]["cost_usd"] == pytest.approx(0.02)
+    assert by_client["2"]["prompt_tokens"] == 500
+    assert by_site["match"]["latency_p95_ms"] == 100 # El acierto de caché no cuenta en la latencia
+    assert by_site["match"]["avg_prompt_tokens"] == 500
+
+def test_flush_keeps_calls_on_failure():
+    """Verifica que un error al persistir no pierda las llamadas registradas"""
+    usage = UsageTracker()
+    usage.record("match", "gemini-pro", 10, 5)
+    db = MagicMock()
+    db.save_llm_calls.side_effect = Exception("timeout")
+
+    with pytest.raises(Exception):
+        usage.flush(db, run_id=3)
+    assert len(usage.calls()) == 1
+
+    db.save_llm_calls.side_effect = None
+    assert usage.flush(db, run_id=3) == 1
+    assert db.save_llm_calls.call_args[0][0][0]["run_id"] == 3
+    assert usage.calls() == []
+
+def test_ingestor_and_context_calls_tag_client_id():
+    """Verifica que relevancia y contexto tecnológico etiqueten el uso con el id del cliente y la URL de la noticia"""
+    from ingestor import InnovationIngestor
+    from matcher import OpportunityMatcher
+
+    with patch.dict(os.environ, {"GEMINI_API_KEY": "fake_key"}), patch('ingestor.genai'), patch('matcher.genai'):
+        ingestor = InnovationIngestor(use_llm_cache=False)
+        matcher = OpportunityMatcher(use_llm_cache=False)
+    ingestor.model.generate_content.return_value = MagicMock(text='{"is_relevant": true, "new_summary": "x"}')
+    matcher.model.generate_content.return_value = MagicMock(text="Perfil")
+
+    ingestor.evaluate_news_with_llm("T", "S", "Codelco", client_id=5, url="http://t/1")
+    matcher.generate_tech_context("Codelco", client_id=5)
+
+    assert [c["client_keys"] for c in ingestor.usage.calls() + matcher.usage.calls()] == [["5"], ["5"]]
+    assert ingestor.usage.calls()[0]["trend_key"] == "http://t/1" # Misma clave de tendencia que el matcher
@@ -0,0 +1,43 @@
+import sys
+import os
+
+# Asegurar que pytest encuentra 'src'
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from vector_index import SimilarityIndex, VectorCache
+
+TRENDS = [
+    {"id": 1, "title": "Azure lanza nuevos servicios de data lake", "summary": "Microsoft Azure amplía su data lake analytics."},
+    {"id": 2, "title": "Robots autónomos en minería", "summary": "Camiones autónomos y sensores IoT para faenas mineras."},
+    {"id": 3, "title": "Nueva app de pagos móviles", "summary": "Billetera digital para banca con pagos instantáneos."},
+]
+CLIENTS = [
+    {"id": 10, "name": "Minera", "industry": "Minería", "tech_context_raw": "Faenas mineras con camiones autónomos, sensores IoT y mantenimiento predictivo."},
+    {"id": 11, "name": "Banco", "industry": "Banca", "tech_context_raw": "Banca digital, pagos móviles, billetera y core bancario."},
+]
+
+def test_select_candidates_top_k():
+    """Verifica que cada cliente reciba primero las tendencias de su dominio"""
+    selection = SimilarityIndex().select_candidates(TRENDS, CLIENTS, top_k=1)
+    assert selection[0][0][0] == 1 # Minera -> robots mineros
+    assert selection[1][0][0] == 2 # Banco -> pagos móviles
+    assert all(len(s) == 1 for s in selection)
+
+def test_select_candidates_threshold():
+    """Verifica el corte por similitud mínima"""
+    selection = SimilarityIndex().select_candidates(TRENDS, CLIENTS, threshold=0.99)
+    assert selection == [[], []]
+
+def test_vector_cache_invalidation(tmp_path):
+    """Verifica que el caché persista vectores y los recalcule si cambia el contenido"""
+    path = str(tmp_path / "vectors.npz")
+    cache = VectorCache(path)
+    first = cache.get("trend:1", "data lake en azure")
+    cache.save()
+
+    reloaded = VectorCache(path)
+    assert (reloaded.get("trend:1", "data lake en azure") == first).all()
+    assert not reloaded._dirty
+    changed = reloaded.get("trend:1", "robots mineros")
+    assert reloaded._dirty
+    assert not (changed == first).all()